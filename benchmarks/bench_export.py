@@ -0,0 +1,79 @@
+"""Benchmark: esportazione PDF/XLSX di un viaggio sintetico da 10.000 elementi.
+
+Misura tempo e picco di memoria (tracemalloc) in due modalità:
+- in memoria: tutte le città già caricate in dati_citta
+- streaming: il documento contiene solo l'indice e le città vengono lette
+  dal backend SQLite una alla volta durante l'esportazione
+
+Uso: python benchmarks/bench_export.py [numero_elementi]
+"""
+
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cities import JAPAN_CITIES, CITY_CATEGORIES
+from storage import SQLiteBackend
+from trip_export import export_pdf, export_xlsx
+
+
+def make_cities(total_items):
+    """Distribuisce total_items elementi su tutte le città e categorie"""
+    cities = {name: {category: {} for category in CITY_CATEGORIES} for name in JAPAN_CITIES}
+    names = list(JAPAN_CITIES)
+    for i in range(total_items):
+        city_name = names[i % len(names)]
+        category = CITY_CATEGORIES[(i // len(names)) % len(CITY_CATEGORIES)]
+        cities[city_name][category][f"{category[:-1]}_{i}"] = {
+            "nome": f"Elemento {i}", "tipo": "Altro", "costo": float(i % 200),
+            "partenza": "Tokyo", "arrivo": "Kyoto", "notti": 1,
+            "check_in_date": "01-04-2025", "check_out_date": "02-04-2025",
+            "orario_apertura": "09:00", "orario_chiusura": "18:00", "note": "x" * 60
+        }
+    return cities
+
+
+def measure(label, export, data, path, city_loader=None):
+    tracemalloc.start()
+    start = time.perf_counter()
+    with open(path, "wb") as output:
+        items = export(data, output, city_loader)
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<28} {items:>7} elementi {elapsed * 1000:9.1f} ms  picco {peak / 1024 / 1024:7.2f} MiB  "
+          f"file {Path(path).stat().st_size / 1024:8.1f} KiB")
+
+
+def main():
+    total_items = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    cities = make_cities(total_items)
+    costi_partenza = {"volo": {"partenza": "Roma", "arrivo": "Tokyo", "totale": 900.0}, "totale_generale": 900.0}
+    in_memory = {"costi_partenza": costi_partenza, "dati_citta": cities}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = SQLiteBackend(f"{tmp}/bench.db")
+        backend.save_cities("bench", cities, "v")
+        streaming = {"costi_partenza": costi_partenza, "dati_citta": {}, "indice_citta": list(cities)}
+
+        def city_loader(city_name):
+            return backend.load_cities("bench", [city_name])[city_name]
+
+        exporters = [("pdf", export_pdf)]
+        try:
+            import openpyxl  # noqa: F401
+            exporters.append(("xlsx", export_xlsx))
+        except ImportError:
+            print("openpyxl non installato: esportazione XLSX saltata")
+
+        for extension, export in exporters:
+            measure(f"{extension} in memoria", export, in_memory, f"{tmp}/mem.{extension}")
+            measure(f"{extension} streaming da SQLite", export, streaming, f"{tmp}/stream.{extension}", city_loader)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,87 @@
+"""Benchmark: anteprime della galleria su una cartella di foto JPEG generate.
+
+- scansione della cartella
+- creazione a freddo di tutte le anteprime (pool di processi) e, per confronto,
+  di un campione nello stesso processo
+- risoluzione a caldo di tutte le anteprime (nessuna foto letta)
+- una pagina della galleria e le 12 foto casuali della Home a caldo
+- nuova scansione dopo la modifica di alcune foto (solo quelle vengono rielaborate)
+
+Uso: python benchmarks/bench_gallery.py [numero foto] [larghezza] [altezza]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from photo_gallery import ThumbnailCache, make_thumbnail, scan_photos  # noqa: E402
+
+
+def create_photo(args):
+    path, width, height, seed = args
+    from PIL import Image
+
+    # Rumore più un gradiente: si comprime come una foto vera e non come un colore pieno
+    noise = Image.effect_noise((width, height), 40 + seed % 30).convert("RGB")
+    gradient = Image.linear_gradient("L").resize((width, height)).convert("RGB")
+    Image.blend(noise, gradient, 0.5).save(path, "JPEG", quality=85)
+
+
+def create_photos(folder, count, width, height):
+    jobs = [(os.path.join(folder, f"sub_{i % 10}", f"foto_{i:05d}.jpg"), width, height, i) for i in range(count)]
+    for sub in range(10):
+        os.makedirs(os.path.join(folder, f"sub_{sub}"), exist_ok=True)
+    with ProcessPoolExecutor() as pool:
+        list(pool.map(create_photo, jobs, chunksize=64))
+
+
+def measure(label, function):
+    start = time.perf_counter()
+    result = function()
+    elapsed = time.perf_counter() - start
+    print(f"{label:<48} {elapsed * 1000:12.1f} ms")
+    return result, elapsed
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    width = int(sys.argv[2]) if len(sys.argv) > 2 else 1600
+    height = int(sys.argv[3]) if len(sys.argv) > 3 else 1200
+
+    with tempfile.TemporaryDirectory() as tmp:
+        photos_dir, cache_dir = os.path.join(tmp, "photos"), os.path.join(tmp, "thumbnails")
+        print(f"Generazione di {count:,} JPEG {width}x{height}...")
+        measure("generazione foto", lambda: create_photos(photos_dir, count, width, height))
+
+        photos, _ = measure("scansione cartella", lambda: scan_photos(photos_dir))
+        sample = photos[:50]
+        _, serial = measure(f"anteprime in questo processo ({len(sample)} foto)", lambda: [
+            make_thumbnail(path, os.path.join(tmp, "serial", f"{i}.jpg")) for i, (path, _, _) in enumerate(sample)
+        ])
+        print(f"{'  stima per tutte le foto':<48} {serial / len(sample) * len(photos) * 1000:12.1f} ms")
+
+        cache = ThumbnailCache(cache_dir)
+        thumbnails, _ = measure(f"anteprime a freddo, pool ({os.cpu_count()} processi)", lambda: cache.ensure(photos))
+        assert len(thumbnails) == len(photos)
+
+        cache = ThumbnailCache(cache_dir)
+        measure("anteprime a caldo (manifest riletto)", lambda: cache.ensure(photos))
+        measure("pagina della galleria (48 foto)", lambda: cache.ensure(photos[480:528]))
+        measure("Home, 12 foto casuali", lambda: cache.ensure(random.sample(photos, 12)))
+
+        changed = random.sample(photos, 20)
+        for path, _, _ in changed:
+            os.utime(path, None)
+        photos, _ = measure("scansione dopo 20 foto modificate", lambda: scan_photos(photos_dir))
+        measure("anteprime dopo 20 foto modificate", lambda: cache.ensure(photos))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""Benchmark: rendering della mappa della Home con e senza cache (24 città attive).
+
+Uso: python benchmarks/bench_map_cache.py [ripetizioni]
+"""
+
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cities import JAPAN_CITIES, get_active_cities
+from japan_map import build_japan_map
+
+
+def make_trip_cities():
+    """Dati di esempio con un alloggio in ognuna delle 24 città"""
+    return {
+        city_name: {"alloggi": {"alloggio_1": {"nome": f"Hotel {city_name}", "costo": 100.0}}}
+        for city_name in JAPAN_CITIES
+    }
+
+
+def run(label, build, active_cities, repeat, render):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        mappa = build(active_cities)
+        if render:
+            mappa.get_root().render()
+    elapsed = (time.perf_counter() - start) / repeat * 1000
+    print(f"{label:<32} {elapsed:8.2f} ms/rerun")
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    active_cities = get_active_cities(make_trip_cities())
+    assert len(active_cities) == 24
+
+    build_japan_map.cache_clear()
+    uncached = build_japan_map.__wrapped__
+    print(f"{len(active_cities)} città attive, {repeat} ripetizioni")
+    run("costruzione senza cache", uncached, active_cities, repeat, render=False)
+    run("costruzione con cache", build_japan_map, active_cities, repeat, render=False)
+    run("costruzione+HTML senza cache", uncached, active_cities, repeat, render=True)
+    run("costruzione+HTML con cache", build_japan_map, active_cities, repeat, render=True)
+
+
+if __name__ == "__main__":
+    main()
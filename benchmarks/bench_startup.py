@@ -0,0 +1,108 @@
+"""Benchmark: tempi di avvio dell'app.
+
+- tempo di importazione a freddo di ogni modulo (un interprete nuovo per modulo)
+- tempo fino al primo rendering di ogni pagina di main(), eseguita con l'AppTest
+  di Streamlit in un interprete nuovo e con il backend JSON su una cartella temporanea
+
+Uso: python benchmarks/bench_startup.py [ripetizioni]
+"""
+
+import json
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+MODULES = [
+    "streamlit", "pandas", "numpy", "folium", "streamlit_folium", "supabase", "openpyxl",
+    "cities", "change_tracking", "trip_cache", "save_queue", "cost_index", "currency",
+    "storage", "city_items", "trip_export", "trip_analytics", "japan_map", "item_import",
+    "tile_cache", "poi_index", "timeline", "route_planner", "photo_gallery", "photo_index",
+]
+
+PAGES = ["Home", "Volo e Assicurazione", "Attività per Città", "Timeline", "Riepilogo Finale", "Galleria Foto"]
+
+IMPORT_SCRIPT = """
+import sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+try:
+    import {module}
+except ImportError:
+    print("-1")
+else:
+    print(time.perf_counter() - start)
+"""
+
+PAGE_SCRIPT = """
+import json, sys, time
+sys.path.insert(0, {root!r})
+from streamlit.testing.v1 import AppTest
+
+app = AppTest.from_file({main!r}, default_timeout=120)
+app.secrets["storage_backend"] = "json"
+app.secrets["json_path"] = {json_path!r}
+app.secrets["async_saves"] = False
+app.session_state["pagina"] = {page!r}
+start = time.perf_counter()
+app.run()
+elapsed = time.perf_counter() - start
+heavy = [name for name in ("pandas", "folium", "streamlit_folium", "supabase") if name in sys.modules]
+print(json.dumps({{"secondi": elapsed, "errori": [str(e.value) for e in app.exception], "moduli": heavy}}))
+"""
+
+
+def run_python(code):
+    result = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, cwd=ROOT)
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else "errore")
+    return result.stdout.strip().splitlines()[-1]
+
+
+def import_times(repeat):
+    print(f"{'modulo':<20} {'import (ms)':>12}")
+    for module in MODULES:
+        times = [float(run_python(IMPORT_SCRIPT.format(root=str(ROOT), module=module))) for _ in range(repeat)]
+        if times[0] < 0:
+            print(f"{module:<20} {'non installato':>12}")
+        else:
+            print(f"{module:<20} {min(times) * 1000:12.1f}")
+
+
+def page_times(repeat):
+    try:
+        import streamlit.testing.v1  # noqa: F401
+    except ImportError:
+        print("streamlit non installato: tempi delle pagine saltati")
+        return
+
+    print(f"\n{'pagina':<24} {'primo rendering (ms)':>20}  moduli pesanti caricati")
+    with tempfile.TemporaryDirectory() as tmp:
+        for page in PAGES:
+            runs = []
+            for i in range(repeat):
+                code = PAGE_SCRIPT.format(
+                    root=str(ROOT), main=str(ROOT / "main.py"), json_path=f"{tmp}/viaggio_{i}.json", page=page
+                )
+                try:
+                    runs.append(json.loads(run_python(code)))
+                except RuntimeError as e:
+                    print(f"{page:<24} errore: {e}")
+                    break
+            if not runs:
+                continue
+            best = min(runs, key=lambda run: run["secondi"])
+            errors = f"  errori: {best['errori']}" if best["errori"] else ""
+            print(f"{page:<24} {best['secondi'] * 1000:20.1f}  {', '.join(best['moduli']) or '-'}{errors}")
+
+
+def main():
+    repeat = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    import_times(repeat)
+    page_times(repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Benchmark: costo di salvataggio e caricamento dei backend locali (SQLite e file JSON).
+
+Uso: python benchmarks/bench_storage.py [elementi_per_categoria]
+"""
+
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from cities import JAPAN_CITIES, CITY_CATEGORIES
+from storage import create_backend
+
+
+def make_cities(items_per_category):
+    """Tutte le città con items_per_category elementi in ogni categoria"""
+    return {
+        city_name: {
+            category: {
+                f"{category[:-1]}_{i}": {"nome": f"{category} {i}", "costo": float(i), "note": "x" * 40}
+                for i in range(1, items_per_category + 1)
+            }
+            for category in CITY_CATEGORIES
+        }
+        for city_name in JAPAN_CITIES
+    }
+
+
+def timed(label, func, repeat=5):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    print(f"{label:<40} {(time.perf_counter() - start) / repeat * 1000:8.2f} ms")
+
+
+def main():
+    items_per_category = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    cities = make_cities(items_per_category)
+    one_city = {"Tokyo": cities["Tokyo"]}
+    total = len(cities) * len(CITY_CATEGORIES) * items_per_category
+    print(f"{len(cities)} città, {total} elementi")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        backends = {
+            "sqlite": create_backend("sqlite", sqlite_path=f"{tmp}/bench.db"),
+            "json": create_backend("json", json_path=f"{tmp}/bench.json"),
+        }
+        for name, backend in backends.items():
+            timed(f"{name}: salvataggio di tutte le città", lambda: backend.save_cities("bench", cities, "v"))
+            timed(f"{name}: salvataggio di una città", lambda: backend.save_cities("bench", one_city, "v"))
+            timed(f"{name}: caricamento di tutte le città", lambda: backend.load_cities("bench"))
+            timed(f"{name}: caricamento di una città", lambda: backend.load_cities("bench", ["Tokyo"]))
+
+
+if __name__ == "__main__":
+    main()
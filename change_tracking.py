@@ -0,0 +1,45 @@
+"""Tracciamento delle modifiche ai dati del viaggio per i salvataggi incrementali"""
+
+
+class ChangeTracker:
+    """Registra quali città, categorie e chiavi degli elementi sono state modificate"""
+
+    def __init__(self):
+        # città -> categoria -> insieme delle chiavi modificate
+        self.cities = {}
+        # True se sono cambiati campi fuori da dati_citta (costi_partenza, budget, link galleria...)
+        self.document = False
+        # True se serve un salvataggio completo del documento
+        self.full = False
+
+    def mark_item(self, city_name: str, category: str, key: str):
+        """Segna come modificato un singolo elemento di una città"""
+        self.cities.setdefault(city_name, {}).setdefault(category, set()).add(key)
+
+    def mark_city(self, city_name: str):
+        """Segna come modificata una città intera (creazione o eliminazione)"""
+        self.cities.setdefault(city_name, {})
+
+    def mark_document(self):
+        """Segna come modificati i campi del documento esterni alle città"""
+        self.document = True
+
+    def mark_full(self):
+        """Richiede il salvataggio completo del documento"""
+        self.full = True
+
+    def dirty_cities(self):
+        """Restituisce l'insieme delle città modificate"""
+        return set(self.cities)
+
+    def changed_keys(self, city_name: str, category: str):
+        """Restituisce le chiavi modificate per una categoria di una città"""
+        return set(self.cities.get(city_name, {}).get(category, set()))
+
+    def is_empty(self):
+        return not (self.cities or self.document or self.full)
+
+    def clear(self):
+        self.cities = {}
+        self.document = False
+        self.full = False
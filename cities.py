@@ -0,0 +1,48 @@
+"""Città del Giappone disponibili nell'app e funzioni di supporto sui dati per città"""
+
+JAPAN_CITIES = {
+    "Tokyo": {"lat": 35.6762, "lon": 139.6503},
+    "Kyoto": {"lat": 35.0116, "lon": 135.7681},
+    "Osaka": {"lat": 34.6937, "lon": 135.5023},
+    "Nara": {"lat": 34.6851, "lon": 135.8048},
+    "Hiroshima": {"lat": 34.3853, "lon": 132.4553},
+    "Sapporo": {"lat": 43.0618, "lon": 141.3545},
+    "Fukuoka": {"lat": 33.5902, "lon": 130.4017},
+    "Kanazawa": {"lat": 36.5944, "lon": 136.6255},
+    "Nagoya": {"lat": 35.1815, "lon": 136.9066},
+    "Kobe": {"lat": 34.6901, "lon": 135.1955},
+    "Takayama": {"lat": 36.1408, "lon": 137.2520},
+    "Hakone": {"lat": 35.2324, "lon": 139.1069},
+    "Nikko": {"lat": 36.7198, "lon": 139.6982},
+    "Kamakura": {"lat": 35.3192, "lon": 139.5467},
+    "Matsumoto": {"lat": 36.2384, "lon": 137.9720},
+    "Kawaguchiko": {"lat": 35.5171, "lon": 138.7510},
+    "Himeji": {"lat": 34.8157, "lon": 134.6854},
+    "Ise": {"lat": 34.4873, "lon": 136.7257},
+    "Sendai": {"lat": 38.2682, "lon": 140.8694},
+    "Nagasaki": {"lat": 32.7503, "lon": 129.8777},
+    "Yokohama": {"lat": 35.4437, "lon": 139.6380},
+    "Takeshima": {"lat": 34.2891, "lon": 133.0182},
+    "Miyajima": {"lat": 34.2971, "lon": 132.3197},
+    "Koyasan": {"lat": 34.2130, "lon": 135.5855}
+}
+
+# Categorie di elementi gestite per ogni città
+CITY_CATEGORIES = ["alloggi", "ristoranti", "negozi", "attivita", "trasporti"]
+
+# Etichette delle categorie mostrate nei riepiloghi
+CATEGORY_LABELS = {
+    "alloggi": "Alloggi",
+    "ristoranti": "Ristoranti",
+    "negozi": "Negozi",
+    "attivita": "Attività",
+    "trasporti": "Trasporti"
+}
+
+
+def get_active_cities(dati_citta: dict):
+    """Restituisce, nell'ordine di JAPAN_CITIES, le città con almeno un elemento"""
+    return tuple(
+        city_name for city_name in JAPAN_CITIES
+        if any(dati_citta.get(city_name, {}).get(category) for category in CITY_CATEGORIES)
+    )
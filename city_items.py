@@ -0,0 +1,187 @@
+"""Schemi degli elementi per categoria, validazione e inserimento in blocco nelle città"""
+
+import csv
+from datetime import date, datetime, time
+
+from cost_index import index_add_item
+from currency import parse_currency
+
+# Opzioni dei menu "Tipo" dei form di inserimento
+TYPE_OPTIONS = {
+    "alloggi": ["Hotel", "Ryokan", "Capsule", "Ostello", "Altro"],
+    "ristoranti": ["Tradizionale", "Ramen", "Sushi", "Izakaya", "Street Food", "Teppanyaki", "Altro"],
+    "negozi": ["Manga", "Cucina", "Cibo", "Elettronica", "Abbigliamento", "Souvenir", "Altro"],
+    "attivita": ["Museo", "Tempio", "Parco", "Evento", "Tour guidato", "Onsen", "Shopping", "Altro"],
+    "trasporti": ["Shinkansen", "Treno Locale", "Autobus", "Metro", "Taxi", "Altro"],
+}
+
+# Campi di ogni categoria, come costruiti dai form input_*: (nome campo, tipo)
+ITEM_SCHEMAS = {
+    "alloggi": [
+        ("nome", "testo"), ("tipo", "tipo"), ("indirizzo", "testo"), ("lat", "coordinata"),
+        ("lon", "coordinata"), ("link_booking", "testo"), ("numero_conferma", "testo"),
+        ("codice_pin", "testo"), ("check_in_date", "data"),
+        ("orario_check_in", "testo"), ("check_out_date", "data"), ("orario_check_out", "testo"),
+        ("notti", "intero"), ("costo", "numero"), ("valuta", "valuta"), ("note", "testo"),
+    ],
+    "ristoranti": [
+        ("nome", "testo"), ("tipo", "tipo"), ("quartiere", "testo"), ("stazione", "testo"),
+        ("lat", "coordinata"), ("lon", "coordinata"), ("orario_apertura", "ora"), ("orario_chiusura", "ora"),
+        ("data_visita", "data_facoltativa"), ("orario_visita", "ora_facoltativa"), ("durata_minuti", "durata"),
+        ("link", "testo"), ("costo", "numero"), ("valuta", "valuta"), ("prenotazione", "booleano"), ("note", "testo"),
+    ],
+    "negozi": [
+        ("nome", "testo"), ("tipo", "tipo"), ("quartiere", "testo"), ("stazione", "testo"),
+        ("lat", "coordinata"), ("lon", "coordinata"), ("orario_apertura", "ora"), ("orario_chiusura", "ora"),
+        ("data_visita", "data_facoltativa"), ("orario_visita", "ora_facoltativa"), ("durata_minuti", "durata"),
+        ("link", "testo"), ("costo", "numero"), ("valuta", "valuta"), ("note", "testo"),
+    ],
+    "attivita": [
+        ("nome", "testo"), ("tipo", "tipo"), ("quartiere", "testo"), ("stazione", "testo"),
+        ("lat", "coordinata"), ("lon", "coordinata"), ("orario_apertura", "ora"), ("orario_chiusura", "ora"),
+        ("data_visita", "data_facoltativa"), ("orario_visita", "ora_facoltativa"), ("durata_minuti", "durata"),
+        ("link", "testo"), ("costo", "numero"), ("valuta", "valuta"), ("prenotazione", "booleano"), ("note", "testo"),
+    ],
+    "trasporti": [
+        ("partenza", "testo"), ("arrivo", "testo"), ("tipo", "tipo"), ("costo", "numero"), ("valuta", "valuta"), ("note", "testo"),
+    ],
+}
+
+# Separatori accettati per le tabelle: senza limiti il Sniffer può scegliere una lettera (es. colonna singola "nome")
+DELIMITERS = "\t;,"
+
+
+def sniff_delimiter(sample: str):
+    """Separatore del testo tra tabulazione, punto e virgola e virgola; tabulazione se non si riconosce"""
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=DELIMITERS).delimiter
+    except csv.Error:
+        return "\t"
+
+
+_TRUE_VALUES = {"1", "true", "si", "sì", "yes", "x", "vero"}
+
+
+def _is_empty(value):
+    return value is None or value != value or (isinstance(value, str) and not value.strip())
+
+
+def _parse_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in ("%d-%m-%Y", "%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data non valida: {text}")
+
+
+def _parse_time(value):
+    if isinstance(value, time):
+        return value
+    if isinstance(value, datetime):
+        return value.time()
+    text = str(value).strip()
+    for fmt in ("%H:%M", "%H:%M:%S", "%H.%M"):
+        try:
+            return datetime.strptime(text, fmt).time()
+        except ValueError:
+            pass
+    raise ValueError(f"orario non valido: {text}")
+
+
+def normalize_item(category: str, row: dict):
+    """Converte una riga (da griglia, tabella incollata o file) in un elemento della categoria.
+
+    Restituisce (elemento, errori): l'elemento è None se la riga non è valida.
+    """
+    item, errors = {}, []
+    for field, kind in ITEM_SCHEMAS[category]:
+        value = row.get(field)
+        empty = _is_empty(value)
+        try:
+            if kind == "testo":
+                item[field] = "" if empty else str(value).strip()
+            elif kind == "tipo":
+                text = "Altro" if empty else str(value).strip()
+                options = {option.lower(): option for option in TYPE_OPTIONS[category]}
+                if text.lower() not in options:
+                    raise ValueError(f"tipo '{text}' non previsto")
+                item[field] = options[text.lower()]
+            elif kind == "numero":
+                text = "0" if empty else str(value).replace("€", "").strip()
+                # Accetta sia "1.234,50" sia "1,234.50"
+                if "," in text and "." in text:
+                    text = text.replace(".", "").replace(",", ".") if text.rfind(",") > text.rfind(".") else text.replace(",", "")
+                item[field] = float(text.replace(",", "."))
+                if item[field] < 0:
+                    raise ValueError("valore negativo")
+            elif kind == "coordinata":
+                # Facoltative: latitudine e longitudine in gradi decimali
+                item[field] = None if empty else float(str(value).replace(",", ".").strip())
+                limit = 90 if field == "lat" else 180
+                if item[field] is not None and not -limit <= item[field] <= limit:
+                    raise ValueError(f"fuori dall'intervallo ±{limit}")
+            elif kind == "valuta":
+                item[field] = parse_currency(value)
+            elif kind == "intero":
+                item[field] = 1 if empty else int(float(value))
+            elif kind == "booleano":
+                item[field] = False if empty else (value if isinstance(value, bool) else str(value).strip().lower() in _TRUE_VALUES)
+            elif kind == "data":
+                item[field] = (date.today() if empty else _parse_date(value)).strftime("%d-%m-%Y")
+            elif kind == "ora":
+                item[field] = (time(0, 0) if empty else _parse_time(value)).strftime("%H:%M")
+            elif kind == "data_facoltativa":
+                item[field] = None if empty else _parse_date(value).strftime("%d-%m-%Y")
+            elif kind == "ora_facoltativa":
+                item[field] = None if empty else _parse_time(value).strftime("%H:%M")
+            elif kind == "durata":
+                # Minuti della visita; vuota vale la durata predefinita della timeline
+                item[field] = None if empty else int(float(value))
+                if item[field] is not None and item[field] <= 0:
+                    raise ValueError("durata non positiva")
+        except (TypeError, ValueError) as e:
+            errors.append(f"{field}: {e}")
+
+    if category == "trasporti":
+        if not item.get("partenza") and not item.get("arrivo"):
+            errors.append("partenza o arrivo obbligatori")
+    elif not item.get("nome"):
+        errors.append("nome obbligatorio")
+    return (None if errors else item), errors
+
+
+def allocate_item_keys(city_data: dict, category: str, count: int):
+    """Riserva count chiavi consecutive usando il contatore salvato nella città.
+
+    Il contatore viene inizializzato una sola volta dalle chiavi esistenti e non
+    diminuisce con le eliminazioni, quindi le chiavi non vengono riutilizzate.
+    """
+    prefix = f"{category[:-1]}_"
+    counters = city_data.setdefault("contatori", {})
+    if category not in counters:
+        numbers = [
+            int(key.split('_')[-1]) for key in city_data.get(category, {})
+            if key.startswith(prefix) and key.split('_')[-1].isdigit()
+        ]
+        counters[category] = max(numbers, default=0)
+    start = counters[category]
+    counters[category] = start + count
+    return [f"{prefix}{number}" for number in range(start + 1, start + count + 1)]
+
+
+def add_items(data: dict, city_name: str, category: str, items: list, changes):
+    """Aggiunge più elementi a una città aggiornando indice dei costi e modifiche da salvare"""
+    city_data = data["dati_citta"][city_name]
+    city_data.setdefault(category, {})
+    keys = allocate_item_keys(city_data, category, len(items))
+    for key, item in zip(keys, items):
+        city_data[category][key] = item
+        index_add_item(data, city_name, category, item)
+        changes.mark_item(city_name, category, key)
+    return keys
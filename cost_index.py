@@ -0,0 +1,175 @@
+"""Indice dei costi per città e categoria, aggiornato a ogni inserimento ed eliminazione.
+
+L'indice è salvato nel documento del viaggio dentro il blocco "budget":
+- suddivisione_per_categoria: {categoria: totale} su tutte le città
+- suddivisione_per_citta: {città: {categoria: {"totale": ..., "elementi": ..., "valute": {...}}}}
+- suddivisione_per_valuta: {valuta: {categoria: importo}} per le valute diverse dall'euro
+
+I totali sono importi originali non convertiti: "totale" somma gli elementi in euro,
+"valute" gli importi nelle altre valute. La conversione avviene alla lettura con
+la tabella dei tassi, così l'indice non dipende dal tasso di cambio.
+"""
+
+from cities import JAPAN_CITIES, CITY_CATEGORIES
+from currency import BASE_CURRENCY, item_currency
+
+
+def _item_cost(item):
+    return float(item.get("costo", 0) or 0) if isinstance(item, dict) else 0.0
+
+
+def _item_currency(item):
+    return item_currency(item) if isinstance(item, dict) else BASE_CURRENCY
+
+
+def _empty_city_entry():
+    return {category: {"totale": 0.0, "elementi": 0} for category in CITY_CATEGORIES}
+
+
+def _budget(data):
+    budget = data.setdefault("budget", {})
+    budget.setdefault("suddivisione_per_categoria", {category: 0 for category in CITY_CATEGORIES})
+    budget.setdefault("suddivisione_per_citta", {})
+    budget.setdefault("suddivisione_per_valuta", {})
+    return budget
+
+
+def _add_amount(entry: dict, currency: str, amount: float):
+    """Somma un importo nel totale in euro o nella valuta corrispondente di una voce dell'indice"""
+    if currency == BASE_CURRENCY:
+        entry["totale"] = round(entry["totale"] + amount, 2)
+        return
+    valute = entry.setdefault("valute", {})
+    valute[currency] = round(valute.get(currency, 0) + amount, 2)
+    if not valute[currency]:
+        del valute[currency]
+    if not valute:
+        del entry["valute"]
+
+
+def build_cost_index(dati_citta: dict):
+    """Calcola da zero l'indice dei costi a partire dagli elementi delle città"""
+    per_categoria = {category: 0.0 for category in CITY_CATEGORIES}
+    per_valuta = {}
+    per_citta = {}
+    for city_name, city_data in dati_citta.items():
+        entry = _empty_city_entry()
+        for category in CITY_CATEGORIES:
+            items = city_data.get(category) or {}
+            amounts = {}
+            for item in items.values():
+                currency = _item_currency(item)
+                amounts[currency] = amounts.get(currency, 0.0) + _item_cost(item)
+            entry[category] = {"totale": round(amounts.pop(BASE_CURRENCY, 0.0), 2), "elementi": len(items)}
+            per_categoria[category] += entry[category]["totale"]
+            valute = {currency: round(amount, 2) for currency, amount in amounts.items() if round(amount, 2)}
+            if valute:
+                entry[category]["valute"] = valute
+                for currency, amount in valute.items():
+                    per_valuta.setdefault(currency, {}).setdefault(category, 0.0)
+                    per_valuta[currency][category] += amount
+        if any(entry[category]["elementi"] for category in CITY_CATEGORIES):
+            per_citta[city_name] = entry
+    per_categoria = {category: round(totale, 2) for category, totale in per_categoria.items()}
+    per_valuta = {
+        currency: {category: round(amount, 2) for category, amount in amounts.items()}
+        for currency, amounts in per_valuta.items()
+    }
+    return per_categoria, per_citta, per_valuta
+
+
+def rebuild_cost_index(data: dict):
+    """Ricostruisce l'indice dei costi dagli elementi grezzi e lo salva nel documento"""
+    budget = _budget(data)
+    per_categoria, per_citta, per_valuta = build_cost_index(data.get("dati_citta", {}))
+    budget["suddivisione_per_categoria"] = per_categoria
+    budget["suddivisione_per_citta"] = per_citta
+    budget["suddivisione_per_valuta"] = per_valuta
+    return data
+
+
+def check_cost_index(data: dict, tolerance: float = 0.01):
+    """Confronta l'indice salvato con quello ricalcolato e restituisce le differenze trovate"""
+    budget = data.get("budget", {})
+    stored_categorie = budget.get("suddivisione_per_categoria", {})
+    stored_citta = budget.get("suddivisione_per_citta")
+    if stored_citta is None:
+        return ["indice dei costi assente"]
+
+    per_categoria, per_citta, per_valuta = build_cost_index(data.get("dati_citta", {}))
+    stored_valute = budget.get("suddivisione_per_valuta", {})
+    errors = []
+    for category, totale in per_categoria.items():
+        if abs(stored_categorie.get(category, 0) - totale) > tolerance:
+            errors.append(f"{category}: totale {stored_categorie.get(category, 0)} invece di {totale}")
+    for currency in set(per_valuta) | set(stored_valute):
+        for category in CITY_CATEGORIES:
+            expected_amount = per_valuta.get(currency, {}).get(category, 0)
+            stored_amount = stored_valute.get(currency, {}).get(category, 0)
+            if abs(stored_amount - expected_amount) > tolerance:
+                errors.append(f"{category}: totale {currency} {stored_amount} invece di {expected_amount}")
+    for city_name in set(per_citta) | set(stored_citta):
+        expected = per_citta.get(city_name, _empty_city_entry())
+        stored = stored_citta.get(city_name, _empty_city_entry())
+        for category in CITY_CATEGORIES:
+            stored_entry = stored.get(category, {"totale": 0, "elementi": 0})
+            if stored_entry["elementi"] != expected[category]["elementi"]:
+                errors.append(f"{city_name}/{category}: {stored_entry['elementi']} elementi invece di {expected[category]['elementi']}")
+            if abs(stored_entry["totale"] - expected[category]["totale"]) > tolerance:
+                errors.append(f"{city_name}/{category}: totale {stored_entry['totale']} invece di {expected[category]['totale']}")
+            expected_valute = expected[category].get("valute", {})
+            stored_valute_city = stored_entry.get("valute", {})
+            for currency in set(expected_valute) | set(stored_valute_city):
+                if abs(stored_valute_city.get(currency, 0) - expected_valute.get(currency, 0)) > tolerance:
+                    errors.append(
+                        f"{city_name}/{category}: totale {currency} {stored_valute_city.get(currency, 0)} "
+                        f"invece di {expected_valute.get(currency, 0)}"
+                    )
+    return errors
+
+
+def ensure_cost_index(data: dict):
+    """Crea l'indice per i documenti salvati prima della sua introduzione"""
+    budget = data.get("budget", {})
+    if "suddivisione_per_citta" not in budget:
+        rebuild_cost_index(data)
+    elif "suddivisione_per_valuta" not in budget:
+        # Indice precedente alle valute: tutti gli elementi erano in euro
+        budget["suddivisione_per_valuta"] = {}
+    return data
+
+
+def _update(data, city_name, category, item, sign):
+    budget = _budget(data)
+    cost = _item_cost(item)
+    currency = _item_currency(item)
+    entry = budget["suddivisione_per_citta"].setdefault(city_name, _empty_city_entry())
+    _add_amount(entry[category], currency, sign * cost)
+    entry[category]["elementi"] += sign
+    if currency == BASE_CURRENCY:
+        budget["suddivisione_per_categoria"][category] = round(
+            budget["suddivisione_per_categoria"].get(category, 0) + sign * cost, 2
+        )
+    else:
+        per_valuta = budget["suddivisione_per_valuta"].setdefault(currency, {})
+        per_valuta[category] = round(per_valuta.get(category, 0) + sign * cost, 2)
+    if not any(entry[c]["elementi"] for c in CITY_CATEGORIES):
+        del budget["suddivisione_per_citta"][city_name]
+
+
+def index_add_item(data: dict, city_name: str, category: str, item: dict):
+    """Aggiorna l'indice dopo l'aggiunta di un elemento"""
+    _update(data, city_name, category, item, 1)
+
+
+def index_remove_item(data: dict, city_name: str, category: str, item: dict):
+    """Aggiorna l'indice dopo l'eliminazione di un elemento"""
+    _update(data, city_name, category, item, -1)
+
+
+def indexed_active_cities(data: dict):
+    """Città con almeno un elemento, nell'ordine di JAPAN_CITIES, lette dall'indice"""
+    per_citta = data.get("budget", {}).get("suddivisione_per_citta", {})
+    return tuple(city_name for city_name in JAPAN_CITIES if city_name in per_citta) + \
+        tuple(city_name for city_name in per_citta if city_name not in JAPAN_CITIES)
+
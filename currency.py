@@ -0,0 +1,227 @@
+"""Valute degli elementi e tabella dei tassi di cambio indicizzata per data.
+
+I tassi sono espressi come unità di valuta per 1 EUR (es. JPY 160.0) e vengono
+letti da un file CSV locale (colonne data, valuta, tasso) e dallo storico salvato
+nel documento del viaggio (data["tassi_cambio"]). Le conversioni lavorano su
+array interi: con una sola data ogni valuta distinta viene convertita con un solo
+fattore, con una data per importo i tassi vengono cercati tutti insieme. Ogni
+elemento è convertito al tasso della sua data (check-in o visita) oppure, se non
+ne ha una, a quello della data di partenza del viaggio.
+numpy e pandas vengono importati solo alla prima tabella dei tassi creata,
+così le pagine che formattano importi non li caricano.
+"""
+
+import hashlib
+import json
+import os
+from datetime import date, datetime
+from functools import lru_cache
+
+BASE_CURRENCY = "EUR"
+CURRENCIES = ["EUR", "JPY"]
+CURRENCY_SYMBOLS = {"EUR": "€", "JPY": "¥"}
+DEFAULT_RATES = {"JPY": 160.0}
+
+# Modi alternativi di indicare le valute nei file importati
+CURRENCY_ALIASES = {"€": "EUR", "EURO": "EUR", "¥": "JPY", "YEN": "JPY", "円": "JPY"}
+
+
+def parse_currency(value):
+    """Codice della valuta dal testo (EUR se vuoto); ValueError se non gestita"""
+    if value is None or value != value or not str(value).strip():
+        return BASE_CURRENCY
+    text = str(value).strip().upper()
+    text = CURRENCY_ALIASES.get(text, text)
+    if text not in CURRENCIES:
+        raise ValueError(f"valuta '{value}' non prevista")
+    return text
+
+
+def item_currency(item: dict):
+    """Valuta di un elemento: quelli salvati prima delle valute sono in euro"""
+    return item.get("valuta") or BASE_CURRENCY
+
+
+def item_date(item: dict):
+    """Data della spesa di un elemento (check-in o visita, "gg-mm-aaaa"), oppure None"""
+    return item.get("check_in_date") or item.get("data_visita") or None
+
+
+def trip_date(data: dict):
+    """Data di partenza del volo, usata per gli importi senza data; None se manca o non è valida"""
+    volo = data.get("costi_partenza", {}).get("volo")
+    if not isinstance(volo, dict) or not volo.get("data_partenza"):
+        return None
+    try:
+        return _to_date(volo["data_partenza"])
+    except ValueError:
+        return None
+
+
+def format_amount(amount, currency: str = BASE_CURRENCY):
+    """Importo con il simbolo della valuta (lo yen non ha decimali)"""
+    amount = float(amount or 0)
+    if currency == "JPY":
+        return f"¥{amount:,.0f}"
+    return f"{CURRENCY_SYMBOLS.get(currency, currency + ' ')}{amount:,.2f}"
+
+
+def _to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    text = str(value).strip()
+    for fmt in ("%Y-%m-%d", "%d-%m-%Y", "%d/%m/%Y"):
+        try:
+            return datetime.strptime(text, fmt).date()
+        except ValueError:
+            pass
+    raise ValueError(f"data non valida: {text}")
+
+
+class RateTable:
+    """Tassi di cambio per valuta ordinati per data, con ricerca binaria della data richiesta.
+
+    snapshot identifica il contenuto della tabella: due tabelle con gli stessi tassi
+    hanno lo stesso snapshot, quindi i totali convertiti possono essere riutilizzati.
+    """
+
+    def __init__(self, records):
+        # records: iterabile di (data, valuta, tasso); a parità di data vale l'ultimo
+        import numpy as np
+
+        by_currency = {}
+        for day, currency, rate in records:
+            currency = parse_currency(currency)
+            if currency == BASE_CURRENCY or not rate or float(rate) <= 0:
+                continue
+            by_currency.setdefault(currency, {})[_to_date(day)] = float(rate)
+
+        self._dates, self._rates = {}, {}
+        for currency, rates in by_currency.items():
+            days = sorted(rates)
+            self._dates[currency] = np.array(days, dtype="datetime64[D]")
+            self._rates[currency] = np.array([rates[day] for day in days], dtype=np.float64)
+
+        content = {
+            currency: [[str(day), rate] for day, rate in zip(self._dates[currency], self._rates[currency])]
+            for currency in sorted(self._dates)
+        }
+        self.snapshot = hashlib.sha1(json.dumps(content).encode()).hexdigest()
+
+    def currencies(self):
+        return [BASE_CURRENCY] + sorted(self._dates)
+
+    def rate(self, currency: str, on=None):
+        """Tasso valido alla data indicata (l'ultimo disponibile se on è None).
+
+        Per date precedenti al primo tasso noto viene usato il primo tasso.
+        """
+        if currency == BASE_CURRENCY:
+            return 1.0
+        if currency not in self._dates:
+            raise KeyError(f"Tasso di cambio non disponibile per {currency}")
+        if on is None:
+            return float(self._rates[currency][-1])
+        import numpy as np
+
+        position = np.searchsorted(self._dates[currency], np.datetime64(_to_date(on), "D"), side="right") - 1
+        return float(self._rates[currency][max(position, 0)])
+
+    def factors(self, currencies, on=None):
+        """Fattori di conversione verso l'euro, uno per valuta"""
+        import numpy as np
+
+        return np.array([1.0 / self.rate(currency, on) for currency in currencies], dtype=np.float64)
+
+    def rates_on(self, currency: str, days):
+        """Tassi di una valuta per un array di date datetime64 (NaT: ultimo tasso disponibile)"""
+        import numpy as np
+
+        days = np.asarray(days, dtype="datetime64[D]")
+        if currency == BASE_CURRENCY:
+            return np.ones(len(days), dtype=np.float64)
+        if currency not in self._dates:
+            raise KeyError(f"Tasso di cambio non disponibile per {currency}")
+        positions = np.searchsorted(self._dates[currency], days, side="right") - 1
+        positions = np.where(np.isnat(days), len(self._dates[currency]) - 1, np.maximum(positions, 0))
+        return self._rates[currency][positions]
+
+    def to_base(self, amounts, currencies, on=None):
+        """Converte in euro un array di importi dato l'array delle rispettive valute.
+
+        on è una data unica (None per l'ultimo tasso) oppure un array datetime64 con la
+        data di ogni importo.
+        """
+        import numpy as np
+        import pandas as pd
+
+        amounts = np.asarray(amounts, dtype=np.float64)
+        codes, uniques = pd.factorize(np.asarray(currencies, dtype=object))
+        if not len(uniques):
+            return amounts.copy()
+        if on is None or np.ndim(on) == 0:
+            return amounts * self.factors(uniques, on)[codes]
+        days = np.asarray(on, dtype="datetime64[D]")
+        rates = np.empty(len(amounts), dtype=np.float64)
+        for position, currency in enumerate(uniques):
+            mask = codes == position
+            rates[mask] = self.rates_on(currency, days[mask])
+        return amounts / rates
+
+    def convert(self, amount, currency: str, on=None):
+        """Converte in euro un singolo importo al tasso della data indicata"""
+        return float(amount or 0) / self.rate(currency, on)
+
+
+def record_rate(data: dict, currency: str, rate: float, on=None):
+    """Aggiunge (o sostituisce per la stessa data) un tasso nello storico del viaggio"""
+    day = (on or date.today()).strftime("%Y-%m-%d")
+    history = [
+        entry for entry in data.get("tassi_cambio", [])
+        if not (entry.get("data") == day and entry.get("valuta") == currency)
+    ]
+    history.append({"data": day, "valuta": currency, "tasso": float(rate)})
+    data["tassi_cambio"] = sorted(history, key=lambda entry: (entry["valuta"], entry["data"]))
+    return data
+
+
+@lru_cache(maxsize=16)
+def _cached_table(path, mtime, history, fallback):
+    records = list(history)
+    if path is not None:
+        import pandas as pd
+
+        frame = pd.read_csv(path, dtype={"valuta": str})
+        records = list(zip(frame["data"], frame["valuta"], frame["tasso"])) + records
+    table = RateTable(records)
+    missing = [currency for currency in CURRENCIES if currency not in table.currencies()]
+    if missing:
+        # Valute senza tassi: tasso manuale del viaggio o valore predefinito
+        day = date.today()
+        table = RateTable(records + [
+            (day, currency, fallback if currency == "JPY" and fallback else DEFAULT_RATES[currency])
+            for currency in missing
+        ])
+    return table
+
+
+def load_rate_table(data: dict, path: str = "data/tassi_cambio.csv"):
+    """Tabella dei tassi dal file locale e dallo storico del viaggio.
+
+    La tabella viene riletta solo se il file o lo storico cambiano; senza tassi per
+    lo yen si usa il tasso manuale dei costi pre-partenza.
+    """
+    mtime = None
+    if path and os.path.exists(path):
+        mtime = os.path.getmtime(path)
+    else:
+        path = None
+    history = tuple(
+        (entry["data"], entry["valuta"], entry["tasso"])
+        for entry in data.get("tassi_cambio", [])
+    )
+    altro = data.get("costi_partenza", {}).get("altro")
+    fallback = altro.get("tasso_cambio") if isinstance(altro, dict) else None
+    return _cached_table(path, mtime, history, fallback)
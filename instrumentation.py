@@ -0,0 +1,159 @@
+"""Timer e contatori leggeri per i punti caldi dell'app.
+
+Le misure finiscono in un archivio in memoria condiviso dal processo, che tiene
+solo le ultime durate di ogni timer, e nel profilo del rerun in corso del thread
+che le ha prodotte. Con la profilazione disattivata timed() e timer() controllano
+solo un flag e non misurano nulla.
+"""
+
+import json
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager, nullcontext
+from functools import wraps
+
+_NULL_TIMER = nullcontext()
+
+
+class MetricsStore:
+    """Ultime durate per timer (in secondi), totali cumulativi e contatori, protetti da un lock"""
+
+    def __init__(self, window: int = 500):
+        self.enabled = False
+        self.window = window
+        self._timings = {}
+        # Per timer: [secondi totali, numero di misure] dall'avvio, non limitati dalla finestra
+        self._totals = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def record(self, name: str, seconds: float):
+        with self._lock:
+            timings = self._timings.get(name)
+            if timings is None:
+                timings = self._timings[name] = deque(maxlen=self.window)
+            timings.append(seconds)
+            totals = self._totals.setdefault(name, [0.0, 0])
+            totals[0] += seconds
+            totals[1] += 1
+        rerun = getattr(self._local, "rerun", None)
+        if rerun is not None:
+            rerun.append((name, seconds))
+
+    def count(self, name: str, value: int = 1):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def begin_rerun(self):
+        """Inizia a raccogliere le misure del rerun del thread corrente"""
+        self._local.rerun = [] if self.enabled else None
+
+    def end_rerun(self):
+        """Restituisce le misure del rerun del thread corrente, nell'ordine di chiusura"""
+        rerun, self._local.rerun = getattr(self._local, "rerun", None), None
+        return rerun or []
+
+    def reset(self):
+        with self._lock:
+            self._timings.clear()
+            self._totals.clear()
+            self._counters.clear()
+
+    def summary(self):
+        """Per ogni timer: numero di misure, totale, media, p50, p95 e massimo in millisecondi"""
+        with self._lock:
+            timings = {name: sorted(values) for name, values in self._timings.items()}
+            counters = dict(self._counters)
+        result = {}
+        for name, values in sorted(timings.items()):
+            n = len(values)
+            result[name] = {
+                "misure": n,
+                "totale_ms": sum(values) * 1000,
+                "media_ms": sum(values) / n * 1000,
+                "p50_ms": values[(n - 1) // 2] * 1000,
+                "p95_ms": values[min(n - 1, int(n * 0.95))] * 1000,
+                "max_ms": values[-1] * 1000,
+            }
+        return result, counters
+
+    def to_json(self):
+        timers, counters = self.summary()
+        return json.dumps({"timer": timers, "contatori": counters}, indent=2)
+
+    def to_prometheus(self):
+        """Testo nel formato di esposizione di Prometheus (summary con quantili e counter).
+
+        I quantili sono calcolati sulla finestra delle ultime durate, _sum e _count sui
+        totali cumulativi, come richiesto da Prometheus per rate() e increase().
+        """
+        timers, counters = self.summary()
+        with self._lock:
+            totals = {name: tuple(values) for name, values in self._totals.items()}
+        lines = []
+        if timers:
+            lines += [
+                "# HELP app_timer_seconds Durata delle sezioni strumentate",
+                "# TYPE app_timer_seconds summary",
+            ]
+            for name, stats in timers.items():
+                label = f'name="{_escape_label(name)}"'
+                lines.append(f'app_timer_seconds{{{label},quantile="0.5"}} {stats["p50_ms"] / 1000:.6f}')
+                lines.append(f'app_timer_seconds{{{label},quantile="0.95"}} {stats["p95_ms"] / 1000:.6f}')
+                total_seconds, total_count = totals[name]
+                lines.append(f'app_timer_seconds_sum{{{label}}} {total_seconds:.6f}')
+                lines.append(f'app_timer_seconds_count{{{label}}} {total_count}')
+        if counters:
+            lines += ["# HELP app_events_total Contatori degli eventi", "# TYPE app_events_total counter"]
+            for name, value in sorted(counters.items()):
+                lines.append(f'app_events_total{{name="{_escape_label(name)}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape_label(value: str):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Archivio condiviso dal processo: il modulo viene importato una sola volta
+metrics = MetricsStore()
+
+
+@contextmanager
+def _measure(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.record(name, time.perf_counter() - start)
+
+
+def timer(name: str):
+    """Context manager che misura il blocco; con la profilazione disattivata non fa nulla"""
+    if not metrics.enabled:
+        return _NULL_TIMER
+    return _measure(name)
+
+
+def timed(name: str):
+    """Decoratore che misura ogni chiamata della funzione con il nome indicato"""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return function(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                metrics.record(name, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def count(name: str, value: int = 1):
+    """Incrementa un contatore (ignorato con la profilazione disattivata)"""
+    metrics.count(name, value)
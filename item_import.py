@@ -0,0 +1,204 @@
+"""Importazione in streaming di elementi da file CSV o XLSX.
+
+Il file viene letto a blocchi di righe: ogni riga viene validata con gli schemi
+di city_items, confrontata con gli elementi già presenti per scartare i
+duplicati e aggiunta a dati_citta. Le modifiche vengono salvate a lotti.
+"""
+
+from pathlib import Path
+
+import pandas as pd
+
+from change_tracking import ChangeTracker
+from cities import JAPAN_CITIES, CITY_CATEGORIES
+from city_items import ITEM_SCHEMAS, normalize_item, add_items, sniff_delimiter
+
+# Nomi accettati per la colonna categoria, oltre alle chiavi di CITY_CATEGORIES
+CATEGORY_ALIASES = {
+    "alloggio": "alloggi", "hotel": "alloggi",
+    "ristorante": "ristoranti",
+    "negozio": "negozi", "shopping": "negozi",
+    "attività": "attivita", "attivita'": "attivita",
+    "trasporto": "trasporti",
+}
+
+MAX_REPORTED_ERRORS = 100
+
+
+class ImportReport:
+    """Conteggi dell'importazione e primi errori riscontrati"""
+
+    def __init__(self):
+        self.rows = 0
+        self.imported = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.batches = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"Riga {row_number}: {message}")
+
+
+def _csv_sample(source, size: int = 65536):
+    """Primi size byte del file come testo, per riconoscere il separatore"""
+    if hasattr(source, "read"):
+        sample = source.read(size)
+        source.seek(0)
+    else:
+        with open(source, "rb") as f:
+            sample = f.read(size)
+    text = sample.decode("utf-8", errors="ignore") if isinstance(sample, bytes) else sample
+    # Solo righe complete: l'ultima può essere tagliata a metà
+    return text[:text.rfind("\n") + 1] or text
+
+
+def _read_csv_chunks(source, chunk_size):
+    sep = sniff_delimiter(_csv_sample(source))
+    for chunk in pd.read_csv(source, sep=sep, dtype=str, chunksize=chunk_size):
+        yield chunk.to_dict("records")
+
+
+def _read_xlsx_chunks(source, chunk_size):
+    try:
+        from openpyxl import load_workbook
+    except ImportError as e:
+        raise ImportError("Per importare file XLSX installa openpyxl (pip install openpyxl)") from e
+
+    # Modalità read_only: le righe vengono lette dal file una alla volta
+    workbook = load_workbook(source, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = [str(value).strip() if value is not None else "" for value in next(rows, [])]
+        chunk = []
+        for values in rows:
+            chunk.append(dict(zip(header, values)))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+    finally:
+        workbook.close()
+
+
+def read_chunks(source, filename: str, chunk_size: int = 1000):
+    """Restituisce un iteratore di blocchi di righe (liste di dizionari) dal file"""
+    suffix = Path(filename).suffix.lower()
+    if suffix == ".csv":
+        return _read_csv_chunks(source, chunk_size)
+    if suffix in (".xlsx", ".xlsm"):
+        return _read_xlsx_chunks(source, chunk_size)
+    raise ValueError(f"Formato non supportato: {suffix} (usa CSV o XLSX)")
+
+
+def item_signature(category: str, item: dict):
+    """Chiave di confronto usata per riconoscere un elemento già presente"""
+    if category == "trasporti":
+        fields = ("partenza", "arrivo", "tipo")
+    elif category == "alloggi":
+        fields = ("nome", "check_in_date")
+    else:
+        fields = ("nome",)
+    return tuple(str(item.get(field, "")).strip().lower() for field in fields)
+
+
+def _normalize_row_keys(row: dict):
+    return {str(key).strip().lower(): value for key, value in row.items() if key is not None}
+
+
+def _resolve_city(value, default):
+    if value is None or value != value or not str(value).strip():
+        return default
+    names = {name.lower(): name for name in JAPAN_CITIES}
+    return names.get(str(value).strip().lower())
+
+
+def _resolve_category(value, default):
+    if value is None or value != value or not str(value).strip():
+        return default
+    text = str(value).strip().lower()
+    if text in CITY_CATEGORIES:
+        return text
+    return CATEGORY_ALIASES.get(text)
+
+
+def import_items(chunks, data: dict, load_city, commit, default_city: str = None,
+                 default_category: str = None, batch_size: int = 500, progress=None):
+    """Importa i blocchi di righe in data["dati_citta"].
+
+    - load_city(città) restituisce i dati della città o None se non esiste
+    - commit(changes) salva un lotto di modifiche e restituisce True se riuscito
+    - progress(report) viene chiamato dopo ogni blocco letto
+
+    Le colonne "citta" e "categoria" sono facoltative se sono indicati i valori predefiniti.
+    """
+    report = ImportReport()
+    signatures = {}
+    changes = ChangeTracker()
+    pending = 0
+
+    def flush():
+        nonlocal changes, pending
+        if pending:
+            if not commit(changes):
+                raise RuntimeError(f"Salvataggio del lotto {report.batches + 1} non riuscito")
+            report.batches += 1
+            changes = ChangeTracker()
+            pending = 0
+
+    for chunk in chunks:
+        # Gli elementi validi del blocco vengono aggiunti insieme per città e categoria
+        accepted = {}
+        for row in chunk:
+            report.rows += 1
+            row = _normalize_row_keys(row)
+            city_name = _resolve_city(row.get("citta", row.get("città")), default_city)
+            category = _resolve_category(row.get("categoria"), default_category)
+            if not city_name:
+                report.add_error(report.rows, "città mancante o sconosciuta")
+                continue
+            if category not in ITEM_SCHEMAS:
+                report.add_error(report.rows, "categoria mancante o sconosciuta")
+                continue
+
+            item, errors = normalize_item(category, row)
+            if item is None:
+                report.add_error(report.rows, ", ".join(errors))
+                continue
+
+            if city_name not in signatures:
+                city_data = load_city(city_name)
+                if city_data is None:
+                    city_data = {name: {} for name in CITY_CATEGORIES}
+                    city_data["coordinate"] = dict(JAPAN_CITIES[city_name])
+                    data.setdefault("dati_citta", {})[city_name] = city_data
+                    changes.mark_city(city_name)
+                signatures[city_name] = {
+                    (existing_category, item_signature(existing_category, existing_item))
+                    for existing_category in CITY_CATEGORIES
+                    for existing_item in (city_data.get(existing_category) or {}).values()
+                    if isinstance(existing_item, dict)
+                }
+
+            signature = (category, item_signature(category, item))
+            if signature in signatures[city_name]:
+                report.duplicates += 1
+                continue
+            signatures[city_name].add(signature)
+            accepted.setdefault((city_name, category), []).append(item)
+
+        for (city_name, category), items in accepted.items():
+            add_items(data, city_name, category, items, changes)
+            report.imported += len(items)
+            pending += len(items)
+            if pending >= batch_size:
+                flush()
+
+        if progress:
+            progress(report)
+
+    flush()
+    return report
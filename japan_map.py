@@ -0,0 +1,134 @@
+"""Costruzione della mappa Folium del Giappone con cache per insieme di città attive"""
+
+import html
+from functools import lru_cache
+
+import folium
+from folium import plugins
+
+from cities import CATEGORY_LABELS, JAPAN_CITIES
+
+# Marker dei punti di interesse creati dal browser: i dati viaggiano come un solo array JSON
+POI_MARKER_CALLBACK = """
+function (row) {
+    var marker = L.marker(new L.LatLng(row[0], row[1]));
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
+
+# Marker delle foto: icona a forma di macchina fotografica, stesso formato dei punti di interesse
+PHOTO_MARKER_CALLBACK = """
+function (row) {
+    var icon = L.divIcon({html: '📷', className: '', iconSize: [20, 20]});
+    var marker = L.marker(new L.LatLng(row[0], row[1]), {icon: icon});
+    marker.bindTooltip(row[2]);
+    return marker;
+}
+"""
+
+
+@lru_cache(maxsize=32)
+def build_japan_map(active_cities: tuple, tiles_url: str = None, pois: tuple = (), photos: tuple = ()):
+    """Crea la mappa con un marker per ogni città attiva.
+
+    La mappa viene ricostruita solo quando cambia l'insieme delle città attive:
+    per la stessa tupla viene restituito l'oggetto già costruito, che non va modificato.
+    Con tiles_url (es. il server della cache locale) le tile non vengono chieste a internet.
+    pois: tupla di (lat, lon, nome, categoria), mostrati raggruppati in cluster.
+    photos: tupla di (lat, lon, nome file, città, data di scatto) delle foto geolocalizzate, in un cluster a parte.
+    """
+    if tiles_url:
+        from tile_cache import ATTRIBUTION
+
+        mappa = folium.Map(
+            location=[36.2048, 138.2529],
+            zoom_start=5,
+            tiles=tiles_url,
+            attr=ATTRIBUTION,
+            control_scale=True
+        )
+        minimap = plugins.MiniMap(tile_layer=folium.TileLayer(tiles_url, attr=ATTRIBUTION))
+    else:
+        mappa = folium.Map(
+            location=[36.2048, 138.2529],
+            zoom_start=5,
+            tiles="cartodb positron",
+            control_scale=True
+        )
+        minimap = plugins.MiniMap()
+
+    # Aggiungi controlli alla mappa
+    mappa.add_child(minimap)
+    mappa.add_child(plugins.Fullscreen())
+    mappa.add_child(plugins.MeasureControl(
+        position='bottomleft',
+        primary_length_unit='kilometers'
+    ))
+
+    # Aggiungi marker per le città con dati attivi
+    for city_name in active_cities:
+        coords = JAPAN_CITIES.get(city_name)
+        if not coords:
+            continue
+        popup_html = f"""
+        <div style='font-family: Arial, sans-serif; width: 200px;'>
+            <h4>{city_name}</h4>
+            <p>Clicca per visualizzare i dettagli</p>
+        </div>
+        """
+
+        folium.Marker(
+            location=[coords['lat'], coords['lon']],
+            popup=folium.Popup(popup_html, max_width=300),
+            tooltip=f"{city_name}",
+            icon=folium.Icon(color='red', icon='info-sign')
+        ).add_to(mappa)
+
+    if pois:
+        add_poi_cluster(mappa, pois)
+    if photos:
+        add_photo_cluster(mappa, photos)
+
+    return mappa
+
+
+def add_poi_cluster(mappa, pois):
+    """Aggiunge i punti di interesse in un cluster disegnato lato browser.
+
+    FastMarkerCluster crea i marker in JavaScript da un unico array, quindi la pagina
+    resta leggera e reattiva anche con migliaia di punti.
+    """
+    data = [
+        [lat, lon, html.escape(f"{name} · {CATEGORY_LABELS.get(category, category)}")]
+        for lat, lon, name, category in pois
+    ]
+    plugins.FastMarkerCluster(
+        data,
+        callback=POI_MARKER_CALLBACK,
+        name="Punti di interesse",
+        options={"disableClusteringAtZoom": 17, "chunkedLoading": True}
+    ).add_to(mappa)
+
+
+def add_photo_cluster(mappa, photos):
+    """Aggiunge le foto geolocalizzate in un cluster disegnato lato browser"""
+    data = []
+    for lat, lon, name, city, taken_at in photos:
+        details = [name]
+        if taken_at:
+            details.append(taken_at[:16].replace("T", " "))
+        if city:
+            details.append(city)
+        data.append([lat, lon, html.escape(" · ".join(details))])
+    plugins.FastMarkerCluster(
+        data,
+        callback=PHOTO_MARKER_CALLBACK,
+        name="Foto",
+        options={"disableClusteringAtZoom": 17, "chunkedLoading": True}
+    ).add_to(mappa)
+
+
+def map_key(active_cities: tuple, with_pois: bool = False, with_photos: bool = False):
+    """Chiave stabile del componente mappa: cambia solo se cambiano le città attive o i livelli mostrati"""
+    return "japan_map_" + "_".join(active_cities) + ("_poi" if with_pois else "") + ("_foto" if with_photos else "")
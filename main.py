@@ -1,25 +1,34 @@
 import streamlit as st
-import folium
-from streamlit_folium import st_folium 
-from folium import plugins
 from datetime import datetime
 import pytz 
-import pandas as pd
-import json
+import io
 import os
-from pathlib import Path
-import random
-from PIL import Image
-from supabase import create_client
-
-# Supabase configuration
-SUPABASE_URL = st.secrets["supabase_url"]  
-SUPABASE_KEY = st.secrets["supabase_key"]
-
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("Missing Supabase credentials. Please check secrets.toml")
+import tempfile
+import copy
+import csv
+import re
+import uuid
+from change_tracking import ChangeTracker
+from undo_history import (
+    OperationLog, DEFAULT_HISTORY_SIZE, DEFAULT_MAX_OPERATIONS,
+    apply_operations, removal_operations, changes_to_removals, history_path, prune_history_files
+)
+from trip_cache import TripCache
+from save_queue import DEFAULT_MAX_ATTEMPTS, SaveJournal, SaveQueue, PendingWrite
+from cities import JAPAN_CITIES, CATEGORY_LABELS
+from cost_index import (
+    check_cost_index, ensure_cost_index,
+    indexed_active_cities, rebuild_cost_index
+)
+from currency import CURRENCIES, format_amount, item_currency, load_rate_table, record_rate, trip_date
+from storage import create_backend
+from resilience import BackendUnavailable
+from instrumentation import metrics, timed, timer, count
+from city_items import TYPE_OPTIONS, ITEM_SCHEMAS, normalize_item, add_items, sniff_delimiter
+from trip_export import export_xlsx, export_pdf
 
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+# pandas, folium, streamlit_folium e i moduli che li usano (japan_map, trip_analytics,
+# item_import) vengono importati dentro le funzioni delle pagine che ne hanno bisogno
 
 # Configurazione pagina
 st.set_page_config(
@@ -29,88 +38,328 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-JAPAN_CITIES = {
-    "Tokyo": {"lat": 35.6762, "lon": 139.6503},
-    "Kyoto": {"lat": 35.0116, "lon": 135.7681},
-    "Osaka": {"lat": 34.6937, "lon": 135.5023},
-    "Nara": {"lat": 34.6851, "lon": 135.8048},
-    "Hiroshima": {"lat": 34.3853, "lon": 132.4553},
-    "Sapporo": {"lat": 43.0618, "lon": 141.3545},
-    "Fukuoka": {"lat": 33.5902, "lon": 130.4017},
-    "Kanazawa": {"lat": 36.5944, "lon": 136.6255},
-    "Nagoya": {"lat": 35.1815, "lon": 136.9066},
-    "Kobe": {"lat": 34.6901, "lon": 135.1955},
-    "Takayama": {"lat": 36.1408, "lon": 137.2520},
-    "Hakone": {"lat": 35.2324, "lon": 139.1069},
-    "Nikko": {"lat": 36.7198, "lon": 139.6982},
-    "Kamakura": {"lat": 35.3192, "lon": 139.5467},
-    "Matsumoto": {"lat": 36.2384, "lon": 137.9720},
-    "Kawaguchiko": {"lat": 35.5171, "lon": 138.7510},
-    "Himeji": {"lat": 34.8157, "lon": 134.6854},
-    "Ise": {"lat": 34.4873, "lon": 136.7257},
-    "Sendai": {"lat": 38.2682, "lon": 140.8694},
-    "Nagasaki": {"lat": 32.7503, "lon": 129.8777},
-    "Yokohama": {"lat": 35.4437, "lon": 139.6380},
-    "Takeshima": {"lat": 34.2891, "lon": 133.0182},
-    "Miyajima": {"lat": 34.2971, "lon": 132.3197},
-    "Koyasan": {"lat": 34.2130, "lon": 135.5855}
-}
+@st.cache_resource
+def get_storage():
+    """Backend di salvataggio scelto con il secret storage_backend (supabase, sqlite o json).
+
+    Un solo backend per processo: il pool di client, i timeout e il circuit breaker
+    sono condivisi da tutte le sessioni.
+    """
+    return create_backend(
+        st.secrets.get("storage_backend", "supabase"),
+        supabase_url=st.secrets.get("supabase_url"),
+        supabase_key=st.secrets.get("supabase_key"),
+        sqlite_path=st.secrets.get("sqlite_path", "data/viaggio.db"),
+        json_path=st.secrets.get("json_path", "data/viaggio_data.json"),
+        timeout=st.secrets.get("storage_timeout_seconds", 10),
+        retries=st.secrets.get("storage_retries", 3),
+        pool_size=st.secrets.get("supabase_pool_size", 4),
+        breaker_failures=st.secrets.get("circuit_breaker_failures", 5),
+        breaker_reset=st.secrets.get("circuit_breaker_reset_seconds", 30)
+    )
+
+@st.cache_resource
+def init_profiling():
+    """Stato iniziale della profilazione, impostato una volta per processo dal secret profiling"""
+    metrics.enabled = bool(st.secrets.get("profiling", False))
+    return metrics
+
+@st.cache_resource
+def get_trip_cache():
+    """Cache dei documenti dei viaggi condivisa da tutte le sessioni del processo"""
+    return TripCache(ttl=float(st.secrets.get("cache_ttl_seconds", 30)))
+
+@st.cache_resource
+def get_save_queue():
+    """Thread di scrittura condiviso da tutte le sessioni, oppure None se disattivato.
+
+    Le scritture accodate sono registrate nel journal locale finché non vengono salvate
+    e, dopo un riavvio, vengono ritentate.
+    """
+    if not st.secrets.get("async_saves", True):
+        return None
+    return SaveQueue(
+        DatabaseManager(use_save_queue=False).write_pending,
+        max_attempts=int(st.secrets.get("save_max_attempts", DEFAULT_MAX_ATTEMPTS)),
+        journal=SaveJournal(st.secrets.get("save_journal_path", "data/save_journal.db"))
+    )
+
+@st.cache_resource
+def get_backup_store():
+    """Backup versionati dei viaggi scritti in background, oppure None se il secret backups è disattivato"""
+    if not st.secrets.get("backups", True):
+        return None
+    from trip_backup import BackupStore, FULL_EVERY
+    max_age = st.secrets.get("backup_max_age_days")
+    return BackupStore(
+        st.secrets.get("backup_path", "data/backup"),
+        keep=int(st.secrets.get("backup_keep", 10)),
+        max_age_days=float(max_age) if max_age is not None else None,
+        full_every=int(st.secrets.get("backup_full_every", FULL_EVERY))
+    )
+
+@st.cache_resource
+def get_tile_server():
+    """Server locale delle tile della mappa (cache MBTiles), oppure None se offline_tiles è disattivato"""
+    if not st.secrets.get("offline_tiles", False):
+        return None
+    from tile_cache import MBTilesCache, TileServer
+
+    cache = MBTilesCache(
+        st.secrets.get("tiles_path", "data/tiles.mbtiles"),
+        max_tiles=int(st.secrets.get("tiles_max", 20000))
+    )
+    try:
+        return TileServer(
+            cache,
+            host=st.secrets.get("tile_server_host", "127.0.0.1"),
+            port=int(st.secrets.get("tile_server_port", 8765)),
+            online=bool(st.secrets.get("tiles_online", True))
+        )
+    except OSError as e:
+        st.error(f"Errore nell'avvio del server delle tile: {str(e)}")
+        return None
+
+def tiles_url():
+    """URL delle tile per Folium: None per usare le tile online predefinite"""
+    server = get_tile_server()
+    if server is None:
+        return None
+    return st.secrets.get("tile_server_url", f"http://localhost:{server.port}/{{z}}/{{x}}/{{y}}.png")
+
+@st.cache_resource
+def get_thumbnail_cache():
+    """Cache su disco delle anteprime delle foto, condivisa da tutte le sessioni"""
+    from photo_gallery import ThumbnailCache
+    return ThumbnailCache(st.secrets.get("thumbnails_path", "data/thumbnails"))
+
+@st.cache_resource
+def get_photo_watcher():
+    """Indice SQLite delle foto e thread che lo tiene allineato alla cartella photos e crea le anteprime"""
+    from photo_index import PhotoIndex, PhotoWatcher
+    index = PhotoIndex(st.secrets.get("photos_index_path", "data/photos.db"), st.secrets.get("photos_path", "photos"))
+    return PhotoWatcher(index, float(st.secrets.get("photo_watch_seconds", 30)), get_thumbnail_cache())
+
+# Layout del documento in cui gli elementi delle città sono salvati nella tabella cities
+CITY_LAYOUT = "citta"
+
+def storage_error(error):
+    """Messaggio di errore del backend, più breve quando il circuit breaker è aperto"""
+    if isinstance(error, BackendUnavailable):
+        return str(error)
+    if isinstance(error, TimeoutError):
+        return f"il database non risponde ({error})"
+    return str(error)
 
 class DatabaseManager:
-    def __init__(self):
-        self.supabase = supabase
+    def __init__(self, use_save_queue: bool = True):
+        self._storage = None
+        self.cache = get_trip_cache()
+        # In modalità lazy gli elementi di una città vengono scaricati solo al primo accesso
+        self.lazy_cities = bool(st.secrets.get("lazy_city_loading", True))
+        self.save_queue = get_save_queue() if use_save_queue else None
+        self.backups = get_backup_store()
+    
+    @property
+    def storage(self):
+        # Il backend (e la connessione a Supabase) viene creato al primo accesso ai dati
+        if self._storage is None:
+            self._storage = get_storage()
+        return self._storage
+    
+    def connection_status(self):
+        """Stato del circuit breaker, o None se il backend non è ancora stato creato o non lo prevede"""
+        if self._storage is None or not hasattr(self._storage, "status"):
+            return None
+        return self._storage.status()
         
+    @timed("db.get_trip_data")
     def get_trip_data(self, trip_id: str = "default_trip"):
+        cached = self.cache.get(trip_id)
+        if cached and not cached.expired:
+            count("cache.hit")
+            return cached.data
         try:
-            response = self.supabase.table('trips').select("*").eq('id', trip_id).execute()
-            return response.data[0]['data'] if response.data else self.create_empty_data()
+            if cached:
+                # Cache scaduta: controlla solo la versione prima di riscaricare il documento
+                if self.storage.trip_version(trip_id) == cached.updated_at:
+                    count("cache.versione_invariata")
+                    self.cache.refresh(trip_id)
+                    return cached.data
+
+            count("cache.miss")
+            data, updated_at = self.storage.load_trip(trip_id)
+            if data is None:
+                return self.create_empty_data()
+            if data.get("meta", {}).get("layout") == CITY_LAYOUT:
+                if self.lazy_cities and "suddivisione_per_citta" in data.get("budget", {}):
+                    # Il documento contiene solo l'indice con conteggi e totali per città
+                    data["dati_citta"] = {}
+                else:
+                    data["dati_citta"] = self.get_all_city_data(data.get("indice_citta", []), trip_id)
+            ensure_cost_index(data)
+            self.cache.put(trip_id, data, updated_at)
+            return data
         except Exception as e:
-            st.error(f"Errore nel caricamento dei dati: {str(e)}")
+            if cached:
+                # Database lento o non raggiungibile: meglio la copia in cache di un viaggio vuoto
+                st.warning(f"Dati dalla cache locale, {storage_error(e)}")
+                return cached.data
+            st.error(f"Errore nel caricamento dei dati: {storage_error(e)}")
             return self.create_empty_data()
     
+    @timed("db.save_trip_data")
     def save_trip_data(self, data: dict, trip_id: str = "default_trip"):
         try:
-            data["meta"] = {
-                "ultima_modifica": datetime.now(pytz.timezone('Europe/Rome')).strftime('%Y-%m-%d %H:%M:%S'),
-                "ultima_modifica_utente": "user",
-                "versione_dati": "1.0"
-            }
-            
-            response = self.supabase.table('trips').upsert({
-                'id': trip_id,
-                'data': data,
-                'updated_at': datetime.now().isoformat()
-            }).execute()
-            
-            return True if response.data else False
+            return self.write_pending(trip_id, self.prepare_full_save(data, trip_id))
         except Exception as e:
-            st.error(f"Errore nel salvataggio dei dati: {str(e)}")
+            st.error(f"Errore nel salvataggio dei dati: {storage_error(e)}")
             return False
             
-    def save_city_data(self, city_name: str, data: dict, trip_id: str = "default_trip"):
+    @timed("db.save_changes")
+    def save_changes(self, data: dict, changes: ChangeTracker, trip_id: str = "default_trip"):
+        """Salva solo le città modificate nella tabella cities e il documento senza gli elementi"""
+        if changes.full:
+            return self.save_trip_data(data, trip_id)
         try:
-            response = self.supabase.table('cities').upsert({
-                'trip_id': trip_id,
-                'city_name': city_name,
-                'data': data,
-                'updated_at': datetime.now().isoformat()
-            }).execute()
-            return True if response.data else False
+            return self.write_pending(trip_id, self.prepare_changes(data, changes))
         except Exception as e:
-            st.error(f"Errore nel salvataggio dati città: {str(e)}")
+            st.error(f"Errore nel salvataggio delle modifiche: {storage_error(e)}")
             return False
 
-    def get_city_data(self, city_name: str, trip_id: str = "default_trip"):
+    def has_pending_saves(self, trip_id: str = "default_trip"):
+        return bool(self.save_queue) and self.save_queue.has_pending(trip_id)
+
+    @timed("db.queue_changes")
+    def queue_changes(self, data: dict, changes: ChangeTracker, trip_id: str = "default_trip"):
+        """Accoda il salvataggio al thread di scrittura senza attendere la risposta del database"""
+        if not self.save_queue:
+            return self.save_changes(data, changes, trip_id)
+        try:
+            if changes.full:
+                pending = self.prepare_full_save(data, trip_id)
+            else:
+                pending = self.prepare_changes(data, changes)
+            self.save_queue.submit(trip_id, pending)
+            self.cache.invalidate(trip_id)
+            return True
+        except Exception as e:
+            st.error(f"Errore nel salvataggio delle modifiche: {storage_error(e)}")
+            return False
+
+    def prepare_full_save(self, data: dict, trip_id: str = "default_trip"):
+        """Prepara il salvataggio dell'intero documento, città comprese"""
+        # Il salvataggio completo richiede tutte le città, anche quelle non ancora caricate
+        self.load_all_cities(data, trip_id)
+        data["meta"] = {
+            "ultima_modifica": datetime.now(pytz.timezone('Europe/Rome')).strftime('%Y-%m-%d %H:%M:%S'),
+            "ultima_modifica_utente": "user",
+            "versione_dati": "1.0"
+        }
+        return PendingWrite(copy.deepcopy(data), full=True)
+
+    def prepare_changes(self, data: dict, changes: ChangeTracker):
+        """Aggiorna meta e indice delle città e prepara la scrittura delle sole città modificate"""
+        dati_citta = data.get("dati_citta", {})
+        reset = data.get("meta", {}).get("layout") != CITY_LAYOUT
+        # Al primo salvataggio incrementale tutte le città vengono spostate nella tabella cities
+        dirty_cities = set(dati_citta) if reset else changes.dirty_cities()
+
+        removed = {city_name for city_name in dirty_cities if city_name not in dati_citta}
+        # L'indice comprende anche le città non ancora caricate in modalità lazy
+        city_index = [city_name for city_name in data.get("indice_citta", []) if city_name not in removed]
+        city_index += [city_name for city_name in dati_citta if city_name not in city_index]
+        data["indice_citta"] = city_index
+
+        data["meta"] = {
+            "ultima_modifica": datetime.now(pytz.timezone('Europe/Rome')).strftime('%Y-%m-%d %H:%M:%S'),
+            "ultima_modifica_utente": "user",
+            "versione_dati": "1.0",
+            "layout": CITY_LAYOUT
+        }
+        # Il documento del viaggio contiene solo l'indice delle città, non gli elementi
+        document = copy.deepcopy({key: value for key, value in data.items() if key != "dati_citta"})
+        document["dati_citta"] = {}
+        rows = {
+            city_name: copy.deepcopy(dati_citta[city_name])
+            for city_name in dirty_cities if city_name in dati_citta
+        }
+        changes.clear()
+        return PendingWrite(document, rows, removed, reset=reset)
+
+    @timed("db.write_pending")
+    def write_pending(self, trip_id: str, pending: PendingWrite):
+        """Esegue una scrittura preparata; solleva un'eccezione in caso di errore"""
+        now = datetime.now().isoformat()
+        if not pending.full:
+            if pending.reset:
+                self.storage.delete_cities(trip_id)
+            if pending.rows and not self.storage.save_cities(trip_id, pending.rows, now):
+                return False
+            if pending.removed:
+                self.storage.delete_cities(trip_id, pending.removed)
+
+        saved = self.storage.save_trip(trip_id, pending.document, now)
+        if saved:
+            self.cache.invalidate(trip_id)
+            if self.backups:
+                # La versione viene calcolata e scritta dal thread dei backup
+                self.backups.submit(trip_id, pending, self.load_complete_trip)
+        return saved
+
+    def load_complete_trip(self, trip_id: str = "default_trip"):
+        """Documento salvato con tutte le città, letto dal database senza cache; None se non esiste"""
+        data, _ = self.storage.load_trip(trip_id)
+        if data is not None and data.get("meta", {}).get("layout") == CITY_LAYOUT:
+            data["dati_citta"] = self.get_all_city_data(data.get("indice_citta", []), trip_id)
+        return data
+
+    @timed("db.save_city_data")
+    def save_city_data(self, city_name: str, data: dict, trip_id: str = "default_trip"):
         try:
-            response = self.supabase.table('cities') \
-                .select("*") \
-                .eq('trip_id', trip_id) \
-                .eq('city_name', city_name) \
-                .execute()
-            return response.data[0]['data'] if response.data else self.get_empty_city_structure()
+            return self.storage.save_cities(trip_id, {city_name: data}, datetime.now().isoformat())
         except Exception as e:
-            st.error(f"Errore nel caricamento dati città: {str(e)}")
-            return self.get_empty_city_structure()
+            st.error(f"Errore nel salvataggio dati città: {storage_error(e)}")
+            return False
+
+    @timed("db.get_city_data")
+    def get_city_data(self, city_name: str, trip_id: str = "default_trip"):
+        """Carica i dati di una città; gli errori del database vengono propagati.
+
+        Una struttura vuota al posto della città non caricata finirebbe in sessione e,
+        alla prima modifica, sovrascriverebbe nel database gli elementi della città.
+        """
+        count("db.citta_caricate")
+        cities = self.storage.load_cities(trip_id, [city_name])
+        return cities.get(city_name, self.get_empty_city_structure())
+
+    @timed("db.get_all_city_data")
+    def get_all_city_data(self, city_names: list, trip_id: str = "default_trip"):
+        """Carica con una sola query i dati delle città presenti nell'indice del viaggio"""
+        count("db.citta_caricate", len(city_names))
+        rows = self.storage.load_cities(trip_id, city_names)
+        return {
+            city_name: rows.get(city_name, self.get_empty_city_structure())
+            for city_name in city_names
+        }
+
+    def load_city(self, data: dict, city_name: str, trip_id: str = "default_trip"):
+        """Restituisce i dati di una città, scaricandoli al primo accesso se non sono in sessione.
+
+        Se il caricamento non riesce l'errore viene propagato e la città non viene messa in sessione.
+        """
+        dati_citta = data.setdefault("dati_citta", {})
+        if city_name not in dati_citta and city_name in data.get("indice_citta", []):
+            dati_citta[city_name] = self.get_city_data(city_name, trip_id)
+        return dati_citta.get(city_name)
+
+    def load_all_cities(self, data: dict, trip_id: str = "default_trip"):
+        """Scarica con una sola query tutte le città non ancora caricate"""
+        dati_citta = data.setdefault("dati_citta", {})
+        missing = [city_name for city_name in data.get("indice_citta", []) if city_name not in dati_citta]
+        if missing:
+            dati_citta.update(self.get_all_city_data(missing, trip_id))
+        return data
 
     def create_empty_data(self):
         return {
@@ -131,8 +380,11 @@ class DatabaseManager:
                     "negozi": 0,
                     "attivita": 0,
                     "trasporti": 0
-                }
+                },
+                "suddivisione_per_citta": {},
+                "suddivisione_per_valuta": {}
             },
+            "tassi_cambio": [],
             "custom_gallery_link": "",  
             "meta": {
                 "ultima_modifica": datetime.now(pytz.timezone('Europe/Rome')).strftime('%Y-%m-%d %H:%M:%S'),
@@ -158,11 +410,52 @@ class DatabaseManager:
 # Initialize database connection
 db = DatabaseManager()
 
-# Initialize session state
-if 'data' not in st.session_state:
-    st.session_state.data = db.get_trip_data()
+def load_session_data():
+    """Carica il viaggio nella sessione alla prima pagina visualizzata"""
+    if 'data' not in st.session_state:
+        st.session_state.data = db.get_trip_data()
+
+def get_items_table():
+    """Tabella degli elementi della sessione, creata al primo riepilogo"""
+    if 'items_table' not in st.session_state:
+        from trip_analytics import ItemsTable
+        st.session_state.items_table = ItemsTable()
+    return st.session_state.items_table
+
+def get_index_totals():
+    """Totali convertiti dell'indice dei costi della sessione, creati alla prima visita della Home"""
+    if 'index_totals' not in st.session_state:
+        from trip_analytics import IndexTotals
+        st.session_state.index_totals = IndexTotals()
+    return st.session_state.index_totals
+
+def get_rate_table():
+    """Tabella dei tassi di cambio dal file locale e dallo storico del viaggio"""
+    return load_rate_table(st.session_state.data, st.secrets.get("rates_path", "data/tassi_cambio.csv"))
 
 # Funzioni di input
+def input_visit(item):
+    """Data, orario e durata facoltativi della visita, usati dalla timeline del viaggio"""
+    col_day, col_time, col_duration = st.columns(3)
+    with col_day:
+        day = st.date_input("Data visita", value=None, format="DD-MM-YYYY")
+    with col_time:
+        visit_time = st.time_input("Orario visita", value=None)
+    with col_duration:
+        item["durata_minuti"] = st.number_input("Durata (minuti)", min_value=1, value=None, step=15, placeholder="60")
+    item["data_visita"] = day.strftime("%d-%m-%Y") if day else None
+    item["orario_visita"] = visit_time.strftime("%H:%M") if visit_time else None
+
+def input_coordinates(item):
+    """Coordinate facoltative del punto di interesse, usate dalla mappa e dalla ricerca per vicinanza"""
+    col_lat, col_lon = st.columns(2)
+    with col_lat:
+        item["lat"] = st.number_input("Latitudine", min_value=-90.0, max_value=90.0, value=None, format="%.6f",
+                                      placeholder="es. 35.658581")
+    with col_lon:
+        item["lon"] = st.number_input("Longitudine", min_value=-180.0, max_value=180.0, value=None, format="%.6f",
+                                      placeholder="es. 139.745433")
+
 def input_accommodation_section():
     """Gestisce la sezione input per gli alloggi"""
     st.subheader("🏨 Alloggi")
@@ -177,7 +470,7 @@ def input_accommodation_section():
         accommodations[accommodation_key]["nome"] = st.text_input("Nome struttura")
         accommodations[accommodation_key]["tipo"] = st.selectbox(
             "Tipo", 
-            ["Hotel", "Ryokan", "Capsule", "Ostello", "Altro"]
+            TYPE_OPTIONS["alloggi"]
         )
         accommodations[accommodation_key]["indirizzo"] = st.text_input("Indirizzo completo")
         accommodations[accommodation_key]["link_booking"] = st.text_input("Link Booking/Struttura")
@@ -193,9 +486,11 @@ def input_accommodation_section():
         accommodations[accommodation_key]["check_out_date"] = check_out_date.strftime("%d-%m-%Y")
         accommodations[accommodation_key]["orario_check_out"] = st.text_input("Orario Check-out (es. 06:30 - 10:00)")
         accommodations[accommodation_key]["notti"] = st.number_input("Numero notti", min_value=1, step=1)
-        accommodations[accommodation_key]["costo"] = st.number_input("Costo totale (€)", min_value=0.0, step=10.0)
+        accommodations[accommodation_key]["costo"] = st.number_input("Costo totale", min_value=0.0, step=10.0)
+        accommodations[accommodation_key]["valuta"] = st.selectbox("Valuta", CURRENCIES)
     
     # Note alla fine
+    input_coordinates(accommodations[accommodation_key])
     accommodations[accommodation_key]["note"] = st.text_area("Note aggiuntive")
     
     return accommodations
@@ -213,7 +508,7 @@ def input_restaurants_section():
         restaurants[restaurant_key]["nome"] = st.text_input("Nome ristorante")
         restaurants[restaurant_key]["tipo"] = st.selectbox(
             "Tipo cucina", 
-            ["Tradizionale", "Ramen", "Sushi", "Izakaya", "Street Food", "Teppanyaki", "Altro"]
+            TYPE_OPTIONS["ristoranti"]
         )
         restaurants[restaurant_key]["quartiere"] = st.text_input("Quartiere")
         restaurants[restaurant_key]["stazione"] = st.text_input("Stazione più vicina")
@@ -226,9 +521,12 @@ def input_restaurants_section():
         restaurants[restaurant_key]["orario_chiusura"] = orario_chiusura.strftime("%H:%M")
         
         restaurants[restaurant_key]["link"] = st.text_input("Link sito/social")
-        restaurants[restaurant_key]["costo"] = st.number_input("Costo (€)", min_value=0.0, step=1.0)
+        restaurants[restaurant_key]["costo"] = st.number_input("Costo", min_value=0.0, step=1.0)
+        restaurants[restaurant_key]["valuta"] = st.selectbox("Valuta", CURRENCIES)
         restaurants[restaurant_key]["prenotazione"] = st.checkbox("Richiede prenotazione")
     
+    input_visit(restaurants[restaurant_key])
+    input_coordinates(restaurants[restaurant_key])
     restaurants[restaurant_key]["note"] = st.text_area("Note", help="Inserisci eventuali note aggiuntive")
     
     return restaurants
@@ -246,7 +544,7 @@ def input_shops_section():
         shops[shop_key]["nome"] = st.text_input("Nome negozio")
         shops[shop_key]["tipo"] = st.selectbox(
             "Tipo negozio", 
-            ["Manga", "Cucina", "Cibo", "Elettronica", "Abbigliamento", "Souvenir", "Altro"]
+            TYPE_OPTIONS["negozi"]
         )
         shops[shop_key]["quartiere"] = st.text_input("Quartiere")
         shops[shop_key]["stazione"] = st.text_input("Stazione più vicina")
@@ -259,8 +557,11 @@ def input_shops_section():
         shops[shop_key]["orario_chiusura"] = orario_chiusura.strftime("%H:%M")
         
         shops[shop_key]["link"] = st.text_input("Link sito/social")
-        shops[shop_key]["costo"] = st.number_input("Prezzo (€)", min_value=0.0, step=1.0)
+        shops[shop_key]["costo"] = st.number_input("Prezzo", min_value=0.0, step=1.0)
+        shops[shop_key]["valuta"] = st.selectbox("Valuta", CURRENCIES)
     
+    input_visit(shops[shop_key])
+    input_coordinates(shops[shop_key])
     shops[shop_key]["note"] = st.text_area("Note", help="Inserisci eventuali note sul budget o sugli acquisti pianificati")
     
     return shops
@@ -278,7 +579,7 @@ def input_activities_section():
         activities[activity_key]["nome"] = st.text_input("Nome attività")
         activities[activity_key]["tipo"] = st.selectbox(
             "Tipo", 
-            ["Museo", "Tempio", "Parco", "Evento", "Tour guidato", "Onsen", "Shopping", "Altro"]
+            TYPE_OPTIONS["attivita"]
         )
         activities[activity_key]["quartiere"] = st.text_input("Quartiere")
         activities[activity_key]["stazione"] = st.text_input("Stazione più vicina")
@@ -291,9 +592,12 @@ def input_activities_section():
         activities[activity_key]["orario_chiusura"] = orario_chiusura.strftime("%H:%M")
         
         activities[activity_key]["link"] = st.text_input("Link sito/social")
-        activities[activity_key]["costo"] = st.number_input("Costo (€)", min_value=0.0, step=1.0)
+        activities[activity_key]["costo"] = st.number_input("Costo", min_value=0.0, step=1.0)
+        activities[activity_key]["valuta"] = st.selectbox("Valuta", CURRENCIES)
         activities[activity_key]["prenotazione"] = st.checkbox("Richiede prenotazione")
     
+    input_visit(activities[activity_key])
+    input_coordinates(activities[activity_key])
     activities[activity_key]["note"] = st.text_area("Note")
     
     return activities
@@ -307,7 +611,8 @@ def input_transport_section():
     if use_japan_rail_pass:
         transports["japan_rail_pass"] = {
             "tipo": "Japan Rail Pass",
-            "costo": st.number_input("Costo del Japan Rail Pass (€)", min_value=0.0, step=1.0),
+            "costo": st.number_input("Costo del Japan Rail Pass", min_value=0.0, step=1.0),
+            "valuta": st.selectbox("Valuta", CURRENCIES),
             "durata": st.selectbox("Durata del Pass", ["7 giorni", "14 giorni", "21 giorni"]),
             "note": st.text_area("Note aggiuntive")
         }
@@ -324,204 +629,386 @@ def input_transport_section():
         with col2:
             transports[transport_key]["tipo"] = st.selectbox(
                 "Tipo di trasporto", 
-                ["Shinkansen", "Treno Locale", "Autobus", "Metro", "Taxi", "Altro"]
+                TYPE_OPTIONS["trasporti"]
             )
-            transports[transport_key]["costo"] = st.number_input("Costo (€)", min_value=0.0, step=1.0)
+            transports[transport_key]["costo"] = st.number_input("Costo", min_value=0.0, step=1.0)
+            transports[transport_key]["valuta"] = st.selectbox("Valuta", CURRENCIES)
         
         transports[transport_key]["note"] = st.text_area("Note")
     
     return transports
 
-def check_and_cleanup_city(city_name, current_data):
-    """Verifica se una città ha elementi e la rimuove se è vuota"""
-    city_data = current_data["dati_citta"].get(city_name, {})
-    has_items = False
-    
-    for category in ["alloggi", "ristoranti", "negozi", "attivita", "trasporti"]:
-        if city_data.get(category) and len(city_data[category]) > 0:
-            has_items = True
-            break
+def get_session_id():
+    """Identificativo della sessione nell'URL (?sessione=...): resta uguale se la pagina viene ricaricata"""
+    session_id = st.query_params.get("sessione")
+    if not session_id or not re.fullmatch(r"[0-9a-f]{32}", session_id):
+        session_id = uuid.uuid4().hex
+        st.query_params["sessione"] = session_id
+    return session_id
+
+def get_history(trip_id: str = "default_trip"):
+    """Cronologia di annulla/ripeti della sessione; con il secret undo_persist è salvata su file.
+
+    Ogni viaggio e ogni sessione ha il suo file: le sessioni aperte insieme non si
+    sovrascrivono la cronologia e non ne applicano le operazioni ai propri dati.
+    """
+    if 'history' not in st.session_state:
+        path = None
+        if st.secrets.get("undo_persist", False):
+            folder = st.secrets.get("undo_folder", "data/undo_history")
+            prune_history_files(folder, float(st.secrets.get("undo_max_age_days", 30)))
+            path = history_path(folder, trip_id, get_session_id())
+        st.session_state.history = OperationLog(
+            int(st.secrets.get("undo_history_size", DEFAULT_HISTORY_SIZE)), path,
+            int(st.secrets.get("undo_max_operations", DEFAULT_MAX_OPERATIONS))
+        )
+    return st.session_state.history
+
+def delete_city_item(city_name, category, key):
+    """Elimina un elemento di una città (e la città se resta vuota) e salva solo la città modificata"""
+    current_data = st.session_state.data
+    changes = ChangeTracker()
+    try:
+        db.load_city(current_data, city_name)
+    except Exception as e:
+        st.error(f"Errore nel caricamento dati città: {storage_error(e)}")
+        return
+    name = current_data["dati_citta"][city_name][category][key].get("nome") or CATEGORY_LABELS.get(category, category)
+    undo = apply_operations(current_data, removal_operations(city_name, category, [key]), changes)
+    get_history().record(f"Eliminazione di {name} ({city_name})", undo)
+    if db.queue_changes(current_data, changes):
+        st.rerun()
+
+def display_history():
+    """Pulsanti Annulla e Ripeti nella sidebar per le ultime aggiunte ed eliminazioni"""
+    history = get_history()
+    if "ultima_azione" in st.session_state:
+        st.sidebar.success(st.session_state.pop("ultima_azione"))
+    undo_entry, redo_entry = history.peek_undo(), history.peek_redo()
+    if not undo_entry and not redo_entry:
+        return
+    col1, col2 = st.sidebar.columns(2)
+    with col1:
+        undo = st.button("↶ Annulla", disabled=not undo_entry, help=undo_entry and undo_entry["descrizione"], key="annulla")
+    with col2:
+        redo = st.button("↷ Ripeti", disabled=not redo_entry, help=redo_entry and redo_entry["descrizione"], key="ripeti")
+    if not (undo or redo):
+        return
+    try:
+        # Le città della voce devono essere in sessione anche in modalità lazy
+        for city_name in history.cities(redo=redo):
+            db.load_city(st.session_state.data, city_name)
+    except Exception as e:
+        st.sidebar.error(f"Errore nel caricamento delle città: {storage_error(e)}")
+        return
+    changes = ChangeTracker()
+    if undo:
+        description = history.undo(st.session_state.data, changes)
+    else:
+        description = history.redo(st.session_state.data, changes)
+    if changes.is_empty() or db.queue_changes(st.session_state.data, changes):
+        st.session_state.ultima_azione = f"{'Annullato' if undo else 'Ripetuto'}: {description}"
+        st.rerun()
+    st.sidebar.error("Errore nel salvataggio della modifica")
+
+
+ITEM_PAGE_SIZES = [10, 25, 50, 100]
+
+# Colonne della tabella di ogni categoria: campo -> intestazione
+TABLE_COLUMNS = {
+    "alloggi": {"nome": "Nome", "tipo": "Tipo", "check_in_date": "Check-in", "check_out_date": "Check-out", "notti": "Notti", "costo": "Importo", "valuta": "Valuta"},
+    "ristoranti": {"nome": "Nome", "tipo": "Tipo", "quartiere": "Quartiere", "orario_apertura": "Apertura", "orario_chiusura": "Chiusura", "costo": "Importo", "valuta": "Valuta"},
+    "negozi": {"nome": "Nome", "tipo": "Tipo", "quartiere": "Quartiere", "orario_apertura": "Apertura", "orario_chiusura": "Chiusura", "costo": "Importo", "valuta": "Valuta"},
+    "attivita": {"nome": "Nome", "tipo": "Tipo", "quartiere": "Quartiere", "orario_apertura": "Apertura", "orario_chiusura": "Chiusura", "costo": "Importo", "valuta": "Valuta"},
+    "trasporti": {"tipo": "Tipo", "partenza": "Partenza", "arrivo": "Arrivo", "durata": "Durata", "costo": "Importo", "valuta": "Valuta"},
+}
+
+def item_label(category, item):
+    """Nome breve di un elemento per il menu di selezione del dettaglio"""
+    if category == "trasporti":
+        if item.get('tipo') == "Japan Rail Pass":
+            return "🎫 Japan Rail Pass"
+        return f"🚄 {item.get('tipo', 'Trasporto')} - {item.get('partenza', 'N/A')} ➔ {item.get('arrivo', 'N/A')}"
+    return item.get('nome') or CATEGORY_LABELS[category]
+
+def item_matches(item, query):
+    """Ricerca senza distinzione di maiuscole nei campi di testo dell'elemento"""
+    return any(query in value.lower() for value in item.values() if isinstance(value, str))
+
+def get_poi_index():
+    """Indice spaziale dei punti di interesse della sessione, creato alla prima ricerca"""
+    if 'poi_index' not in st.session_state:
+        from poi_index import PoiIndex
+        st.session_state.poi_index = PoiIndex()
+    return st.session_state.poi_index
+
+@timed("render.display_nearby")
+def display_nearby(city_name, category, key, item):
+    """Posizione dell'elemento e punti di interesse vicini tra quelli delle città caricate"""
+    from poi_index import item_coordinates
     
-    if not has_items:
-        del current_data["dati_citta"][city_name]
+    coords = item_coordinates(item)
+    if coords is None:
+        return
+    st.write(f"**Posizione:** {coords[0]:.6f}, {coords[1]:.6f}")
+    radius = st.number_input(
+        "📍 Nelle vicinanze (km)", min_value=0.1, max_value=50.0, value=1.0, step=0.5,
+        key=f"radius_{category}_{key}_{city_name}"
+    )
+    with timer("poi.ricerca"):
+        grid = get_poi_index().grid(st.session_state.data)
+        this = (city_name, category, key, item.get("nome", ""))
+        nearby = [result for result in grid.within(coords[0], coords[1], radius) if result[0] != this]
+        if not nearby:
+            nearby = grid.nearest(coords[0], coords[1], k=5, exclude=this)
+            if nearby:
+                st.caption(f"Nessun punto entro {radius:g} km, i più vicini:")
+    if nearby:
+        import pandas as pd
+        
+        st.dataframe(
+            pd.DataFrame([
+                {
+                    "Nome": other_name,
+                    "Categoria": CATEGORY_LABELS[other_category],
+                    "Città": other_city,
+                    "Distanza (km)": round(distance, 2)
+                }
+                for (other_city, other_category, _, other_name), distance in nearby
+            ]),
+            hide_index=True,
+            use_container_width=True
+        )
+
+@timed("render.display_item_list")
+def display_item_list(items, category, city_name, render_item):
+    """Tabella paginata e ricercabile degli elementi; il dettaglio viene mostrato solo per l'elemento scelto"""
+    state_key = f"{category}_{city_name}"
+    col1, col2 = st.columns([3, 1])
+    with col1:
+        query = st.text_input("🔍 Cerca", key=f"search_{state_key}").strip().lower()
+    with col2:
+        page_size = st.selectbox("Elementi per pagina", ITEM_PAGE_SIZES, key=f"page_size_{state_key}")
+
+    keys = [
+        key for key, item in items.items()
+        if isinstance(item, dict) and (not query or item_matches(item, query))
+    ]
+    if not keys:
+        st.info("Nessun elemento corrisponde alla ricerca")
+        return
+
+    pages = -(-len(keys) // page_size)
+    page_key = f"page_{state_key}"
+    # Dopo una ricerca o un cambio di dimensione la pagina salvata può non esistere più
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    page = st.number_input("Pagina", min_value=1, max_value=pages, step=1, key=page_key) if pages > 1 else 1
+    page_keys = keys[(page - 1) * page_size:page * page_size]
+
+    import pandas as pd
     
-    return current_data
+    columns = TABLE_COLUMNS[category]
+    st.dataframe(
+        pd.DataFrame([
+            # Gli elementi senza valuta sono in euro
+            {label: item_currency(items[key]) if field == "valuta" else items[key].get(field) for field, label in columns.items()}
+            for key in page_keys
+        ]),
+        hide_index=True,
+        use_container_width=True
+    )
+    st.caption(f"{len(keys)} elementi · pagina {page} di {pages}")
 
+    selected = st.selectbox(
+        "Dettagli",
+        page_keys,
+        index=None,
+        format_func=lambda key: item_label(category, items[key]),
+        placeholder="Seleziona un elemento per vedere i dettagli",
+        key=f"detail_{state_key}_{page}"
+    )
+    if selected in items:
+        render_item(selected, items[selected], city_name)
 
+def render_accommodation(key, alloggio, city_name):
+    """Dettaglio di un alloggio"""
+    with st.expander(f"🏨 {alloggio.get('nome', 'Alloggio')}", expanded=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.write(f"**Tipo:** {alloggio.get('tipo', 'N/A')}")
+            st.write(f"**Indirizzo:** {alloggio.get('indirizzo', 'N/A')}")
+            st.write(f"**Notti:** {alloggio.get('notti', 0)}")
+            st.write(f"**Costo totale:** {format_amount(alloggio.get('costo', 0), item_currency(alloggio))}")
+            st.write(f"**Costo per notte:** {format_amount(alloggio.get('costo', 0) / max(alloggio.get('notti', 1), 1), item_currency(alloggio))}")
+        with col2:
+            st.write(f"**Check-in:** {alloggio.get('check_in_date', 'N/A')}")
+            st.write(f"**Orario check-in:** {alloggio.get('orario_check_in', 'N/A')}")
+            st.write(f"**Check-out:** {alloggio.get('check_out_date', 'N/A')}")
+            st.write(f"**Orario check-out:** {alloggio.get('orario_check_out', 'N/A')}")
+        with col3:
+            st.write(f"**Numero conferma:** {alloggio.get('numero_conferma', 'N/A')}")
+            st.write(f"**Codice PIN:** {alloggio.get('codice_pin', 'N/A')}")
+            if alloggio.get('link_booking'):
+                st.write(f"**Link Booking:** [{alloggio['link_booking'].split('/')[-1]}]({alloggio['link_booking']})")
+            if st.button("🗑️", key=f"delete_alloggio_{key}_{city_name}"):
+                delete_city_item(city_name, "alloggi", key)
+        
+        if alloggio.get('note'):
+            st.write(f"**Note:** {alloggio['note']}")
+        display_nearby(city_name, "alloggi", key, alloggio)
+
+@timed("render.display_accommodations")
 def display_accommodations(alloggi, city_name):
     """Visualizza i dettagli degli alloggi per una città"""
     if alloggi:
-        for key, alloggio in alloggi.items():
-            with st.expander(f"🏨 {alloggio.get('nome', 'Alloggio')}", expanded=True):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write(f"**Tipo:** {alloggio.get('tipo', 'N/A')}")
-                    st.write(f"**Indirizzo:** {alloggio.get('indirizzo', 'N/A')}")
-                    st.write(f"**Notti:** {alloggio.get('notti', 0)}")
-                    st.write(f"**Costo totale:** €{alloggio.get('costo', 0):,.2f}")
-                    st.write(f"**Costo per notte:** €{(alloggio.get('costo', 0) / max(alloggio.get('notti', 1), 1)):,.2f}")
-                with col2:
-                    st.write(f"**Check-in:** {alloggio.get('check_in_date', 'N/A')}")
-                    st.write(f"**Orario check-in:** {alloggio.get('orario_check_in', 'N/A')}")
-                    st.write(f"**Check-out:** {alloggio.get('check_out_date', 'N/A')}")
-                    st.write(f"**Orario check-out:** {alloggio.get('orario_check_out', 'N/A')}")
-                with col3:
-                    st.write(f"**Numero conferma:** {alloggio.get('numero_conferma', 'N/A')}")
-                    st.write(f"**Codice PIN:** {alloggio.get('codice_pin', 'N/A')}")
-                    if alloggio.get('link_booking'):
-                        st.write(f"**Link Booking:** [{alloggio['link_booking'].split('/')[-1]}]({alloggio['link_booking']})")
-                    if st.button("🗑️", key=f"delete_alloggio_{key}_{city_name}"):
-                        current_data = st.session_state.data
-                        del current_data["dati_citta"][city_name]["alloggi"][key]
-                        current_data = check_and_cleanup_city(city_name, current_data)
-                        if db.save_trip_data(current_data):
-                            st.rerun()
-                
-                if alloggio.get('note'):
-                    st.write(f"**Note:** {alloggio['note']}")
+        display_item_list(alloggi, "alloggi", city_name, render_accommodation)
     else:
         st.info("Nessun alloggio inserito per questa città")
 
+def render_restaurant(key, ristorante, city_name):
+    """Dettaglio di un ristorante"""
+    with st.expander(f"🍜 {ristorante.get('nome', 'Ristorante')}", expanded=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.write(f"**Tipo:** {ristorante.get('tipo', 'N/A')}")
+            st.write(f"**Quartiere:** {ristorante.get('quartiere', 'N/A')}")
+            st.write(f"**Stazione:** {ristorante.get('stazione', 'N/A')}")
+        with col2:
+            st.write(f"**Orari:** {ristorante.get('orario_apertura', 'N/A')} - {ristorante.get('orario_chiusura', 'N/A')}")
+            if ristorante.get('data_visita'):
+                st.write(f"**Visita:** {ristorante['data_visita']} {ristorante.get('orario_visita') or ''}")
+            st.write(f"**Prenotazione necessaria:** {'Sì' if ristorante.get('prenotazione', False) else 'No'}")
+            st.write(f"**Costo:** {format_amount(ristorante.get('costo', 0), item_currency(ristorante))} per persona")
+            if ristorante.get('link'):
+                st.write(f"**Link:** [{ristorante['link'].split('/')[-1]}]({ristorante['link']})")
+        with col3:
+            if st.button("🗑️", key=f"delete_ristorante_{key}_{city_name}"):
+                delete_city_item(city_name, "ristoranti", key)
+        if ristorante.get('note'):
+            st.write(f"**Note:** {ristorante['note']}")
+        display_nearby(city_name, "ristoranti", key, ristorante)
+
+@timed("render.display_restaurants")
 def display_restaurants(ristoranti, city_name):
     """Visualizza i dettagli dei ristoranti per una città"""
     if ristoranti:
-        for key, ristorante in ristoranti.items():
-            with st.expander(f"🍜 {ristorante.get('nome', 'Ristorante')}", expanded=True):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write(f"**Tipo:** {ristorante.get('tipo', 'N/A')}")
-                    st.write(f"**Quartiere:** {ristorante.get('quartiere', 'N/A')}")
-                    st.write(f"**Stazione:** {ristorante.get('stazione', 'N/A')}")
-                with col2:
-                    st.write(f"**Orari:** {ristorante.get('orario_apertura', 'N/A')} - {ristorante.get('orario_chiusura', 'N/A')}")
-                    st.write(f"**Prenotazione necessaria:** {'Sì' if ristorante.get('prenotazione', False) else 'No'}")
-                    st.write(f"**Costo:** €{ristorante.get('costo', 0):,.2f} per persona")
-                    if ristorante.get('link'):
-                        st.write(f"**Link:** [{ristorante['link'].split('/')[-1]}]({ristorante['link']})")
-                with col3:
-                    if st.button("🗑️", key=f"delete_ristorante_{key}_{city_name}"):
-                        current_data = st.session_state.data
-                        del current_data["dati_citta"][city_name]["ristoranti"][key]
-                        current_data = check_and_cleanup_city(city_name, current_data)
-                        if db.save_trip_data(current_data):
-                            st.rerun()
-                if ristorante.get('note'):
-                    st.write(f"**Note:** {ristorante['note']}")
+        display_item_list(ristoranti, "ristoranti", city_name, render_restaurant)
     else:
         st.info("Nessun ristorante inserito per questa città")
 
+def render_shop(key, negozio, city_name):
+    """Dettaglio di un negozio"""
+    with st.expander(f"🛍️ {negozio.get('nome', 'Negozio')}", expanded=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.write(f"**Tipo:** {negozio.get('tipo', 'N/A')}")
+            st.write(f"**Quartiere:** {negozio.get('quartiere', 'N/A')}")
+            st.write(f"**Stazione:** {negozio.get('stazione', 'N/A')}")
+        with col2:
+            st.write(f"**Orari:** {negozio.get('orario_apertura', 'N/A')} - {negozio.get('orario_chiusura', 'N/A')}")
+            if negozio.get('data_visita'):
+                st.write(f"**Visita:** {negozio['data_visita']} {negozio.get('orario_visita') or ''}")
+            st.write(f"**Prezzo:** {format_amount(negozio.get('costo', 0), item_currency(negozio))}")
+            if negozio.get('link'):
+                st.write(f"**Link:** [{negozio['link'].split('/')[-1]}]({negozio['link']})")
+        with col3:
+            if st.button("🗑️", key=f"delete_negozio_{key}_{city_name}"):
+                delete_city_item(city_name, "negozi", key)
+        if negozio.get('note'):
+            st.write(f"**Note:** {negozio['note']}")
+        display_nearby(city_name, "negozi", key, negozio)
+
+@timed("render.display_shops")
 def display_shops(negozi, city_name):
     """Visualizza i dettagli dei negozi per una città"""
     if negozi:
-        for key, negozio in negozi.items():
-            with st.expander(f"🛍️ {negozio.get('nome', 'Negozio')}", expanded=True):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write(f"**Tipo:** {negozio.get('tipo', 'N/A')}")
-                    st.write(f"**Quartiere:** {negozio.get('quartiere', 'N/A')}")
-                    st.write(f"**Stazione:** {negozio.get('stazione', 'N/A')}")
-                with col2:
-                    st.write(f"**Orari:** {negozio.get('orario_apertura', 'N/A')} - {negozio.get('orario_chiusura', 'N/A')}")
-                    st.write(f"**Prezzo:** €{negozio.get('costo', 0):,.2f}")
-                    if negozio.get('link'):
-                        st.write(f"**Link:** [{negozio['link'].split('/')[-1]}]({negozio['link']})")
-                with col3:
-                    if st.button("🗑️", key=f"delete_negozio_{key}_{city_name}"):
-                        current_data = st.session_state.data
-                        del current_data["dati_citta"][city_name]["negozi"][key]
-                        current_data = check_and_cleanup_city(city_name, current_data)
-                        if db.save_trip_data(current_data):
-                            st.rerun()
-                if negozio.get('note'):
-                    st.write(f"**Note:** {negozio['note']}")
+        display_item_list(negozi, "negozi", city_name, render_shop)
     else:
         st.info("Nessun negozio inserito per questa città")
 
+def render_activity(key, attivita_item, city_name):
+    """Dettaglio di un'attività"""
+    with st.expander(f"🎯 {attivita_item.get('nome', 'Attività')}", expanded=True):
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            st.write(f"**Tipo:** {attivita_item.get('tipo', 'N/A')}")
+            st.write(f"**Quartiere:** {attivita_item.get('quartiere', 'N/A')}")
+            st.write(f"**Stazione:** {attivita_item.get('stazione', 'N/A')}")
+        with col2:
+            st.write(f"**Orari:** {attivita_item.get('orario_apertura', 'N/A')} - {attivita_item.get('orario_chiusura', 'N/A')}")
+            if attivita_item.get('data_visita'):
+                st.write(f"**Visita:** {attivita_item['data_visita']} {attivita_item.get('orario_visita') or ''}")
+            if attivita_item.get('link'):
+                st.write(f"**Link:** [{attivita_item['link'].split('/')[-1]}]({attivita_item['link']})")
+            st.write(f"**Costo:** {format_amount(attivita_item.get('costo', 0), item_currency(attivita_item))}")
+            st.write(f"**Prenotazione necessaria:** {'Sì' if attivita_item.get('prenotazione', False) else 'No'}")
+        with col3:
+            if st.button("🗑️", key=f"delete_attivita_{key}_{city_name}"):
+                delete_city_item(city_name, "attivita", key)
+        if attivita_item.get('note'):
+            st.write(f"**Note:** {attivita_item['note']}")
+        display_nearby(city_name, "attivita", key, attivita_item)
+
+@timed("render.display_activities")
 def display_activities(attivita, city_name):
     """Visualizza i dettagli delle attività per una città"""
     if attivita:
-        for key, attivita_item in attivita.items():
-            with st.expander(f"🎯 {attivita_item.get('nome', 'Attività')}", expanded=True):
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.write(f"**Tipo:** {attivita_item.get('tipo', 'N/A')}")
-                    st.write(f"**Quartiere:** {attivita_item.get('quartiere', 'N/A')}")
-                    st.write(f"**Stazione:** {attivita_item.get('stazione', 'N/A')}")
-                with col2:
-                    st.write(f"**Orari:** {attivita_item.get('orario_apertura', 'N/A')} - {attivita_item.get('orario_chiusura', 'N/A')}")
-                    if attivita_item.get('link'):
-                        st.write(f"**Link:** [{attivita_item['link'].split('/')[-1]}]({attivita_item['link']})")
-                    st.write(f"**Costo:** €{attivita_item.get('costo', 0):,.2f}")
-                    st.write(f"**Prenotazione necessaria:** {'Sì' if attivita_item.get('prenotazione', False) else 'No'}")
-                with col3:
-                    if st.button("🗑️", key=f"delete_attivita_{key}_{city_name}"):
-                        current_data = st.session_state.data
-                        del current_data["dati_citta"][city_name]["attivita"][key]
-                        current_data = check_and_cleanup_city(city_name, current_data)
-                        if db.save_trip_data(current_data):
-                            st.rerun()
-                if attivita_item.get('note'):
-                    st.write(f"**Note:** {attivita_item['note']}")
+        display_item_list(attivita, "attivita", city_name, render_activity)
     else:
         st.info("Nessuna attività inserita per questa città")
 
+def render_transport(key, trasporto, city_name):
+    """Dettaglio di un trasporto o del Japan Rail Pass"""
+    if trasporto.get('tipo') == "Japan Rail Pass":
+        with st.expander("🎫 Japan Rail Pass", expanded=True):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.write(f"**Costo:** {format_amount(trasporto.get('costo', 0), item_currency(trasporto))}")
+                st.write(f"**Durata:** {trasporto.get('durata', 'N/A')}")
+            with col2:
+                st.write(f"**Note:** {trasporto.get('note', 'Nessuna nota')}")
+            with col3:
+                if st.button("🗑️", key=f"delete_jrp_{key}_{city_name}"):
+                    delete_city_item(city_name, "trasporti", key)
+    else:
+        with st.expander(f"🚄 {trasporto.get('tipo', 'Trasporto')} - {trasporto.get('partenza', 'N/A')} ➔ {trasporto.get('arrivo', 'N/A')}", expanded=True):
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.write(f"**Tipo:** {trasporto.get('tipo', 'N/A')}")
+                st.write(f"**Tratta:** {trasporto.get('partenza', 'N/A')} ➔ {trasporto.get('arrivo', 'N/A')}")
+            with col2:
+                st.write(f"**Costo:** {format_amount(trasporto.get('costo', 0), item_currency(trasporto))}")
+                st.write(f"**Note:** {trasporto.get('note', 'Nessuna nota')}")
+            with col3:
+                if st.button("🗑️", key=f"delete_trasporto_{key}_{city_name}"):
+                    delete_city_item(city_name, "trasporti", key)
+
+@timed("render.display_transports")
 def display_transports(trasporti, city_name):
     """Visualizza i dettagli dei trasporti per una città"""
     if trasporti:
-        for key, trasporto in trasporti.items():
-            if trasporto.get('tipo') == "Japan Rail Pass":
-                with st.expander("🎫 Japan Rail Pass", expanded=True):
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.write(f"**Costo:** €{trasporto.get('costo', 0):,.2f}")
-                        st.write(f"**Durata:** {trasporto.get('durata', 'N/A')}")
-                    with col2:
-                        st.write(f"**Note:** {trasporto.get('note', 'Nessuna nota')}")
-                    with col3:
-                        if st.button("🗑️", key=f"delete_jrp_{key}_{city_name}"):
-                            current_data = st.session_state.data
-                            del current_data["dati_citta"][city_name]["trasporti"][key]
-                        if db.save_trip_data(current_data):
-                            st.rerun()
-            else:
-                with st.expander(f"🚄 {trasporto.get('tipo', 'Trasporto')} - {trasporto.get('partenza', 'N/A')} ➔ {trasporto.get('arrivo', 'N/A')}", expanded=True):
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.write(f"**Tipo:** {trasporto.get('tipo', 'N/A')}")
-                        st.write(f"**Tratta:** {trasporto.get('partenza', 'N/A')} ➔ {trasporto.get('arrivo', 'N/A')}")
-                    with col2:
-                        st.write(f"**Costo:** €{trasporto.get('costo', 0):,.2f}")
-                        st.write(f"**Note:** {trasporto.get('note', 'Nessuna nota')}")
-            with col3:
-                if st.button("🗑️", key=f"delete_trasporto_{key}_{city_name}"):
-                    current_data = st.session_state.data
-                    del current_data["dati_citta"][city_name]["trasporti"][key]
-                    current_data = check_and_cleanup_city(city_name, current_data)
-                    if db.save_trip_data(current_data):
-                        st.rerun()
+        display_item_list(trasporti, "trasporti", city_name, render_transport)
     else:
         st.info("Nessun trasporto inserito per questa città")
 
+@timed("render.display_city_costs")
 def display_city_costs():
     """Visualizza i costi per ogni città"""
     st.header("Riepilogo Finale")
     
     # Filtra solo le città che hanno effettivamente dati
-    cities_with_data = []
-    for city_name, city_data in st.session_state.data["dati_citta"].items():
-        has_items = False
-        for category in ["alloggi", "ristoranti", "negozi", "attivita", "trasporti"]:
-            if city_data.get(category) and len(city_data[category]) > 0:
-                has_items = True
-                break
-        if has_items:
-            cities_with_data.append(city_name)
+    cities_with_data = list(indexed_active_cities(st.session_state.data))
     
     if cities_with_data:
         selected_city = st.selectbox("Seleziona la città", options=cities_with_data)
         
         if selected_city:
-            city_data = st.session_state.data["dati_citta"][selected_city]
+            try:
+                city_data = db.load_city(st.session_state.data, selected_city)
+            except Exception as e:
+                st.error(f"Errore nel caricamento dati città: {storage_error(e)}")
+                return
             st.subheader(f"Dettaglio costi per {selected_city}")
             
             categoria = st.selectbox(
@@ -544,20 +1031,30 @@ def display_city_costs():
     else:
         st.warning("Nessuna città con dati disponibili.")
 
-def display_city_summary(city_data):
+@timed("render.display_city_summary")
+def display_city_summary(city_name):
     """Visualizza il riepilogo dei costi per una città"""
+    import pandas as pd
+    from trip_analytics import category_totals
+    
     st.subheader("Riepilogo Costi")
     
-    total_costs = {
-        "Alloggi": sum(item["costo"] for item in city_data.get("alloggi", {}).values()),
-        "Ristoranti": sum(item["costo"] for item in city_data.get("ristoranti", {}).values()),
-        "Negozi": sum(item["costo"] for item in city_data.get("negozi", {}).values()),
-        "Attività": sum(item["costo"] for item in city_data.get("attivita", {}).values()),
-        "Trasporti": sum(item["costo"] for item in city_data.get("trasporti", {}).values())
-    }
+    try:
+        db.load_city(st.session_state.data, city_name)
+    except Exception as e:
+        st.error(f"Errore nel caricamento dati città: {storage_error(e)}")
+        return
+    # Aggregazione raggruppata sulla tabella degli elementi (ricostruita solo se i dati cambiano),
+    # con i costi convertiti in euro una volta per snapshot dei tassi
+    with timer("riepilogo.aggregazione"):
+        frame = get_items_table().frame(st.session_state.data, get_rate_table())
+        totals = category_totals(frame, city_name, "costo_eur")
     
     # Create summary DataFrame
-    df_summary = pd.DataFrame(list(total_costs.items()), columns=["Categoria", "Costo"])
+    df_summary = pd.DataFrame({
+        "Categoria": [CATEGORY_LABELS[category] for category in totals.index],
+        "Costo": totals["totale"].to_numpy()
+    })
     df_summary.loc[len(df_summary)] = ["TOTALE", df_summary["Costo"].sum()]
     
     # Display summary table
@@ -567,6 +1064,7 @@ def display_city_summary(city_data):
         use_container_width=True
     )
 
+@timed("render.display_flight_costs")
 def display_flight_costs():
     """Visualizza i costi di volo e pre-partenza"""
     st.header("Costi Pre-Partenza")
@@ -620,53 +1118,29 @@ def display_flight_costs():
     else:
         st.info("Nessun dato di pre-partenza disponibile")
 
-def create_japan_map():
-    """Crea e restituisce una mappa Folium centrata sul Giappone"""
-    mappa = folium.Map(
-        location=[36.2048, 138.2529],
-        zoom_start=5,
-        tiles="cartodb positron",
-        control_scale=True
-    )
-    
-    # Aggiungi controlli alla mappa
-    mappa.add_child(plugins.MiniMap())
-    mappa.add_child(plugins.Fullscreen())
-    mappa.add_child(plugins.MeasureControl(
-        position='bottomleft',
-        primary_length_unit='kilometers'
-    ))
-    
-    # Aggiungi marker per le città con dati attivi
-    for city_name, coords in JAPAN_CITIES.items():
-        if city_name in st.session_state.data["dati_citta"]:
-            # Verifica se ci sono elementi attivi in qualsiasi categoria
-            city_data = st.session_state.data["dati_citta"][city_name]
-            has_active_items = False
-            
-            # Controlla tutte le categorie per elementi attivi
-            for category in ["alloggi", "ristoranti", "negozi", "attivita", "trasporti"]:
-                if city_data.get(category) and len(city_data[category]) > 0:
-                    has_active_items = True
-                    break
-            
-            # Aggiungi il marker solo se ci sono elementi attivi
-            if has_active_items:
-                popup_html = f"""
-                <div style='font-family: Arial, sans-serif; width: 200px;'>
-                    <h4>{city_name}</h4>
-                    <p>Clicca per visualizzare i dettagli</p>
-                </div>
-                """
-                
-                folium.Marker(
-                    location=[coords['lat'], coords['lon']],
-                    popup=folium.Popup(popup_html, max_width=300),
-                    tooltip=f"{city_name}",
-                    icon=folium.Icon(color='red', icon='info-sign')
-                ).add_to(mappa)
+@timed("mappa.create_japan_map")
+def create_japan_map(with_pois=False, with_photos=False):
+    """Restituisce la mappa Folium centrata sul Giappone (dalla cache) e la chiave del componente.
+
+    Con with_pois vengono caricate tutte le città e aggiunti i punti di interesse con coordinate.
+    Con with_photos vengono aggiunte le foto con coordinate GPS, lette dall'indice delle foto.
+    """
+    from japan_map import build_japan_map, map_key
     
-    return mappa
+    active_cities = indexed_active_cities(st.session_state.data)
+    pois = ()
+    if with_pois:
+        try:
+            db.load_all_cities(st.session_state.data)
+        except Exception as e:
+            st.error(f"Errore nel caricamento delle città: {storage_error(e)}")
+        grid = get_poi_index().grid(st.session_state.data)
+        pois = tuple(
+            (float(lat), float(lon), name, category)
+            for lat, lon, (_, category, _, name) in zip(grid.lats, grid.lons, grid.payloads)
+        )
+    photos = get_photo_watcher().index.geotagged() if with_photos else ()
+    return build_japan_map(active_cities, tiles_url(), pois, photos), map_key(active_cities, with_pois, with_photos)
 
 def handle_pre_partenza():
     """Gestisce la sezione pre-partenza"""
@@ -800,7 +1274,10 @@ def handle_pre_partenza():
             }
             
             st.session_state.data["costi_partenza"] = pre_partenza_data
-            if db.save_trip_data(st.session_state.data):
+            record_rate(st.session_state.data, "JPY", tasso_cambio)
+            changes = ChangeTracker()
+            changes.mark_document()
+            if db.queue_changes(st.session_state.data, changes):
                 st.success("Dati salvati con successo!")
 
 def handle_city_activities():
@@ -822,7 +1299,7 @@ def handle_city_activities():
             st.session_state.data["dati_citta"] = {}
         
         # Inizializza la struttura dati per la città selezionata se non esiste
-        if citta not in st.session_state.data["dati_citta"]:
+        if db.load_city(st.session_state.data, citta) is None:
             empty_structure = db.get_empty_city_structure()
             # Aggiungi le coordinate dalla costante JAPAN_CITIES
             if citta in JAPAN_CITIES:
@@ -830,11 +1307,14 @@ def handle_city_activities():
             st.session_state.data["dati_citta"][citta] = empty_structure
             
             # Salva immediatamente la struttura vuota nel database
-            if not db.save_trip_data(st.session_state.data):
+            changes = ChangeTracker()
+            changes.mark_city(citta)
+            if not db.queue_changes(st.session_state.data, changes):
                 st.error(f"Errore durante l'inizializzazione dei dati per {citta}")
                 return
     except Exception as e:
-        st.error(f"Errore durante l'elaborazione dei dati: {str(e)}")
+        # Città non caricata: niente modifiche, che sovrascriverebbero quella salvata
+        st.error(f"Errore durante l'elaborazione dei dati: {storage_error(e)}")
         return
         
     # Applica stili per i pulsanti
@@ -956,40 +1436,170 @@ def handle_city_activities():
         submit = st.form_submit_button("Salva Dati")
         
         if submit:
+            changes = ChangeTracker()
             if citta not in st.session_state.data["dati_citta"]:
                 st.session_state.data["dati_citta"][citta] = db.get_empty_city_structure()
+                changes.mark_city(citta)
             
+            undo = []
             for category, data in data_to_save.items():
                 if data:  # se ci sono dati da salvare
-                    # Ottieni il numero massimo esistente per la categoria
-                    existing_items = st.session_state.data["dati_citta"][citta][category]
-                    existing_keys = [k for k in existing_items.keys() if k.startswith(f"{category[:-1]}_")]
-                    max_num = 0
-                    if existing_keys:
-                        max_num = max([int(k.split('_')[-1]) for k in existing_keys])
-                    
-                    # Aggiungi i nuovi elementi con numeri incrementali
-                    for item in data.values():
-                        if isinstance(item, dict) and (item.get('nome') or category == "trasporti"):
-                            max_num += 1
-                            new_key = f"{category[:-1]}_{max_num}"
-                            st.session_state.data["dati_citta"][citta][category][new_key] = item
+                    # Le nuove chiavi vengono dal contatore della categoria salvato nella città
+                    new_items = [
+                        item for item in data.values()
+                        if isinstance(item, dict) and (item.get('nome') or category == "trasporti")
+                    ]
+                    keys = add_items(st.session_state.data, citta, category, new_items, changes)
+                    undo += removal_operations(citta, category, keys)
+            get_history().record(f"Aggiunta a {citta}", undo)
             
-            if db.save_trip_data(st.session_state.data):
+            if db.queue_changes(st.session_state.data, changes):
                 st.success(f"Dati salvati con successo per {citta}!")
                 st.rerun()  # Aggiorna la pagina per mostrare i nuovi dati
+
+    bulk_input_section(citta, st.session_state.selected_activity)
+    file_import_section(citta, st.session_state.selected_activity)
+
+def file_import_section(citta, category):
+    """Importazione di elementi da file CSV o Excel, letto e salvato a blocchi"""
+    with st.expander("📥 Importa da CSV/Excel"):
+        st.caption(
+            "Le colonne seguono i campi del form. Con le colonne 'citta' e 'categoria' "
+            f"si possono importare più città e categorie; altrimenti si usano {citta} e la categoria selezionata."
+        )
+        uploaded = st.file_uploader("File CSV o XLSX", type=["csv", "xlsx"], key="import_file")
+        batch_size = st.number_input("Elementi per salvataggio", min_value=50, value=500, step=50)
+        
+        if uploaded and st.button("📥 Importa", key="import_submit"):
+            from item_import import read_chunks, import_items
+            
+            progress_text = st.empty()
+            
+            undo = []
+            
+            def commit(changes):
+                # Le chiavi vanno lette prima del salvataggio, che azzera le modifiche
+                undo.extend(changes_to_removals(changes))
+                return db.queue_changes(st.session_state.data, changes)
+            
+            def progress(report):
+                progress_text.write(
+                    f"Righe lette: {report.rows:,} · importate: {report.imported:,} · "
+                    f"duplicate: {report.duplicates:,} · non valide: {report.invalid:,}"
+                )
+            
+            try:
+                report = import_items(
+                    read_chunks(uploaded, uploaded.name),
+                    st.session_state.data,
+                    load_city=lambda city_name: db.load_city(st.session_state.data, city_name),
+                    commit=commit,
+                    default_city=citta,
+                    default_category=category,
+                    batch_size=int(batch_size),
+                    progress=progress
+                )
+            except Exception as e:
+                st.error(f"Errore durante l'importazione: {str(e)}")
+                return
+            finally:
+                # Anche un'importazione interrotta si annulla per i lotti già salvati
+                if not get_history().record(f"Importazione di {uploaded.name}", undo):
+                    st.warning("Importazione troppo grande per essere annullata con ↶ Annulla")
+            
+            st.success(f"Importati {report.imported:,} elementi in {report.batches} salvataggi")
+            if report.errors:
+                with st.expander(f"⚠️ {report.invalid:,} righe non valide"):
+                    st.write("\n".join(f"- {error}" for error in report.errors))
+
+def bulk_input_section(citta, category):
+    """Inserimento di più elementi in una volta da griglia o da tabella incollata"""
+    import pandas as pd
+    
+    with st.expander("📋 Inserimento multiplo"):
+        dtypes = {"numero": "float64", "intero": "float64", "coordinata": "float64", "durata": "float64", "booleano": "bool"}
+        empty_grid = pd.DataFrame({
+            field: pd.Series(dtype=dtypes.get(kind, "object"))
+            for field, kind in ITEM_SCHEMAS[category]
+        })
+        column_config = {"tipo": st.column_config.SelectboxColumn("tipo", options=TYPE_OPTIONS[category])}
+        for field, kind in ITEM_SCHEMAS[category]:
+            if kind in ("numero", "intero"):
+                column_config[field] = st.column_config.NumberColumn(field, min_value=0)
+            elif kind == "durata":
+                column_config[field] = st.column_config.NumberColumn(field, min_value=1, step=15)
+            elif kind == "coordinata":
+                limit = 90 if field == "lat" else 180
+                column_config[field] = st.column_config.NumberColumn(field, min_value=-limit, max_value=limit, format="%.6f")
+            elif kind == "booleano":
+                column_config[field] = st.column_config.CheckboxColumn(field)
+            elif kind == "valuta":
+                column_config[field] = st.column_config.SelectboxColumn(field, options=CURRENCIES)
+        
+        grid = st.data_editor(
+            empty_grid,
+            num_rows="dynamic",
+            column_config=column_config,
+            use_container_width=True,
+            key=f"bulk_grid_{category}_{citta}"
+        )
+        pasted = st.text_area(
+            "Oppure incolla una tabella (con intestazione, separata da tabulazioni, ; o ,)",
+            key=f"bulk_paste_{category}_{citta}"
+        )
+        
+        if st.button("➕ Aggiungi tutti", key=f"bulk_submit_{category}_{citta}"):
+            rows = grid.to_dict("records")
+            if pasted.strip():
+                try:
+                    rows += pd.read_csv(
+                        io.StringIO(pasted), sep=sniff_delimiter(pasted[:4096]), dtype=str
+                    ).to_dict("records")
+                except (pd.errors.ParserError, csv.Error) as e:
+                    st.error(f"Errore nella lettura della tabella incollata: {e}")
+                    return
+            
+            new_items, errors = [], []
+            for number, row in enumerate(rows, start=1):
+                if all(value is None or value != value or value == "" for value in row.values()):
+                    continue  # riga vuota
+                item, row_errors = normalize_item(category, row)
+                if item:
+                    new_items.append(item)
+                else:
+                    errors.append(f"Riga {number}: {', '.join(row_errors)}")
+            
+            for error in errors:
+                st.warning(error)
+            if not new_items:
+                st.info("Nessun elemento valido da aggiungere")
+                return
+            
+            # Tutto il blocco viene salvato con una sola scrittura
+            changes = ChangeTracker()
+            keys = add_items(st.session_state.data, citta, category, new_items, changes)
+            if not get_history().record(f"Inserimento multiplo in {citta}", removal_operations(citta, category, keys)):
+                st.warning("Inserimento troppo grande per essere annullato con ↶ Annulla")
+            if db.queue_changes(st.session_state.data, changes):
+                st.success(f"{len(new_items)} elementi aggiunti a {citta}")
+                st.rerun()
                 
 def handle_costs_summary():
     """Gestisce la sezione riepilogo"""
     st.title("Riepilogo")
     
-    # Ottieni i dati aggiornati dal database
-    current_data = db.get_trip_data()
-    st.session_state.data = current_data
+    # Ottieni i dati aggiornati (dalla cache se la versione non è cambiata);
+    # con salvataggi ancora in coda i dati in sessione sono i più recenti
+    if not db.has_pending_saves():
+        current_data = db.get_trip_data()
+        if current_data.get("meta") == st.session_state.data.get("meta"):
+            # Documento invariato: mantieni le città già caricate in sessione
+            current_data["dati_citta"] = st.session_state.data["dati_citta"]
+        st.session_state.data = current_data
     
     tab_selezionata = st.radio(
         "Seleziona una sezione",
-        ("Costi Pre-Partenza", "Riepilogo Finale"),
+        ("Costi Pre-Partenza", "Riepilogo Finale", "Percorsi e JR Pass"),
         horizontal=True
     )
     
@@ -997,6 +1607,173 @@ def handle_costs_summary():
         display_flight_costs()
     elif tab_selezionata == "Riepilogo Finale":
         display_city_costs()
+    elif tab_selezionata == "Percorsi e JR Pass":
+        display_routes()
+    
+    display_export_section()
+
+def get_route_planner():
+    """Percorsi minimi della sessione, ricalcolati solo quando cambiano le tratte o i tassi"""
+    if 'route_planner' not in st.session_state:
+        from route_planner import RoutePlanner
+        st.session_state.route_planner = RoutePlanner()
+    return st.session_state.route_planner
+
+@timed("render.display_routes")
+def display_routes():
+    """Percorso più economico o più veloce tra due città e confronto delle tratte con il JR Pass"""
+    from route_planner import CRITERIA, format_minutes
+    import pandas as pd
+    
+    st.header("Percorsi e JR Pass")
+    try:
+        db.load_all_cities(st.session_state.data)
+    except Exception as e:
+        st.error(f"Errore nel caricamento delle città: {storage_error(e)}")
+    with timer("percorsi.aggiornamento"):
+        planner = get_route_planner().update(
+            st.session_state.data.get("dati_citta", {}), get_rate_table(), trip_date(st.session_state.data)
+        )
+    graph = planner.graph
+    
+    if len(graph.nodes) < 2:
+        st.info("Inserisci almeno una tratta (partenza e arrivo) nei trasporti per calcolare i percorsi")
+    else:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            origin = st.selectbox("Partenza", graph.nodes, key="percorso_partenza")
+        with col2:
+            destination = st.selectbox("Arrivo", graph.nodes, index=len(graph.nodes) - 1, key="percorso_arrivo")
+        with col3:
+            criterion = st.radio("Criterio", list(CRITERIA), format_func=CRITERIA.get, key="percorso_criterio")
+        
+        route = graph.route(origin, destination, criterion) if origin != destination else None
+        if origin == destination:
+            st.info("Scegli due città diverse")
+        elif route is None:
+            st.warning(f"Nessun percorso tra {origin} e {destination} con le tratte inserite")
+        else:
+            total_cost, total_minutes, legs = route
+            col1, col2, col3 = st.columns(3)
+            col1.metric("Costo totale", f"€{total_cost:,.2f}")
+            col2.metric("Tempo stimato", format_minutes(total_minutes))
+            col3.metric("Tratte", len(legs))
+            st.dataframe(
+                pd.DataFrame([
+                    {
+                        "Tratta": f"{leg['partenza']} ➔ {leg['arrivo']}",
+                        "Tipo": leg["tipo"],
+                        "Costo (€)": round(leg["costo"], 2),
+                        "Tempo stimato": format_minutes(leg["tempo"])
+                    }
+                    for leg in legs
+                ]),
+                hide_index=True,
+                use_container_width=True
+            )
+        st.caption("Tempi stimati dalla distanza tra le città e dalla velocità media del tipo di trasporto; "
+                   "le tratte valgono in entrambe le direzioni")
+    
+    st.subheader("🎫 Conviene il JR Pass?")
+    if not graph.legs:
+        st.info("Nessuna tratta inserita")
+        return
+    st.dataframe(
+        pd.DataFrame([
+            {
+                "Pass": row["pass"],
+                "Prezzo": row["prezzo"],
+                "Tratte coperte": row["tratte_coperte"],
+                "Risparmio": row["risparmio"]
+            }
+            for row in planner.jr_passes
+        ]).style.format({"Prezzo": "€{:,.2f}", "Tratte coperte": "€{:,.2f}", "Risparmio": "€{:,.2f}"}),
+        hide_index=True,
+        use_container_width=True
+    )
+    st.caption("Tratte coperte: somma delle tratte in Shinkansen e treno locale. Il pass conviene se il "
+               "risparmio è positivo e le tratte rientrano nei giorni di validità.")
+
+def get_timeline():
+    """Timeline del viaggio della sessione, aggiornata solo per le città modificate"""
+    if 'timeline' not in st.session_state:
+        from timeline import Timeline
+        st.session_state.timeline = Timeline()
+    return st.session_state.timeline
+
+TIMELINE_ICONS = {"alloggi": "🏨", "ristoranti": "🍜", "negozi": "🛍️", "attivita": "🎯"}
+
+@timed("render.display_timeline")
+def display_timeline():
+    """Vista giorno per giorno di alloggi e visite, con i conflitti trovati"""
+    st.title("Timeline del Viaggio 📅")
+    
+    try:
+        db.load_all_cities(st.session_state.data)
+    except Exception as e:
+        st.error(f"Errore nel caricamento delle città: {storage_error(e)}")
+    with timer("timeline.aggiornamento"):
+        timeline = get_timeline().update(st.session_state.data.get("dati_citta", {}))
+    
+    if not timeline.days:
+        st.info("Nessun elemento con date: aggiungi check-in/check-out agli alloggi o data e orario di visita")
+        return
+    
+    conflicts_by_day = {}
+    for conflict in timeline.conflicts:
+        conflicts_by_day.setdefault(conflict.day, []).append(conflict)
+    if timeline.conflicts:
+        st.warning(f"⚠️ {len(timeline.conflicts)} conflitti in {len(conflicts_by_day)} giorni")
+    else:
+        st.success("Nessun conflitto trovato")
+    
+    only_conflicts = st.checkbox("Mostra solo i giorni con conflitti", key="timeline_solo_conflitti")
+    for day, entries in timeline.days.items():
+        day_conflicts = conflicts_by_day.get(day, [])
+        if only_conflicts and not day_conflicts:
+            continue
+        label = f"{day.strftime('%d-%m-%Y')} · {len(entries)} elementi" + (" ⚠️" if day_conflicts else "")
+        with st.expander(label, expanded=bool(day_conflicts)):
+            for conflict in day_conflicts:
+                st.warning(conflict.message)
+            for entry in entries:
+                icon = TIMELINE_ICONS.get(entry.category, "•")
+                if entry.kind == "soggiorno":
+                    if entry.start.date() == day:
+                        moment = "check-in"
+                    elif entry.end.date() == day:
+                        moment = "check-out"
+                    else:
+                        moment = "notte"
+                    st.write(f"{icon} **{entry.name}** ({entry.city}) · {moment}")
+                else:
+                    st.write(f"{icon} **{entry.start:%H:%M} - {entry.end:%H:%M}** {entry.name} ({entry.city})")
+
+def display_export_section():
+    """Esporta il riepilogo completo del viaggio in Excel o PDF"""
+    with st.expander("📤 Esporta riepilogo"):
+        formato = st.radio("Formato", ("Excel (XLSX)", "PDF"), horizontal=True)
+        if st.button("Genera file"):
+            export, extension, mime = (
+                (export_xlsx, "xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+                if formato.startswith("Excel") else (export_pdf, "pdf", "application/pdf")
+            )
+            # Le righe vengono scritte su un file temporaneo; le città non caricate
+            # vengono lette una alla volta senza aggiungerle alla sessione
+            with tempfile.TemporaryFile() as output:
+                try:
+                    items = export(st.session_state.data, output, city_loader=db.get_city_data, rates=get_rate_table())
+                except Exception as e:
+                    st.error(f"Errore durante l'esportazione: {str(e)}")
+                    return
+                output.seek(0)
+                content = output.read()
+            st.download_button(
+                f"⬇️ Scarica {extension.upper()} ({items:,} elementi)",
+                data=content,
+                file_name=f"viaggio_giappone.{extension}",
+                mime=mime
+            )
 
 def display_photo_gallery():
     """Mostra la galleria fotografica con link personalizzabile e salvataggio nel database"""
@@ -1030,46 +1807,279 @@ def display_photo_gallery():
             
             if submit_link and custom_link:
                 st.session_state.data["custom_gallery_link"] = custom_link
-                if db.save_trip_data(st.session_state.data):
+                changes = ChangeTracker()
+                changes.mark_document()
+                if db.queue_changes(st.session_state.data, changes):
                     st.success("Link salvato con successo!")
                 else:
                     st.error("Errore nel salvataggio del link")
+    
+    display_local_gallery()
+
+PHOTO_PAGE_SIZES = [24, 48, 96]
+PHOTO_COLUMNS = 6
+
+def display_thumbnails(photos, thumbnails):
+    """Griglia delle anteprime pronte: le foto originali non vengono mai lette"""
+    columns = st.columns(PHOTO_COLUMNS)
+    for position, photo in enumerate(photos):
+        thumbnail = thumbnails.get(photo[0])
+        with columns[position % PHOTO_COLUMNS]:
+            if thumbnail:
+                st.image(thumbnail, caption=os.path.basename(photo[0]), use_container_width=True)
+            else:
+                st.caption(f"⏳ {os.path.basename(photo[0])}: anteprima in preparazione")
+
+@timed("render.display_home_photos")
+def display_home_photos():
+    """12 foto casuali nella Home, scelte una volta per sessione dall'indice delle foto"""
+    index = get_photo_watcher().index
+    # Nuovo campione solo quando l'indice cambia (foto aggiunte, modificate o rimosse): nessuna query a ogni rerun
+    if st.session_state.get("home_photos_version") != index.version:
+        st.session_state.home_photos = index.sample(12)
+        st.session_state.home_photos_version = index.version
+    if not st.session_state.home_photos:
+        return
+    st.subheader("📸 Foto del viaggio")
+    with timer("foto.anteprime"):
+        thumbnails = get_thumbnail_cache().lookup(st.session_state.home_photos)
+    display_thumbnails(st.session_state.home_photos, thumbnails)
+
+def photo_filters(index):
+    """Filtri della galleria per città e intervallo di date di scatto: (inizio, fine, città)"""
+    col1, col2 = st.columns(2)
+    with col1:
+        cities = index.cities()
+        labels = {"Tutte": None} | {f"{city} ({count})": city for city, count in cities}
+        city = labels[st.selectbox("Città", list(labels), key="foto_citta")]
+    start = end = None
+    first, last = index.date_range()
+    with col2:
+        if first is not None:
+            selected = st.date_input("Date di scatto", value=(first, last), min_value=first, max_value=last, key="foto_date")
+            # Durante la scelta dell'intervallo è selezionata solo la prima data
+            if isinstance(selected, (list, tuple)) and len(selected) == 2:
+                start, end = selected
+                if (start, end) == (first, last):
+                    # Intervallo completo: comprese le foto senza data di scatto
+                    start = end = None
+    return start, end, city
+
+@timed("render.display_local_gallery")
+def display_local_gallery():
+    """Griglia paginata delle foto indicizzate con le anteprime create in background"""
+    st.markdown("### 🗂️ Foto locali")
+    watcher = get_photo_watcher()
+    index = watcher.index
+    if not index.count():
+        if watcher.status()["in_corso"]:
+            st.info("⏳ Indicizzazione delle foto in corso...")
+        else:
+            st.info("Nessuna foto trovata: inserisci le foto (jpg, jpeg, png, gif) nella cartella photos")
+        return
+    
+    start, end, city = photo_filters(index)
+    with timer("foto.indice"):
+        total = index.count(start, end, city)
+    if not total:
+        st.info("Nessuna foto per i filtri selezionati")
+        return
+    
+    col1, col2, col3 = st.columns([1, 1, 2])
+    with col1:
+        page_size = st.selectbox("Foto per pagina", PHOTO_PAGE_SIZES, key="foto_per_pagina")
+    pages = -(-total // page_size)
+    if st.session_state.get("foto_pagina", 1) > pages:
+        st.session_state["foto_pagina"] = pages
+    with col2:
+        page = st.number_input("Pagina", min_value=1, max_value=pages, step=1, key="foto_pagina")
+    with col3:
+        pending = watcher.status()["anteprime_da_creare"]
+        if pending:
+            st.caption(f"⏳ Anteprime in preparazione: {pending:,} rimanenti")
+            if st.button("🔄 Aggiorna"):
+                st.rerun()
+    
+    with timer("foto.indice"):
+        page_photos = index.query(start, end, city, limit=page_size, offset=(page - 1) * page_size)
+    with timer("foto.anteprime"):
+        thumbnails = get_thumbnail_cache().lookup(page_photos)
+    st.caption(f"{total:,} foto · pagina {page} di {pages}")
+    display_thumbnails(page_photos, thumbnails)
+
+def display_save_status():
+    """Mostra nella sidebar lo stato della connessione e dell'ultimo salvataggio in background"""
+    connection = db.connection_status()
+    if connection and connection["stato"] != "chiuso":
+        st.sidebar.warning("⚠️ Database lento o non raggiungibile: nuovo tentativo a breve")
+    if not db.save_queue:
+        return
+    status = db.save_queue.status("default_trip")
+    if status["stato"] == "fallito":
+        st.sidebar.error(
+            f"❌ Salvataggio non riuscito dopo {status['tentativi']} tentativi: {status['errore']}. "
+            "Le modifiche restano in sessione e nel journal locale."
+        )
+        if st.sidebar.button("🔁 Riprova il salvataggio"):
+            db.save_queue.retry("default_trip")
+            st.rerun()
+        return
+    if status["stato"] == "errore":
+        st.sidebar.error(f"❌ Salvataggio non riuscito, nuovo tentativo in corso: {status['errore']}")
+    elif status.get("recuperato"):
+        st.sidebar.info("⏳ Salvataggio delle modifiche rimaste in sospeso prima del riavvio...")
+    elif status["in_coda"]:
+        st.sidebar.info("⏳ Salvataggio in corso...")
+    elif status.get("ultimo_salvataggio"):
+        st.sidebar.caption(f"💾 Ultimo salvataggio: {status['ultimo_salvataggio']}")
+    
+    if status["in_coda"] and st.sidebar.button("💾 Salva ora"):
+        if db.save_queue.flush(timeout=10):
+            st.sidebar.success("Tutte le modifiche sono state salvate")
+        else:
+            st.sidebar.warning("Salvataggio non ancora completato")
+
+def display_backups():
+    """Versioni salvate del viaggio nella sidebar, con il ripristino di una versione precedente"""
+    if not db.backups:
+        return
+    versions = db.backups.versions("default_trip")
+    if not versions:
+        return
+    with st.sidebar.expander("🗄️ Backup"):
+        if db.backups.last_error:
+            st.error(f"Errore nella scrittura dei backup: {db.backups.last_error}")
+        labels = {
+            f"v{version.number} · {version.timestamp:%d-%m-%Y %H:%M:%S} · {version.size / 1024:.1f} KB": version.number
+            for version in reversed(versions)
+        }
+        selected = st.selectbox("Versione", list(labels), key="backup_versione")
+        if st.button("↩️ Ripristina questa versione"):
+            try:
+                restored = db.backups.restore("default_trip", labels[selected])
+            except Exception as e:
+                st.error(f"Errore nel ripristino del backup: {e}")
+                return
+            rebuild_cost_index(restored)
+            st.session_state.data = restored
+            # Le strutture derivate della sessione vanno ricostruite sul documento ripristinato
+            for name in ("items_table", "poi_index", "route_planner", "timeline"):
+                st.session_state.pop(name, None)
+            # Le modifiche della cronologia si riferiscono al documento sostituito
+            get_history().clear()
+            changes = ChangeTracker()
+            changes.mark_full()
+            if db.queue_changes(st.session_state.data, changes):
+                st.rerun()
+            else:
+                st.error("Errore nel salvataggio della versione ripristinata")
+
+def display_profiling_panel(rerun):
+    """Pannello di debug nella sidebar (secret debug_panel) con le misure del rerun e le ultime statistiche"""
+    if not st.secrets.get("debug_panel", False):
+        return
+    with st.sidebar.expander("🛠️ Profilazione"):
+        enabled = st.checkbox("Profilazione attiva", value=metrics.enabled)
+        if enabled != metrics.enabled:
+            metrics.enabled = enabled
+            st.rerun()
+        if st.button("🔍 Verifica indice dei costi"):
+            # L'indice copre tutte le città: quelle non ancora aperte vanno scaricate prima del confronto
+            data = db.load_all_cities(st.session_state.data)
+            errors = check_cost_index(data)
+            if errors:
+                st.error(f"Indice dei costi non allineato ({len(errors)} differenze)")
+                st.code("\n".join(errors[:50]), language=None)
+            else:
+                st.success("Indice dei costi allineato")
+        if not metrics.enabled:
+            st.caption("Attiva la profilazione per raccogliere le misure")
+            return
+        
+        if rerun:
+            st.caption(f"Questo rerun ({len(rerun)} misure)")
+            st.dataframe(
+                [{"sezione": name, "ms": round(seconds * 1000, 1)} for name, seconds in rerun],
+                hide_index=True,
+                use_container_width=True
+            )
+        timers, counters = metrics.summary()
+        if timers:
+            st.caption(f"Ultime {metrics.window} misure per sezione")
+            st.dataframe(
+                [
+                    {"sezione": name, **{key: round(value, 1) for key, value in stats.items()}}
+                    for name, stats in timers.items()
+                ],
+                hide_index=True,
+                use_container_width=True
+            )
+        if counters:
+            st.caption("Contatori")
+            st.dataframe(
+                [{"evento": name, "totale": value} for name, value in sorted(counters.items())],
+                hide_index=True,
+                use_container_width=True
+            )
+        
+        col1, col2 = st.columns(2)
+        with col1:
+            st.download_button("JSON", metrics.to_json(), file_name="metriche.json", mime="application/json")
+        with col2:
+            st.download_button("Prometheus", metrics.to_prometheus(), file_name="metriche.prom", mime="text/plain")
+        if st.button("🧹 Azzera misure"):
+            metrics.reset()
+            st.rerun()
+
 def main():
     """Funzione principale dell'applicazione"""
+    init_profiling()
+    metrics.begin_rerun()
     st.sidebar.title("Viaggio in Giappone")
     pagina = st.sidebar.selectbox(
         "Seleziona una pagina",
-        ["Home", "Volo e Assicurazione", "Attività per Città", "Riepilogo Finale", "Galleria Foto"]
+        ["Home", "Volo e Assicurazione", "Attività per Città", "Timeline", "Riepilogo Finale", "Galleria Foto"],
+        key="pagina"
     )
+    display_save_status()
+    load_session_data()
+    display_history()
+    display_backups()
     
+    with timer(f"pagina.{pagina}"):
+        display_page(pagina)
+    display_profiling_panel(metrics.end_rerun())
+
+def display_page(pagina):
+    """Mostra la pagina selezionata nella sidebar"""
     if pagina == "Home":
+        from streamlit_folium import st_folium
+        
         st.title("Pianificazione Viaggio in Giappone 🗾")
         
         # Mostra la mappa
-        mappa = create_japan_map()
-        st_folium(mappa, width=800, height=600)
+        col1, col2 = st.columns(2)
+        with col1:
+            with_pois = st.checkbox("📍 Mostra punti di interesse", key="mostra_poi")
+        with col2:
+            with_photos = st.checkbox("📷 Mostra foto sulla mappa", key="mostra_foto_mappa")
+        mappa, key = create_japan_map(with_pois, with_photos)
+        # Chiave stabile e nessun valore restituito: pan e zoom non causano rerun
+        # e il componente non viene rimontato finché le città attive non cambiano
+        with timer("mappa.st_folium"):
+            st_folium(mappa, width=800, height=600, key=key, returned_objects=[])
         
         # Mostra statistiche generali se ci sono dati
-        if st.session_state.data["dati_citta"]:
+        if st.session_state.data["dati_citta"] or st.session_state.data.get("indice_citta"):
             st.markdown("<div style='margin-top: 10px;'></div>", unsafe_allow_html=True)
             st.subheader("Statistiche Generali")
             col1, col2, col3 = st.columns(3)
             
-            # Calcola il numero di città con elementi attivi
-            active_cities = 0
-            total_cost = 0
-            for city_name, city_data in st.session_state.data["dati_citta"].items():
-                has_active_items = False
-                city_cost = 0
-                for category in ["alloggi", "ristoranti", "negozi", "attivita", "trasporti"]:
-                    if city_data.get(category) and len(city_data[category]) > 0:
-                        has_active_items = True
-                        if category in ["alloggi", "attivita", "trasporti"]:
-                            city_cost += sum(item.get("costo", 0) for item in city_data[category].values())
-                
-                if has_active_items:
-                    active_cities += 1
-                    total_cost += city_cost
+            # Statistiche lette dall'indice dei costi, convertite in euro per snapshot dei tassi
+            with timer("home.statistiche"):
+                active_cities = len(indexed_active_cities(st.session_state.data))
+                city_totals = get_index_totals().totals(st.session_state.data, get_rate_table())
+                total_cost = float(city_totals[["alloggi", "attivita", "trasporti"]].to_numpy().sum())
             
             pre_departure_cost = st.session_state.data.get("costi_partenza", {}).get("totale_generale", 0)
             
@@ -1077,9 +2087,13 @@ def main():
                 st.metric("Città Pianificate", active_cities)
             with col2:
                 st.metric("Costi Pre-Partenza", f"€{pre_departure_cost:,.2f}")
+            with col3:
+                st.metric("Costi Città", f"€{total_cost:,.2f}")
         
         else:
             st.info("Nessun dato inserito. Inizia aggiungendo i costi pre-partenza o le attività per città!")
+        
+        display_home_photos()
             
     elif pagina == "Volo e Assicurazione":
         handle_pre_partenza()
@@ -1087,6 +2101,9 @@ def main():
     elif pagina == "Attività per Città":
         handle_city_activities()
         
+    elif pagina == "Timeline":
+        display_timeline()
+        
     elif pagina == "Riepilogo Finale":
         handle_costs_summary()
         
@@ -1095,6 +2112,4 @@ def main():
 
 
 if __name__ == "__main__":
-    if 'data' not in st.session_state:
-            st.session_state.data = db.get_trip_data()
     main()
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""Foto locali della cartella photos/ e anteprime salvate in una cache su disco.
+
+Le anteprime sono file JPEG in data/thumbnails, con il nome dato dall'hash del
+contenuto della foto e dalla dimensione dell'anteprima: foto identiche in percorsi
+diversi condividono la stessa anteprima. Il manifest ricorda per ogni foto mtime,
+dimensione e hash, così l'hash viene ricalcolato solo per le foto modificate.
+Le anteprime mancanti vengono create in background in un pool di processi; le
+pagine cercano solo le anteprime pronte e non decodificano mai le foto.
+"""
+
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+
+PHOTO_EXTENSIONS = {".jpg", ".jpeg", ".png", ".gif"}
+THUMBNAIL_SIZE = 320
+# Sotto questo numero di anteprime da creare il pool di processi costa più di quanto fa risparmiare
+POOL_MIN_JOBS = 4
+
+
+def scan_photos(folder: str = "photos"):
+    """Foto della cartella (sottocartelle comprese): lista di (percorso, mtime_ns, dimensione) ordinata"""
+    photos = []
+    pending = [folder]
+    while pending:
+        try:
+            entries = os.scandir(pending.pop())
+        except OSError:
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    pending.append(entry.path)
+                elif os.path.splitext(entry.name)[1].lower() in PHOTO_EXTENSIONS:
+                    stat = entry.stat()
+                    photos.append((entry.path, stat.st_mtime_ns, stat.st_size))
+    photos.sort()
+    return photos
+
+
+def file_hash(path: str):
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def make_thumbnail(source: str, target: str, size: int = THUMBNAIL_SIZE, quality: int = 80):
+    """Crea l'anteprima JPEG di una foto; eseguita nei processi del pool"""
+    from PIL import Image, ImageOps
+
+    with Image.open(source) as image:
+        # Per i JPEG la decodifica avviene già ridotta (scala DCT 1/2, 1/4 o 1/8)
+        image.draft("RGB", (size, size))
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((size, size))
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        Path(target).parent.mkdir(parents=True, exist_ok=True)
+        temporary = f"{target}.{os.getpid()}.tmp"
+        image.save(temporary, "JPEG", quality=quality, optimize=True)
+    os.replace(temporary, target)
+
+
+def _thumbnail_job(source: str, known_hash: str, cache_dir: str, size: int):
+    """Hash del contenuto (se non già noto) e anteprima, se manca: restituisce (hash, errore)"""
+    try:
+        digest = known_hash or file_hash(source)
+        target = ThumbnailCache.path_for(cache_dir, digest, size)
+        if not os.path.exists(target):
+            make_thumbnail(source, target, size)
+        return digest, None
+    except Exception as e:
+        return known_hash, f"{type(e).__name__}: {e}"
+
+
+class ThumbnailCache:
+    """Anteprime su disco indicizzate per hash del contenuto, invalidate dal cambio di mtime o dimensione"""
+
+    def __init__(self, cache_dir: str = "data/thumbnails", size: int = THUMBNAIL_SIZE, workers: int = None):
+        self.cache_dir = cache_dir
+        self.size = size
+        self.workers = workers
+        self._manifest_path = os.path.join(cache_dir, "manifest.json")
+        self._lock = threading.Lock()
+        self._manifest = self._read_manifest()
+
+    @staticmethod
+    def path_for(cache_dir: str, digest: str, size: int):
+        return os.path.join(cache_dir, digest[:2], f"{digest}_{size}.jpg")
+
+    def _read_manifest(self):
+        try:
+            with open(self._manifest_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_manifest(self):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        temporary = self._manifest_path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump(self._manifest, f)
+        os.replace(temporary, self._manifest_path)
+
+    def _known_hash(self, photo):
+        path, mtime, size = photo
+        entry = self._manifest.get(path)
+        if entry and entry["mtime"] == mtime and entry["size"] == size:
+            return entry["hash"]
+        return None
+
+    def cached(self, photo):
+        """Percorso dell'anteprima se è già pronta e la foto non è cambiata, altrimenti None"""
+        with self._lock:
+            digest = self._known_hash(photo)
+        if digest is None:
+            return None
+        target = self.path_for(self.cache_dir, digest, self.size)
+        return target if os.path.exists(target) else None
+
+    def lookup(self, photos):
+        """{percorso foto: percorso anteprima} delle sole anteprime già pronte: nessuna foto viene letta"""
+        result = {}
+        for photo in photos:
+            target = self.cached(photo)
+            if target:
+                result[photo[0]] = target
+        return result
+
+    def ensure(self, photos, progress=None):
+        """Crea le anteprime mancanti e restituisce {percorso foto: percorso anteprima}.
+
+        Le foto già in cache vengono risolte senza leggerle; le altre sono elaborate
+        in un pool di processi (poche foto direttamente in questo processo). I processi
+        vengono avviati con spawn: il server di Streamlit ha già altri thread attivi.
+        """
+        result, missing = {}, []
+        for photo in photos:
+            target = self.cached(photo)
+            if target:
+                result[photo[0]] = target
+            else:
+                with self._lock:
+                    missing.append((photo, self._known_hash(photo)))
+        if not missing:
+            return result
+
+        jobs = [(photo[0], digest, self.cache_dir, self.size) for photo, digest in missing]
+        outcomes = []
+        if len(jobs) >= POOL_MIN_JOBS:
+            context = multiprocessing.get_context("spawn")
+            try:
+                with ProcessPoolExecutor(max_workers=self.workers, mp_context=context) as pool:
+                    for outcome in pool.map(_thumbnail_job, *zip(*jobs), chunksize=max(1, len(jobs) // 64)):
+                        outcomes.append(outcome)
+                        if progress:
+                            progress(len(outcomes), len(jobs))
+            except (BrokenProcessPool, OSError):
+                # Processi non avviabili (es. interprete senza __main__ importabile): si prosegue qui
+                pass
+        for job in jobs[len(outcomes):]:
+            outcomes.append(_thumbnail_job(*job))
+            if progress:
+                progress(len(outcomes), len(jobs))
+
+        with self._lock:
+            for (photo, _), (digest, error) in zip(missing, outcomes):
+                path, mtime, size = photo
+                if digest is None:
+                    continue
+                self._manifest[path] = {"mtime": mtime, "size": size, "hash": digest}
+                if error is None:
+                    result[path] = self.path_for(self.cache_dir, digest, self.size)
+            self._write_manifest()
+        return result
+
+    def prune(self, photos):
+        """Elimina dal manifest le foto che non esistono più"""
+        current = {photo[0] for photo in photos}
+        with self._lock:
+            removed = [path for path in self._manifest if path not in current]
+            for path in removed:
+                del self._manifest[path]
+            if removed:
+                self._write_manifest()
+        return len(removed)
@@ -0,0 +1,298 @@
+"""Indice SQLite delle foto della cartella photos/ aggiornato in modo incrementale.
+
+Per ogni foto l'indice conserva percorso, dimensione, mtime, data di scatto (EXIF),
+coordinate GPS, larghezza, altezza e città più vicina. Un thread di controllo
+confronta periodicamente la cartella con l'indice (mtime e dimensione), rilegge in
+un pool di processi solo le intestazioni delle foto nuove o modificate e ne crea le
+anteprime; le pagine e la mappa interrogano soltanto il database e la cache delle
+anteprime e non aprono mai le foto.
+"""
+
+import multiprocessing
+import os
+import sqlite3
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+
+from cities import JAPAN_CITIES
+from photo_gallery import POOL_MIN_JOBS, scan_photos
+
+# Oltre questa distanza una foto non viene assegnata a nessuna città
+MAX_CITY_KM = 60.0
+# Celle della griglia delle città: dello stesso ordine di MAX_CITY_KM (0.5° ≈ 55 km)
+CITY_CELL_DEG = 0.5
+
+# Tag EXIF: DateTimeOriginal (Exif IFD), DateTime, Exif IFD e GPS IFD
+_EXIF_IFD, _GPS_IFD = 0x8769, 0x8825
+_DATETIME_ORIGINAL, _DATETIME = 0x9003, 0x0132
+
+
+def _gps_degrees(values, ref):
+    degrees, minutes, seconds = (float(value) for value in values)
+    result = degrees + minutes / 60 + seconds / 3600
+    return -result if ref in ("S", "W") else result
+
+
+def read_metadata(path: str):
+    """Data di scatto, coordinate e dimensioni dalla sola intestazione del file (nessuna decodifica)"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        width, height = image.size
+        exif = image.getexif()
+    taken_at = exif.get_ifd(_EXIF_IFD).get(_DATETIME_ORIGINAL) or exif.get(_DATETIME)
+    try:
+        taken_at = datetime.strptime(str(taken_at).strip("\x00 "), "%Y:%m:%d %H:%M:%S").isoformat()
+    except ValueError:
+        taken_at = None
+    lat = lon = None
+    gps = exif.get_ifd(_GPS_IFD)
+    try:
+        lat = _gps_degrees(gps[2], gps.get(1, "N"))
+        lon = _gps_degrees(gps[4], gps.get(3, "E"))
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            lat = lon = None
+    except (KeyError, TypeError, ValueError, ZeroDivisionError):
+        lat = lon = None
+    return {"taken_at": taken_at, "lat": lat, "lon": lon, "width": width, "height": height}
+
+
+def _metadata_job(path: str):
+    """Metadati di una foto: restituisce (metadati, errore); eseguita nei processi del pool"""
+    try:
+        return read_metadata(path), None
+    except Exception as e:
+        return {"taken_at": None, "lat": None, "lon": None, "width": None, "height": None}, f"{type(e).__name__}: {e}"
+
+
+def read_all_metadata(paths, workers: int = None):
+    """Metadati di più foto, in un pool di processi (spawn) quando sono abbastanza da convenire"""
+    outcomes = []
+    if len(paths) >= POOL_MIN_JOBS:
+        context = multiprocessing.get_context("spawn")
+        try:
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                outcomes.extend(pool.map(_metadata_job, paths, chunksize=max(1, len(paths) // 64)))
+        except (BrokenProcessPool, OSError):
+            # Processi non avviabili: si prosegue in questo processo
+            pass
+    outcomes.extend(_metadata_job(path) for path in paths[len(outcomes):])
+    return outcomes
+
+
+@lru_cache(maxsize=1)
+def city_grid():
+    """Indice a griglia delle coordinate di JAPAN_CITIES, costruito una volta"""
+    from poi_index import GridIndex
+    return GridIndex(
+        [(coords["lat"], coords["lon"], city_name) for city_name, coords in JAPAN_CITIES.items()],
+        cell_deg=CITY_CELL_DEG
+    )
+
+
+def nearest_city(lat, lon):
+    """Città di JAPAN_CITIES più vicina entro MAX_CITY_KM, oppure None"""
+    if lat is None or lon is None:
+        return None
+    found = city_grid().within(lat, lon, MAX_CITY_KM)
+    return found[0][0] if found else None
+
+
+class PhotoIndex:
+    """Tabella photos con le informazioni di ogni foto e sincronizzazione con la cartella"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS photos (
+            path TEXT PRIMARY KEY,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            taken_at TEXT,
+            lat REAL,
+            lon REAL,
+            width INTEGER,
+            height INTEGER,
+            city TEXT,
+            error TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_photos_taken_at ON photos (taken_at);
+        CREATE INDEX IF NOT EXISTS idx_photos_city ON photos (city, taken_at);
+    """
+
+    def __init__(self, db_path: str = "data/photos.db", folder: str = "photos", workers: int = None):
+        self.folder = folder
+        self.workers = workers
+        # Aumenta a ogni sincronizzazione che cambia l'indice: chiave delle cache dei chiamanti
+        self.version = 0
+        self._geotagged = None
+        if db_path != ":memory:":
+            Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        if db_path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def sync(self):
+        """Allinea l'indice alla cartella: restituisce (aggiunte o aggiornate, rimosse)"""
+        on_disk = {path: (mtime, size) for path, mtime, size in scan_photos(self.folder)}
+        with self._lock:
+            indexed = {path: (mtime, size) for path, mtime, size in self._conn.execute("SELECT path, mtime_ns, size FROM photos")}
+        removed = [path for path in indexed if path not in on_disk]
+        changed = [path for path, stat in on_disk.items() if indexed.get(path) != stat]
+
+        rows = []
+        for path, (meta, error) in zip(changed, read_all_metadata(changed, self.workers)):
+            mtime, size = on_disk[path]
+            rows.append((
+                path, size, mtime, meta["taken_at"], meta["lat"], meta["lon"], meta["width"], meta["height"],
+                nearest_city(meta["lat"], meta["lon"]), error
+            ))
+
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM photos WHERE path = ?", [(path,) for path in removed])
+            self._conn.executemany("INSERT OR REPLACE INTO photos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            if rows or removed:
+                self.version += 1
+        return len(rows), len(removed)
+
+    def _where(self, start=None, end=None, city=None):
+        clauses, params = ["error IS NULL"], []
+        if start is not None:
+            clauses.append("taken_at >= ?")
+            params.append(start.isoformat())
+        if end is not None:
+            # end è un giorno incluso
+            clauses.append("taken_at < date(?, '+1 day')")
+            params.append(end.isoformat())
+        if city is not None:
+            clauses.append("city = ?")
+            params.append(city)
+        return " AND ".join(clauses), params
+
+    def count(self, start=None, end=None, city=None):
+        where, params = self._where(start, end, city)
+        with self._lock:
+            return self._conn.execute(f"SELECT COUNT(*) FROM photos WHERE {where}", params).fetchone()[0]
+
+    def query(self, start=None, end=None, city=None, limit: int = 48, offset: int = 0):
+        """Foto (percorso, mtime_ns, dimensione) filtrate per data di scatto e città, in ordine di scatto"""
+        where, params = self._where(start, end, city)
+        with self._lock:
+            return self._conn.execute(
+                f"SELECT path, mtime_ns, size FROM photos WHERE {where} "
+                "ORDER BY taken_at IS NULL, taken_at, path LIMIT ? OFFSET ?",
+                params + [limit, offset]
+            ).fetchall()
+
+    def sample(self, n: int = 12):
+        """n foto casuali"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT path, mtime_ns, size FROM photos WHERE error IS NULL ORDER BY RANDOM() LIMIT ?", (n,)
+            ).fetchall()
+
+    def cities(self):
+        """[(città, numero di foto)] delle foto con una città assegnata"""
+        with self._lock:
+            return self._conn.execute(
+                "SELECT city, COUNT(*) FROM photos WHERE city IS NOT NULL AND error IS NULL GROUP BY city ORDER BY city"
+            ).fetchall()
+
+    def geotagged(self):
+        """Foto con coordinate GPS: tupla di (lat, lon, nome file, città, data di scatto).
+
+        Letta dal database e ricalcolata solo quando l'indice cambia.
+        """
+        with self._lock:
+            if self._geotagged is None or self._geotagged[0] != self.version:
+                rows = self._conn.execute(
+                    "SELECT lat, lon, path, city, taken_at FROM photos "
+                    "WHERE lat IS NOT NULL AND error IS NULL ORDER BY path"
+                ).fetchall()
+                self._geotagged = (self.version, tuple(
+                    (lat, lon, os.path.basename(path), city, taken_at) for lat, lon, path, city, taken_at in rows
+                ))
+            return self._geotagged[1]
+
+    def date_range(self):
+        """(prima, ultima) data di scatto come date, oppure (None, None)"""
+        with self._lock:
+            first, last = self._conn.execute(
+                "SELECT MIN(taken_at), MAX(taken_at) FROM photos WHERE error IS NULL"
+            ).fetchone()
+        if first is None:
+            return None, None
+        return datetime.fromisoformat(first).date(), datetime.fromisoformat(last).date()
+
+
+# Anteprime create per ogni giro del pool: il manifest viene aggiornato (e le anteprime mostrate) a ogni lotto
+THUMBNAIL_BATCH = 500
+
+
+class PhotoWatcher:
+    """Thread che sincronizza l'indice con la cartella ogni interval secondi.
+
+    Con thumbnails (ThumbnailCache) dopo ogni sincronizzazione che cambia l'indice
+    crea anche le anteprime mancanti, così le pagine non devono mai crearle.
+    """
+
+    def __init__(self, index: PhotoIndex, interval: float = 30.0, thumbnails=None):
+        self.index = index
+        self.interval = interval
+        self.thumbnails = thumbnails
+        self.thumbnails_pending = 0
+        self._thumbnails_version = None
+        self.last_sync = None
+        self.last_error = None
+        self.syncing = True
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="photo-watcher", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.syncing = True
+            try:
+                self.index.sync()
+                if self.thumbnails is not None and self._thumbnails_version != self.index.version:
+                    self._make_thumbnails()
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            self.syncing = False
+            self.last_sync = time.time()
+            self._stop.wait(self.interval)
+
+    def _make_thumbnails(self):
+        # Le foto non leggibili vengono riprovate solo quando l'indice cambia
+        version = self.index.version
+        photos = self.index.query(limit=-1)
+        missing = [photo for photo in photos if not self.thumbnails.cached(photo)]
+        self.thumbnails_pending = len(missing)
+        for start in range(0, len(missing), THUMBNAIL_BATCH):
+            if self._stop.is_set():
+                return
+            batch = missing[start:start + THUMBNAIL_BATCH]
+            self.thumbnails.ensure(batch)
+            self.thumbnails_pending -= len(batch)
+        self.thumbnails.prune(photos)
+        self._thumbnails_version = version
+
+    def status(self):
+        """Stato del controllo: sincronizzazione in corso, ultimo controllo, anteprime da creare ed eventuale errore"""
+        return {
+            "in_corso": self.syncing and self.last_sync is None,
+            "ultimo_controllo": self.last_sync,
+            "anteprime_da_creare": self.thumbnails_pending,
+            "errore": self.last_error,
+        }
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
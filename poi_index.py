@@ -0,0 +1,160 @@
+"""Coordinate dei punti di interesse e indice spaziale a griglia per le ricerche di vicinanza.
+
+Ogni elemento di alloggi, ristoranti, negozi e attività può avere le coordinate
+lat/lon. I punti vengono distribuiti in celle di cell_deg gradi: una ricerca per
+raggio esamina solo le celle che intersecano il riquadro del cerchio e una ricerca
+dei più vicini si allarga ad anelli di celle finché i risultati trovati non sono
+più vicini di qualunque punto fuori dagli anelli già visitati.
+"""
+
+import math
+
+import numpy as np
+
+from trip_analytics import data_version
+
+POI_CATEGORIES = ["alloggi", "ristoranti", "negozi", "attivita"]
+EARTH_RADIUS_KM = 6371.0088
+
+
+def item_coordinates(item: dict):
+    """(lat, lon) dell'elemento, oppure None se le coordinate mancano o non sono valide"""
+    try:
+        lat, lon = float(item.get("lat")), float(item.get("lon"))
+    except (TypeError, ValueError):
+        return None
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return None
+    return lat, lon
+
+
+def haversine_km(lat, lon, lats, lons):
+    """Distanza in km tra un punto e un array di punti"""
+    lat1, lon1 = math.radians(lat), math.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GridIndex:
+    """Punti (lat, lon) con un payload, raggruppati per cella della griglia"""
+
+    def __init__(self, points, cell_deg: float = 0.02):
+        # points: lista di (lat, lon, payload)
+        self.cell_deg = cell_deg
+        self.payloads = [payload for _, _, payload in points]
+        self.lats = np.array([lat for lat, _, _ in points], dtype=np.float64)
+        self.lons = np.array([lon for _, lon, _ in points], dtype=np.float64)
+
+        cells = {}
+        rows = np.floor(self.lats / cell_deg).astype(np.int64)
+        cols = np.floor(self.lons / cell_deg).astype(np.int64)
+        for position, cell in enumerate(zip(rows.tolist(), cols.tolist())):
+            cells.setdefault(cell, []).append(position)
+        self._cells = {cell: np.array(positions, dtype=np.int64) for cell, positions in cells.items()}
+
+    def __len__(self):
+        return len(self.payloads)
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg)
+
+    def _gather(self, cells):
+        found = [self._cells[cell] for cell in cells if cell in self._cells]
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def _results(self, positions, distances):
+        order = np.argsort(distances, kind="stable")
+        return [(self.payloads[positions[i]], float(distances[i])) for i in order]
+
+    def within(self, lat: float, lon: float, radius_km: float):
+        """Punti entro radius_km dal punto indicato: lista di (payload, distanza km) ordinata"""
+        if not len(self):
+            return []
+        dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+        dlon = dlat / max(math.cos(math.radians(min(abs(lat) + dlat, 89.9))), 1e-6)
+        row_min, col_min = self._cell(lat - dlat, lon - dlon)
+        row_max, col_max = self._cell(lat + dlat, lon + dlon)
+        if (row_max - row_min + 1) * (col_max - col_min + 1) > len(self._cells):
+            # Raggio più grande dell'area occupata: conviene scorrere le celle esistenti
+            cells = [
+                cell for cell in self._cells
+                if row_min <= cell[0] <= row_max and col_min <= cell[1] <= col_max
+            ]
+        else:
+            cells = [(row, col) for row in range(row_min, row_max + 1) for col in range(col_min, col_max + 1)]
+        positions = self._gather(cells)
+        distances = haversine_km(lat, lon, self.lats[positions], self.lons[positions])
+        mask = distances <= radius_km
+        return self._results(positions[mask], distances[mask])
+
+    def nearest(self, lat: float, lon: float, k: int = 5, exclude=None):
+        """I k punti più vicini (escluso il payload exclude): lista di (payload, distanza km)"""
+        center_row, center_col = self._cell(lat, lon)
+        positions = np.empty(0, dtype=np.int64)
+        distances = np.empty(0, dtype=np.float64)
+        ring = 0
+        while True:
+            if (2 * ring + 1) ** 2 > len(self._cells):
+                # Gli anelli coprirebbero più celle di quelle occupate: meglio calcolare tutte le distanze
+                positions = np.arange(len(self), dtype=np.int64)
+                distances = haversine_km(lat, lon, self.lats, self.lons)
+                break
+            if ring == 0:
+                cells = [(center_row, center_col)]
+            else:
+                cells = [
+                    (center_row + dr, center_col + dc)
+                    for dr in range(-ring, ring + 1) for dc in range(-ring, ring + 1)
+                    if max(abs(dr), abs(dc)) == ring
+                ]
+            new = self._gather(cells)
+            if len(new):
+                positions = np.concatenate([positions, new])
+                distances = np.concatenate([distances, haversine_km(lat, lon, self.lats[new], self.lons[new])])
+            # I punti fuori dagli anelli visitati distano almeno ring celle (in longitudine,
+            # misurate alla latitudine più lontana dall'equatore che possono avere)
+            reach = ring * math.radians(self.cell_deg) * EARTH_RADIUS_KM * \
+                math.cos(math.radians(min(abs(lat) + (ring + 1) * self.cell_deg, 89.0)))
+            if len(positions) > k and np.partition(distances, k)[k] <= reach:
+                break
+            ring += 1
+
+        results = self._results(positions, distances)
+        if exclude is not None:
+            results = [result for result in results if result[0] != exclude]
+        return results[:k]
+
+
+def collect_pois(dati_citta: dict):
+    """Punti con coordinate: lista di (lat, lon, (città, categoria, chiave, nome))"""
+    points = []
+    for city_name, city_data in dati_citta.items():
+        for category in POI_CATEGORIES:
+            for key, item in (city_data.get(category) or {}).items():
+                if not isinstance(item, dict):
+                    continue
+                coords = item_coordinates(item)
+                if coords:
+                    points.append((coords[0], coords[1], (city_name, category, key, item.get("nome", ""))))
+    return points
+
+
+class PoiIndex:
+    """Indice spaziale dei punti di interesse ricostruito solo quando i dati cambiano"""
+
+    def __init__(self, cell_deg: float = 0.02):
+        self.cell_deg = cell_deg
+        self._version = None
+        self._grid = None
+
+    def grid(self, data: dict):
+        version = data_version(data)
+        if self._grid is None or version != self._version:
+            self._grid = GridIndex(collect_pois(data.get("dati_citta", {})), self.cell_deg)
+            self._version = version
+        return self._grid
+
+    def invalidate(self):
+        self._grid = None
+        self._version = None
@@ -0,0 +1,155 @@
+"""Chiamate al database con pool di client, timeout, nuovi tentativi e circuit breaker.
+
+Ogni chiamata viene eseguita in un thread del pool condiviso dal processo e attesa
+al massimo per il timeout indicato: un backend lento fa fallire la chiamata invece
+di bloccare la sessione. Gli errori di rete vengono ritentati con backoff
+esponenziale e jitter; dopo troppi errori consecutivi il circuit breaker si apre
+e le chiamate falliscono subito fino al tentativo di prova successivo.
+"""
+
+import math
+import queue
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import contextmanager
+
+
+class BackendUnavailable(Exception):
+    """Il circuit breaker è aperto: il database non viene interrogato"""
+
+    def __init__(self, retry_in: float):
+        super().__init__(f"database temporaneamente non raggiungibile, nuovo tentativo tra {math.ceil(retry_in)} s")
+        self.retry_in = retry_in
+
+
+def is_transient(error: Exception):
+    """Errori di rete o di timeout, per cui ha senso ritentare la chiamata"""
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    # Errori di trasporto del client HTTP usato da supabase (httpx/httpcore)
+    return type(error).__module__.split(".")[0] in ("httpx", "httpcore")
+
+
+class CircuitBreaker:
+    """Interrompe le chiamate dopo failure_threshold errori consecutivi per reset_timeout secondi.
+
+    Allo scadere lascia passare una sola chiamata di prova: se riesce il circuito
+    si richiude, altrimenti resta aperto per un altro periodo.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at = None
+        self._probe = False
+        self._lock = threading.Lock()
+
+    def before_call(self):
+        """Solleva BackendUnavailable se il circuito è aperto"""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0 or self._probe:
+                raise BackendUnavailable(max(remaining, 0))
+            self._probe = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probe = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._probe = False
+            if self._opened_at is not None or self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+
+    def status(self):
+        """Stato del circuito: chiuso, aperto o prova, con gli errori consecutivi"""
+        with self._lock:
+            if self._opened_at is None:
+                state = "chiuso"
+            elif self._probe or time.monotonic() >= self._opened_at + self.reset_timeout:
+                state = "prova"
+            else:
+                state = "aperto"
+            return {"stato": state, "errori_consecutivi": self._failures}
+
+
+class RetryPolicy:
+    """Attese tra i tentativi: backoff esponenziale con jitter completo"""
+
+    def __init__(self, attempts: int = 3, base_delay: float = 0.25, max_delay: float = 4.0):
+        self.attempts = max(1, attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int):
+        """Attesa prima del tentativo attempt + 1 (attempt parte da 1)"""
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class ResilientCaller:
+    """Esegue le chiamate con timeout, nuovi tentativi e circuit breaker"""
+
+    def __init__(self, timeout: float = 10.0, retry: RetryPolicy = None, breaker: CircuitBreaker = None,
+                 max_workers: int = 8):
+        self.timeout = timeout
+        self.retry = retry or RetryPolicy()
+        self.breaker = breaker or CircuitBreaker()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="storage")
+
+    def call(self, function, *args, **kwargs):
+        for attempt in range(1, self.retry.attempts + 1):
+            self.breaker.before_call()
+            future = self._executor.submit(function, *args, **kwargs)
+            try:
+                result = future.result(timeout=self.timeout)
+            except FutureTimeout:
+                # Il thread resta occupato finché la chiamata non termina, ma la sessione no
+                future.cancel()
+                error = TimeoutError(f"nessuna risposta dal database entro {self.timeout:g} s")
+            except Exception as e:
+                if not is_transient(e):
+                    # Il database ha risposto: l'errore non dipende dalla connessione
+                    self.breaker.record_success()
+                    raise
+                error = e
+            else:
+                self.breaker.record_success()
+                return result
+
+            self.breaker.record_failure()
+            if attempt == self.retry.attempts:
+                raise error
+            time.sleep(self.retry.delay(attempt))
+
+
+class ClientPool:
+    """Client condivisi dal processo: ogni chiamata prende un client libero, creato al bisogno fino a size"""
+
+    def __init__(self, factory, size: int = 4, acquire_timeout: float = 10.0):
+        self.factory = factory
+        self.acquire_timeout = acquire_timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    @contextmanager
+    def client(self):
+        if not self._slots.acquire(timeout=self.acquire_timeout):
+            raise TimeoutError("nessun client del database disponibile")
+        try:
+            try:
+                client = self._idle.get_nowait()
+            except queue.Empty:
+                client = self.factory()
+            yield client
+            self._idle.put(client)
+        finally:
+            self._slots.release()
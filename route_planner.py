@@ -0,0 +1,201 @@
+"""Grafo delle tratte inserite nei trasporti, percorsi più economici e più veloci e confronto con il JR Pass.
+
+Ogni tratta (partenza, arrivo, tipo, costo) è un arco percorribile in entrambe le
+direzioni. Il tempo di percorrenza è stimato dalla distanza in linea d'aria tra le
+città di JAPAN_CITIES, allungata di un fattore di percorso e divisa per la velocità
+media del tipo di trasporto, più un tempo fisso di attesa. I percorsi minimi tra
+tutte le coppie di città vengono calcolati con Dijkstra una volta per insieme di
+tratte e snapshot dei tassi, e poi letti dalla tabella.
+"""
+
+import heapq
+import math
+
+from cities import JAPAN_CITIES
+from currency import item_currency
+
+# Velocità medie (km/h) comprese le fermate e minuti fissi di attesa/imbarco per tipo di trasporto
+TRANSPORT_SPEEDS = {
+    "Shinkansen": 200, "Treno Locale": 60, "Autobus": 50, "Metro": 30, "Taxi": 35, "Altro": 50,
+}
+TRANSPORT_OVERHEAD_MINUTES = {
+    "Shinkansen": 20, "Treno Locale": 10, "Autobus": 15, "Metro": 5, "Taxi": 5, "Altro": 15,
+}
+# Le strade e i binari non sono in linea d'aria
+ROUTE_FACTOR = 1.25
+
+# Tipi di trasporto coperti dal JR Pass (linee JR, escluse Nozomi e Mizuho)
+JR_PASS_TYPES = {"Shinkansen", "Treno Locale"}
+# Prezzi del JR Pass ordinario per adulto, in yen
+JR_PASS_PRICES = {"7 giorni": 50000, "14 giorni": 80000, "21 giorni": 100000}
+
+CRITERIA = {"costo": "Più economico", "tempo": "Più veloce"}
+
+_CITY_NAMES = {name.lower(): name for name in JAPAN_CITIES}
+
+
+def city_node(name):
+    """Nome del nodo: la città di JAPAN_CITIES corrispondente, altrimenti il testo inserito"""
+    text = (name or "").strip()
+    return _CITY_NAMES.get(text.lower(), text)
+
+
+def haversine_km(origin: dict, destination: dict):
+    lat1, lon1 = math.radians(origin["lat"]), math.radians(origin["lon"])
+    lat2, lon2 = math.radians(destination["lat"]), math.radians(destination["lon"])
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0088 * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def estimate_minutes(origin: str, destination: str, transport_type: str):
+    """Minuti stimati per la tratta, oppure None se una delle due città non ha coordinate"""
+    if origin not in JAPAN_CITIES or destination not in JAPAN_CITIES:
+        return None
+    distance = haversine_km(JAPAN_CITIES[origin], JAPAN_CITIES[destination]) * ROUTE_FACTOR
+    speed = TRANSPORT_SPEEDS.get(transport_type, TRANSPORT_SPEEDS["Altro"])
+    overhead = TRANSPORT_OVERHEAD_MINUTES.get(transport_type, TRANSPORT_OVERHEAD_MINUTES["Altro"])
+    return distance / speed * 60 + overhead
+
+
+def transport_legs(dati_citta: dict, rates, on=None):
+    """Tratte di tutte le città come dizionari con costo in euro e tempo stimato; esclusi i JR Pass.
+
+    Le tratte non hanno data: i costi sono convertiti al tasso del giorno on (la partenza del viaggio).
+    """
+    legs = []
+    for city_name, city_data in dati_citta.items():
+        for key, item in (city_data.get("trasporti") or {}).items():
+            if not isinstance(item, dict) or item.get("tipo") == "Japan Rail Pass":
+                continue
+            origin, destination = city_node(item.get("partenza")), city_node(item.get("arrivo"))
+            if not origin or not destination or origin == destination:
+                continue
+            legs.append({
+                "citta": city_name,
+                "chiave": key,
+                "partenza": origin,
+                "arrivo": destination,
+                "tipo": item.get("tipo", "Altro"),
+                "costo": rates.convert(item.get("costo", 0), item_currency(item), on),
+                "tempo": estimate_minutes(origin, destination, item.get("tipo", "Altro")),
+            })
+    return legs
+
+
+class RouteGraph:
+    """Grafo non orientato delle tratte con i percorsi minimi tra tutte le coppie di nodi"""
+
+    def __init__(self, legs):
+        self.legs = legs
+        self.adjacency = {}
+        for leg in legs:
+            self.adjacency.setdefault(leg["partenza"], []).append((leg["arrivo"], leg))
+            self.adjacency.setdefault(leg["arrivo"], []).append((leg["partenza"], leg))
+        self.nodes = sorted(self.adjacency)
+        # {criterio: {partenza: {arrivo: (totale costo, totale tempo, tratte)}}}
+        self._paths = {criterion: {node: self._dijkstra(node, criterion) for node in self.nodes} for criterion in CRITERIA}
+
+    def _dijkstra(self, source: str, criterion: str):
+        """Percorsi minimi da source secondo il criterio; a parità vale l'altro criterio.
+
+        Le tratte senza tempo stimato non sono usate per i percorsi più veloci; negli
+        altri percorsi rendono sconosciuto (None) il tempo totale.
+        """
+        other = "tempo" if criterion == "costo" else "costo"
+        best = {source: (0.0, 0.0)}
+        previous = {}
+        heap = [(0.0, 0.0, source)]
+        done = set()
+        while heap:
+            primary, secondary, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+            for neighbour, leg in self.adjacency.get(node, []):
+                if leg[criterion] is None:
+                    continue
+                # Valore mancante come infinito: a parità si preferisce il percorso con il totale noto
+                candidate = (primary + leg[criterion], secondary + (math.inf if leg[other] is None else leg[other]))
+                if neighbour not in best or candidate < best[neighbour]:
+                    best[neighbour] = candidate
+                    previous[neighbour] = (node, leg)
+                    heapq.heappush(heap, (candidate[0], candidate[1], neighbour))
+
+        paths = {}
+        for target in best:
+            if target == source:
+                continue
+            legs, node = [], target
+            while node != source:
+                node, leg = previous[node]
+                legs.append(leg)
+            legs.reverse()
+            totals = {criterion: best[target][0], other: None if math.isinf(best[target][1]) else best[target][1]}
+            paths[target] = (totals["costo"], totals["tempo"], legs)
+        return paths
+
+    def route(self, origin: str, destination: str, criterion: str = "costo"):
+        """(costo totale in euro, minuti totali, tratte) oppure None se le città non sono collegate"""
+        return self._paths[criterion].get(city_node(origin), {}).get(city_node(destination))
+
+
+def jr_pass_comparison(legs, rates, owned_passes=(), on=None):
+    """Costo delle tratte coperte dal JR Pass confrontato con il prezzo di ogni pass (in euro).
+
+    owned_passes: elementi "Japan Rail Pass" dei trasporti, il cui costo inserito sostituisce il listino.
+    """
+    covered = sum(leg["costo"] for leg in legs if leg["tipo"] in JR_PASS_TYPES)
+    prices = {duration: rates.convert(price, "JPY", on) for duration, price in JR_PASS_PRICES.items()}
+    for item in owned_passes:
+        if item.get("durata") in prices and item.get("costo"):
+            prices[item["durata"]] = rates.convert(item["costo"], item_currency(item), on)
+    return [
+        {"pass": duration, "prezzo": price, "tratte_coperte": covered, "risparmio": covered - price}
+        for duration, price in prices.items()
+    ]
+
+
+def owned_jr_passes(dati_citta: dict):
+    return [
+        item for city_data in dati_citta.values()
+        for item in (city_data.get("trasporti") or {}).values()
+        if isinstance(item, dict) and item.get("tipo") == "Japan Rail Pass"
+    ]
+
+
+class RoutePlanner:
+    """Grafo e percorsi minimi della sessione, ricalcolati solo se cambiano le tratte o i tassi"""
+
+    def __init__(self):
+        self._key = None
+        self._graph = None
+        self._passes = None
+
+    def update(self, dati_citta: dict, rates, on=None):
+        # Le chiavi degli elementi non vengono riutilizzate: bastano a capire se le tratte sono cambiate
+        key = (
+            tuple((city_name, tuple(city_data.get("trasporti") or ())) for city_name, city_data in dati_citta.items()),
+            rates.snapshot,
+            on,
+        )
+        if self._graph is None or key != self._key:
+            self._graph = RouteGraph(transport_legs(dati_citta, rates, on))
+            self._passes = jr_pass_comparison(self._graph.legs, rates, owned_jr_passes(dati_citta), on)
+            self._key = key
+        return self
+
+    @property
+    def graph(self):
+        return self._graph
+
+    @property
+    def jr_passes(self):
+        return self._passes
+
+
+def format_minutes(minutes):
+    if minutes is None:
+        return "N/D"
+    hours, rest = divmod(int(round(minutes)), 60)
+    return f"{hours}h {rest:02d}m" if hours else f"{rest}m"
+
@@ -0,0 +1,273 @@
+"""Coda di salvataggio in background con accorpamento delle scritture per viaggio.
+
+Con un SaveJournal ogni scrittura viene registrata su disco prima di essere accodata
+e cancellata solo dopo essere stata salvata nel database: le scritture rimaste in
+sospeso alla chiusura del processo vengono rimesse in coda al riavvio.
+"""
+
+import atexit
+import json
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+# Tentativi di una scrittura prima di considerarla fallita (fino a un nuovo salvataggio o a retry)
+DEFAULT_MAX_ATTEMPTS = 8
+
+
+class PendingWrite:
+    """Scrittura in attesa per un viaggio: documento, righe delle città da salvare ed eliminare.
+
+    - full: il documento contiene tutte le città (salvataggio completo, senza tabella cities)
+    - reset: le righe delle città del viaggio vanno eliminate prima di salvare rows
+    Entrambi i casi descrivono lo stato completo del viaggio.
+    """
+
+    def __init__(self, document: dict, rows: dict = None, removed: set = None, full: bool = False, reset: bool = False):
+        self.document = document
+        self.rows = rows or {}
+        self.removed = removed or set()
+        self.full = full
+        self.reset = reset
+
+    def is_complete(self):
+        return self.full or self.reset
+
+    def to_json(self):
+        return json.dumps({
+            "document": self.document, "rows": self.rows, "removed": sorted(self.removed),
+            "full": self.full, "reset": self.reset,
+        }, ensure_ascii=False)
+
+    @classmethod
+    def from_json(cls, text: str):
+        value = json.loads(text)
+        return cls(value["document"], value["rows"], set(value["removed"]), value["full"], value["reset"])
+
+    def merge(self, newer: "PendingWrite"):
+        """Accorpa una scrittura più recente in questa e restituisce il risultato"""
+        if newer.is_complete():
+            return newer
+        if self.full:
+            # Il documento completo resta valido: applica le città della scrittura successiva
+            for key, value in newer.document.items():
+                if key not in ("dati_citta", "meta"):
+                    self.document[key] = value
+            dati_citta = self.document.setdefault("dati_citta", {})
+            for city_name in newer.removed:
+                dati_citta.pop(city_name, None)
+            dati_citta.update(newer.rows)
+            return self
+        for city_name in newer.removed:
+            self.rows.pop(city_name, None)
+            self.removed.add(city_name)
+        for city_name, city_data in newer.rows.items():
+            self.removed.discard(city_name)
+            self.rows[city_name] = city_data
+        self.document = newer.document
+        return self
+
+
+class SaveJournal:
+    """Scritture accodate e non ancora salvate, in un database SQLite locale.
+
+    Ogni scrittura è una riga con un numero progressivo; quando una scrittura riesce si
+    eliminano le righe del viaggio fino all'ultima accorpata in essa.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS pending (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            trip_id TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_pending_trip ON pending (trip_id, seq);
+    """
+
+    def __init__(self, path: str = "data/save_journal.db"):
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+
+    def append(self, trip_id: str, pending: PendingWrite):
+        """Registra una scrittura e ne restituisce il numero progressivo"""
+        with self._lock, self._conn:
+            return self._conn.execute(
+                "INSERT INTO pending (trip_id, payload) VALUES (?, ?)", (trip_id, pending.to_json())
+            ).lastrowid
+
+    def remove(self, trip_id: str, up_to: int):
+        """Elimina le scritture del viaggio salvate nel database (numero fino a up_to)"""
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM pending WHERE trip_id = ? AND seq <= ?", (trip_id, up_to))
+
+    def load(self):
+        """{viaggio: (scrittura accorpata, ultimo numero)} delle scritture rimaste in sospeso"""
+        with self._lock:
+            rows = self._conn.execute("SELECT seq, trip_id, payload FROM pending ORDER BY seq").fetchall()
+        result = {}
+        for seq, trip_id, payload in rows:
+            pending = PendingWrite.from_json(payload)
+            current = result.get(trip_id)
+            result[trip_id] = (current[0].merge(pending) if current else pending, seq)
+        return result
+
+
+class SaveQueue:
+    """Scrive in un thread separato, una sola scrittura per viaggio alla volta.
+
+    Le richieste per lo stesso viaggio arrivate mentre una scrittura è in attesa vengono
+    accorpate in un unico upsert. Una scrittura fallita viene ritentata con attese crescenti
+    fino a max_attempts volte, poi resta ferma nello stato "fallito" finché non arriva un
+    nuovo salvataggio per lo stesso viaggio o viene chiamato retry(). Con un journal le
+    scritture non ancora salvate sopravvivono anche al riavvio del processo.
+    """
+
+    def __init__(self, writer, retry_delay: float = 1.0, max_retry_delay: float = 30.0,
+                 max_attempts: int = DEFAULT_MAX_ATTEMPTS, journal: SaveJournal = None):
+        # writer(trip_id, pending) deve sollevare un'eccezione o restituire False in caso di errore
+        self.writer = writer
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.max_attempts = max(1, max_attempts)
+        self.journal = journal
+        self._pending = {}
+        self._in_flight = set()
+        self._failed = {}
+        self._status = {}
+        self._failures = {}
+        # Ultimo numero del journal accodato per viaggio
+        self._journal_seq = {}
+        self._condition = threading.Condition()
+        if journal is not None:
+            for trip_id, (pending, seq) in journal.load().items():
+                self._pending[trip_id] = pending
+                self._journal_seq[trip_id] = seq
+                self._status[trip_id] = {"stato": "in attesa", "recuperato": True}
+        self._thread = threading.Thread(target=self._run, name="save-queue", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush, 10.0)
+
+    def submit(self, trip_id: str, pending: PendingWrite):
+        """Accoda una scrittura, accorpandola a quella già in attesa (o fallita) per lo stesso viaggio.
+
+        Con il journal la scrittura è registrata su disco prima di essere accodata: se la
+        registrazione non riesce viene sollevata l'eccezione e la coda resta invariata.
+        """
+        with self._condition:
+            if self.journal is not None:
+                self._journal_seq[trip_id] = self.journal.append(trip_id, pending)
+            current = self._pending.get(trip_id)
+            if current is None and trip_id in self._failed:
+                # Un nuovo salvataggio dopo una scrittura fallita riparte con tutti i tentativi
+                current = self._failed.pop(trip_id)
+                self._failures.pop(trip_id, None)
+            self._pending[trip_id] = current.merge(pending) if current else pending
+            self._status.setdefault(trip_id, {})["stato"] = "in attesa"
+            self._condition.notify_all()
+
+    def retry(self, trip_id: str):
+        """Rimette in coda una scrittura fallita"""
+        with self._condition:
+            pending = self._failed.pop(trip_id, None)
+            if pending is None:
+                return
+            newer = self._pending.get(trip_id)
+            self._pending[trip_id] = pending.merge(newer) if newer else pending
+            self._failures.pop(trip_id, None)
+            self._status.setdefault(trip_id, {})["stato"] = "in attesa"
+            self._condition.notify_all()
+
+    def has_pending(self, trip_id: str):
+        """True se ci sono modifiche del viaggio non ancora salvate nel database, anche fallite"""
+        with self._condition:
+            return trip_id in self._pending or trip_id in self._in_flight or trip_id in self._failed
+
+    def status(self, trip_id: str):
+        """Stato dell'ultimo salvataggio: stato, ultimo_salvataggio, errore, tentativi"""
+        with self._condition:
+            status = dict(self._status.get(trip_id, {"stato": "nessuna modifica"}))
+            status["in_coda"] = trip_id in self._pending or trip_id in self._in_flight
+            status["tentativi"] = self._failures.get(trip_id, (0, 0))[0]
+            return status
+
+    def flush(self, timeout: float = None):
+        """Attende che tutte le scritture accodate siano completate; restituisce False allo scadere"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            # Le scritture in attesa di un nuovo tentativo vengono eseguite subito (quelle fallite no)
+            for trip_id in self._pending:
+                if trip_id in self._failures:
+                    self._failures[trip_id] = (self._failures[trip_id][0], 0)
+            self._condition.notify_all()
+            while self._pending or self._in_flight:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            return True
+
+    def _next_ready(self):
+        now = time.monotonic()
+        for trip_id in self._pending:
+            retry_at = self._failures.get(trip_id, (0, 0))[1]
+            if retry_at <= now:
+                return trip_id, None
+        waits = [self._failures[trip_id][1] - now for trip_id in self._pending if trip_id in self._failures]
+        return None, min(waits) if waits else None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                trip_id, wait = self._next_ready()
+                while trip_id is None:
+                    self._condition.wait(wait)
+                    trip_id, wait = self._next_ready()
+                pending = self._pending.pop(trip_id)
+                journal_seq = self._journal_seq.get(trip_id)
+                self._in_flight.add(trip_id)
+
+            error = None
+            try:
+                if not self.writer(trip_id, pending):
+                    error = "nessuna risposta dal database"
+                elif self.journal is not None and journal_seq is not None:
+                    # Le scritture accodate nel frattempo hanno numeri più alti e restano nel journal
+                    self.journal.remove(trip_id, journal_seq)
+            except Exception as e:
+                error = str(e)
+
+            with self._condition:
+                self._in_flight.discard(trip_id)
+                status = self._status.setdefault(trip_id, {})
+                if error is None:
+                    self._failures.pop(trip_id, None)
+                    status.pop("recuperato", None)
+                    status.update({
+                        "stato": "salvato" if trip_id not in self._pending else "in attesa",
+                        "ultimo_salvataggio": datetime.now().strftime('%H:%M:%S'),
+                        "errore": None
+                    })
+                else:
+                    # Rimetti in coda la scrittura fallita prima di quelle arrivate nel frattempo
+                    newer = self._pending.pop(trip_id, None)
+                    pending = pending.merge(newer) if newer else pending
+                    attempts = self._failures.get(trip_id, (0, 0))[0] + 1
+                    if attempts >= self.max_attempts:
+                        # Niente più tentativi automatici: la scrittura resta nel journal
+                        self._failed[trip_id] = pending
+                        self._failures[trip_id] = (attempts, 0)
+                        status.update({"stato": "fallito", "errore": error})
+                    else:
+                        self._pending[trip_id] = pending
+                        delay = min(self.retry_delay * 2 ** (attempts - 1), self.max_retry_delay)
+                        self._failures[trip_id] = (attempts, time.monotonic() + delay)
+                        status.update({"stato": "errore", "errore": error})
+                self._condition.notify_all()
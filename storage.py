@@ -0,0 +1,365 @@
+"""Backend di salvataggio dei viaggi: Supabase, SQLite locale e file JSON.
+
+Ogni backend salva il documento del viaggio (senza gli elementi delle città) e,
+separatamente, i dati di ogni città. Le date di aggiornamento (updated_at)
+sono stringhe ISO usate come versione del documento.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+from cities import CITY_CATEGORIES
+from resilience import CircuitBreaker, ClientPool, ResilientCaller, RetryPolicy
+
+
+class StorageBackend(ABC):
+    """Interfaccia comune dei backend di salvataggio"""
+
+    @abstractmethod
+    def load_trip(self, trip_id: str):
+        """Restituisce (documento, updated_at) oppure (None, None) se il viaggio non esiste"""
+
+    @abstractmethod
+    def trip_version(self, trip_id: str):
+        """Restituisce solo updated_at del documento, o None se il viaggio non esiste"""
+
+    @abstractmethod
+    def save_trip(self, trip_id: str, data: dict, updated_at: str):
+        """Salva il documento del viaggio; restituisce True se la scrittura è riuscita"""
+
+    @abstractmethod
+    def load_cities(self, trip_id: str, city_names: list = None):
+        """Restituisce {città: dati} per le città indicate, o per tutte se city_names è None"""
+
+    @abstractmethod
+    def save_cities(self, trip_id: str, cities: dict, updated_at: str):
+        """Salva i dati di più città in una sola scrittura"""
+
+    @abstractmethod
+    def delete_cities(self, trip_id: str, city_names: list = None):
+        """Elimina le città indicate, o tutte le città del viaggio se city_names è None"""
+
+
+class SupabaseBackend(StorageBackend):
+    """Tabelle trips e cities su Supabase; ogni chiamata usa un client libero del pool"""
+
+    def __init__(self, pool: ClientPool):
+        self.pool = pool
+
+    def load_trip(self, trip_id: str):
+        with self.pool.client() as client:
+            response = client.table('trips').select("*").eq('id', trip_id).execute()
+        if not response.data:
+            return None, None
+        return response.data[0]['data'], response.data[0].get('updated_at')
+
+    def trip_version(self, trip_id: str):
+        with self.pool.client() as client:
+            response = client.table('trips').select("updated_at").eq('id', trip_id).execute()
+        return response.data[0]['updated_at'] if response.data else None
+
+    def save_trip(self, trip_id: str, data: dict, updated_at: str):
+        with self.pool.client() as client:
+            response = client.table('trips').upsert({
+                'id': trip_id,
+                'data': data,
+                'updated_at': updated_at
+            }).execute()
+        return True if response.data else False
+
+    def load_cities(self, trip_id: str, city_names: list = None):
+        with self.pool.client() as client:
+            query = client.table('cities').select("*").eq('trip_id', trip_id)
+            if city_names is not None:
+                query = query.in_('city_name', list(city_names))
+            response = query.execute()
+        return {row['city_name']: row['data'] for row in response.data or []}
+
+    def save_cities(self, trip_id: str, cities: dict, updated_at: str):
+        if not cities:
+            return True
+        with self.pool.client() as client:
+            response = client.table('cities').upsert([
+                {'trip_id': trip_id, 'city_name': city_name, 'data': city_data, 'updated_at': updated_at}
+                for city_name, city_data in cities.items()
+            ]).execute()
+        return True if response.data else False
+
+    def delete_cities(self, trip_id: str, city_names: list = None):
+        with self.pool.client() as client:
+            query = client.table('cities').delete().eq('trip_id', trip_id)
+            if city_names is not None:
+                query = query.in_('city_name', list(city_names))
+            query.execute()
+
+
+class ResilientBackend(StorageBackend):
+    """Esegue le chiamate di un altro backend con timeout, nuovi tentativi e circuit breaker"""
+
+    def __init__(self, backend: StorageBackend, caller: ResilientCaller):
+        self.backend = backend
+        self.caller = caller
+
+    def status(self):
+        """Stato del circuit breaker (chiuso, aperto o prova)"""
+        return self.caller.breaker.status()
+
+    def load_trip(self, trip_id: str):
+        return self.caller.call(self.backend.load_trip, trip_id)
+
+    def trip_version(self, trip_id: str):
+        return self.caller.call(self.backend.trip_version, trip_id)
+
+    def save_trip(self, trip_id: str, data: dict, updated_at: str):
+        return self.caller.call(self.backend.save_trip, trip_id, data, updated_at)
+
+    def load_cities(self, trip_id: str, city_names: list = None):
+        return self.caller.call(self.backend.load_cities, trip_id, city_names)
+
+    def save_cities(self, trip_id: str, cities: dict, updated_at: str):
+        return self.caller.call(self.backend.save_cities, trip_id, cities, updated_at)
+
+    def delete_cities(self, trip_id: str, city_names: list = None):
+        return self.caller.call(self.backend.delete_cities, trip_id, city_names)
+
+
+class SQLiteBackend(StorageBackend):
+    """Database SQLite locale con una riga per elemento e indici per viaggio e città"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS trips (
+            id TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS cities (
+            trip_id TEXT NOT NULL,
+            city_name TEXT NOT NULL,
+            extra TEXT NOT NULL,
+            updated_at TEXT,
+            PRIMARY KEY (trip_id, city_name)
+        );
+        CREATE TABLE IF NOT EXISTS items (
+            trip_id TEXT NOT NULL,
+            city_name TEXT NOT NULL,
+            category TEXT NOT NULL,
+            item_key TEXT NOT NULL,
+            costo REAL NOT NULL DEFAULT 0,
+            data TEXT NOT NULL,
+            PRIMARY KEY (trip_id, city_name, category, item_key)
+        );
+        CREATE INDEX IF NOT EXISTS idx_items_category ON items (trip_id, category);
+    """
+
+    def __init__(self, path: str = "data/viaggio.db"):
+        self.path = path
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(self.SCHEMA)
+
+    def load_trip(self, trip_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT data, updated_at FROM trips WHERE id = ?", (trip_id,)
+            ).fetchone()
+        if row is None:
+            return None, None
+        return json.loads(row[0]), row[1]
+
+    def trip_version(self, trip_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT updated_at FROM trips WHERE id = ?", (trip_id,)).fetchone()
+        return row[0] if row else None
+
+    def save_trip(self, trip_id: str, data: dict, updated_at: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO trips (id, data, updated_at) VALUES (?, ?, ?)",
+                (trip_id, json.dumps(data), updated_at)
+            )
+        return True
+
+    def load_cities(self, trip_id: str, city_names: list = None):
+        where, params = "trip_id = ?", [trip_id]
+        if city_names is not None:
+            city_names = list(city_names)
+            if not city_names:
+                return {}
+            where += f" AND city_name IN ({','.join('?' * len(city_names))})"
+            params += city_names
+        with self._lock:
+            city_rows = self._conn.execute(
+                f"SELECT city_name, extra FROM cities WHERE {where}", params
+            ).fetchall()
+            item_rows = self._conn.execute(
+                f"SELECT city_name, category, item_key, data FROM items WHERE {where} ORDER BY rowid", params
+            ).fetchall()
+
+        cities = {}
+        for city_name, extra in city_rows:
+            city_data = {category: {} for category in CITY_CATEGORIES}
+            city_data.update(json.loads(extra))
+            cities[city_name] = city_data
+        for city_name, category, item_key, data in item_rows:
+            if city_name in cities:
+                cities[city_name].setdefault(category, {})[item_key] = json.loads(data)
+        return cities
+
+    def save_cities(self, trip_id: str, cities: dict, updated_at: str):
+        if not cities:
+            return True
+        city_rows, item_rows = [], []
+        for city_name, city_data in cities.items():
+            # Le categorie vanno nella tabella items, il resto (es. coordinate) resta nella città
+            extra = {key: value for key, value in city_data.items() if key not in CITY_CATEGORIES}
+            city_rows.append((trip_id, city_name, json.dumps(extra), updated_at))
+            for category in CITY_CATEGORIES:
+                for item_key, item in (city_data.get(category) or {}).items():
+                    cost = item.get("costo", 0) if isinstance(item, dict) else 0
+                    item_rows.append((trip_id, city_name, category, item_key, float(cost or 0), json.dumps(item)))
+
+        names = list(cities)
+        placeholders = ','.join('?' * len(names))
+        with self._lock, self._conn:
+            self._conn.execute(
+                f"DELETE FROM items WHERE trip_id = ? AND city_name IN ({placeholders})", [trip_id] + names
+            )
+            self._conn.executemany("INSERT OR REPLACE INTO cities VALUES (?, ?, ?, ?)", city_rows)
+            self._conn.executemany("INSERT INTO items VALUES (?, ?, ?, ?, ?, ?)", item_rows)
+        return True
+
+    def delete_cities(self, trip_id: str, city_names: list = None):
+        where, params = "trip_id = ?", [trip_id]
+        if city_names is not None:
+            city_names = list(city_names)
+            if not city_names:
+                return
+            where += f" AND city_name IN ({','.join('?' * len(city_names))})"
+            params += city_names
+        with self._lock, self._conn:
+            self._conn.execute(f"DELETE FROM items WHERE {where}", params)
+            self._conn.execute(f"DELETE FROM cities WHERE {where}", params)
+
+
+class JSONFileBackend(StorageBackend):
+    """Un file JSON locale con tutti i viaggi, scritto in modo atomico"""
+
+    def __init__(self, path: str = "data/viaggio_data.json"):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._store = self._read()
+
+    def _read(self):
+        if not self.path.exists():
+            return {}
+        with open(self.path, encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self):
+        tmp_path = self.path.with_suffix(self.path.suffix + ".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self._store, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+
+    def _trip(self, trip_id: str):
+        return self._store.setdefault(trip_id, {"data": None, "updated_at": None, "cities": {}})
+
+    def load_trip(self, trip_id: str):
+        with self._lock:
+            trip = self._store.get(trip_id)
+            if not trip or trip["data"] is None:
+                return None, None
+            return json.loads(json.dumps(trip["data"])), trip["updated_at"]
+
+    def trip_version(self, trip_id: str):
+        with self._lock:
+            trip = self._store.get(trip_id)
+            return trip["updated_at"] if trip and trip["data"] is not None else None
+
+    def save_trip(self, trip_id: str, data: dict, updated_at: str):
+        with self._lock:
+            trip = self._trip(trip_id)
+            trip["data"] = json.loads(json.dumps(data))
+            trip["updated_at"] = updated_at
+            self._write()
+        return True
+
+    def load_cities(self, trip_id: str, city_names: list = None):
+        with self._lock:
+            cities = self._store.get(trip_id, {}).get("cities", {})
+            if city_names is not None:
+                cities = {name: cities[name] for name in city_names if name in cities}
+            return json.loads(json.dumps(cities))
+
+    def save_cities(self, trip_id: str, cities: dict, updated_at: str):
+        if not cities:
+            return True
+        with self._lock:
+            self._trip(trip_id)["cities"].update(json.loads(json.dumps(cities)))
+            self._write()
+        return True
+
+    def delete_cities(self, trip_id: str, city_names: list = None):
+        with self._lock:
+            trip = self._trip(trip_id)
+            if city_names is None:
+                trip["cities"] = {}
+            else:
+                for city_name in city_names:
+                    trip["cities"].pop(city_name, None)
+            self._write()
+
+
+def _supabase_client_factory(url: str, key: str, timeout: float):
+    from supabase import create_client
+
+    try:
+        from supabase import ClientOptions
+    except ImportError:
+        # Versioni di supabase senza ClientOptions: vale solo il timeout di ResilientCaller
+        return lambda: create_client(url, key)
+    return lambda: create_client(url, key, options=ClientOptions(postgrest_client_timeout=timeout))
+
+
+def create_backend(name: str = "supabase", **options):
+    """Crea il backend indicato: "supabase", "sqlite" o "json".
+
+    Il backend Supabase (o qualsiasi backend con resilient=True) viene avvolto in
+    ResilientBackend; le opzioni timeout, retries, pool_size, breaker_failures e
+    breaker_reset regolano pool, timeout e circuit breaker.
+    """
+    timeout = float(options.get("timeout", 10.0))
+    if name == "supabase":
+        url, key = options.get("supabase_url"), options.get("supabase_key")
+        if not url or not key:
+            raise ValueError("Missing Supabase credentials. Please check secrets.toml")
+        pool = ClientPool(_supabase_client_factory(url, key, timeout), size=int(options.get("pool_size", 4)))
+        backend = SupabaseBackend(pool)
+    elif name == "sqlite":
+        backend = SQLiteBackend(options.get("sqlite_path", "data/viaggio.db"))
+    elif name == "json":
+        backend = JSONFileBackend(options.get("json_path", "data/viaggio_data.json"))
+    else:
+        raise ValueError(f"Backend di salvataggio sconosciuto: {name}")
+
+    if not options.get("resilient", name == "supabase"):
+        return backend
+    caller = ResilientCaller(
+        timeout=timeout,
+        retry=RetryPolicy(attempts=int(options.get("retries", 3))),
+        breaker=CircuitBreaker(
+            failure_threshold=int(options.get("breaker_failures", 5)),
+            reset_timeout=float(options.get("breaker_reset", 30.0))
+        ),
+        max_workers=int(options.get("pool_size", 4)) * 2
+    )
+    return ResilientBackend(backend, caller)
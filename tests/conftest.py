@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# I moduli dell'app sono nella radice del repository, come per i benchmark
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
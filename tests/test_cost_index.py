@@ -0,0 +1,53 @@
+import copy
+
+from cost_index import build_cost_index, check_cost_index, index_add_item, index_remove_item, rebuild_cost_index
+
+
+def make_data():
+    return {
+        "dati_citta": {
+            "Tokyo": {
+                "alloggi": {"a1": {"nome": "Hotel", "costo": 300}},
+                "ristoranti": {"r1": {"nome": "Ramen", "costo": 1200, "valuta": "JPY"}},
+                "negozi": {}, "attivita": {}, "trasporti": {},
+            },
+        },
+    }
+
+
+def test_incremental_updates_match_rebuild():
+    data = make_data()
+    rebuild_cost_index(data)
+
+    added = [
+        ("Tokyo", "attivita", "t1", {"nome": "Museo", "costo": 20}),
+        ("Kyoto", "ristoranti", "r1", {"nome": "Kaiseki", "costo": 8000, "valuta": "JPY"}),
+        ("Kyoto", "trasporti", "s1", {"partenza": "Kyoto", "arrivo": "Osaka", "costo": 15}),
+    ]
+    for city_name, category, key, item in added:
+        city_data = data["dati_citta"].setdefault(city_name, {})
+        city_data.setdefault(category, {})[key] = item
+        index_add_item(data, city_name, category, item)
+    removed = data["dati_citta"]["Tokyo"]["ristoranti"].pop("r1")
+    index_remove_item(data, "Tokyo", "ristoranti", removed)
+
+    assert check_cost_index(data) == []
+    expected = copy.deepcopy(data)
+    rebuild_cost_index(expected)
+    assert data["budget"]["suddivisione_per_citta"] == expected["budget"]["suddivisione_per_citta"]
+    assert data["budget"]["suddivisione_per_valuta"] == expected["budget"]["suddivisione_per_valuta"]
+
+
+def test_check_reports_stale_index():
+    data = make_data()
+    rebuild_cost_index(data)
+    data["dati_citta"]["Tokyo"]["alloggi"]["a2"] = {"nome": "Ryokan", "costo": 200}
+    assert check_cost_index(data)
+
+
+def test_build_keeps_currencies_separate():
+    per_categoria, per_citta, per_valuta = build_cost_index(make_data()["dati_citta"])
+    assert per_categoria["alloggi"] == 300
+    assert per_categoria["ristoranti"] == 0
+    assert per_valuta["JPY"]["ristoranti"] == 1200
+    assert per_citta["Tokyo"]["ristoranti"]["elementi"] == 1
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+from currency import RateTable, parse_currency, trip_date
+
+
+@pytest.fixture
+def rates():
+    return RateTable([
+        ("2025-01-01", "JPY", 150.0),
+        ("01-03-2025", "yen", 170.0),
+        ("2025-02-01", "EUR", 2.0),
+    ])
+
+
+def test_rate_by_date(rates):
+    assert rates.rate("EUR") == 1.0
+    assert rates.rate("JPY") == 170.0
+    assert rates.rate("JPY", "2024-12-01") == 150.0
+    assert rates.rate("JPY", "2025-02-15") == 150.0
+    assert rates.rate("JPY", "2025-03-01") == 170.0
+    with pytest.raises(KeyError):
+        rates.rate("USD")
+
+
+def test_convert_and_to_base(rates):
+    assert rates.convert(1500, "JPY", "2025-01-10") == pytest.approx(10.0)
+    assert rates.convert(None, "EUR") == 0.0
+    converted = rates.to_base([1700, 10, 3400], ["JPY", "EUR", "JPY"])
+    assert converted == pytest.approx([10.0, 10.0, 20.0])
+
+
+def test_to_base_with_a_date_per_amount(rates):
+    days = np.array(["2025-01-10", "2025-03-10", "NaT", "2025-01-10"], dtype="datetime64[D]")
+    converted = rates.to_base([1500, 1700, 1700, 5], ["JPY", "JPY", "JPY", "EUR"], days)
+    assert converted == pytest.approx([10.0, 10.0, 10.0, 5.0])
+
+
+def test_snapshot_depends_only_on_content(rates):
+    same = RateTable([("2025-03-01", "JPY", 170.0), ("2025-01-01", "JPY", 150.0)])
+    assert same.snapshot == rates.snapshot
+    assert RateTable([("2025-01-01", "JPY", 151.0)]).snapshot != rates.snapshot
+
+
+def test_parse_currency_and_trip_date():
+    assert parse_currency("¥") == "JPY"
+    assert parse_currency("") == "EUR"
+    with pytest.raises(ValueError):
+        parse_currency("USD")
+    assert str(trip_date({"costi_partenza": {"volo": {"data_partenza": "2025-04-01"}}})) == "2025-04-01"
+    assert trip_date({"costi_partenza": {"voli": []}}) is None
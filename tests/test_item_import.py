@@ -0,0 +1,61 @@
+import io
+
+import pytest
+
+from city_items import sniff_delimiter
+from item_import import import_items, read_chunks
+
+
+def run_import(text, data, batch_size=500, **defaults):
+    commits = []
+
+    def commit(changes):
+        commits.append(changes)
+        return True
+
+    report = import_items(
+        read_chunks(io.BytesIO(text.encode("utf-8")), "elementi.csv", chunk_size=2),
+        data,
+        load_city=lambda city_name: data.get("dati_citta", {}).get(city_name),
+        commit=commit,
+        batch_size=batch_size,
+        **defaults
+    )
+    return report, commits
+
+
+@pytest.mark.parametrize("separator", ["\t", ";", ","])
+def test_delimiter_is_detected(separator):
+    text = separator.join(["nome", "costo", "valuta"]) + "\nRamen Ichiran" + separator + "1200" + separator + "JPY\n"
+    assert sniff_delimiter(text) == separator
+    data = {"dati_citta": {}}
+    report, _ = run_import(text, data, default_city="Tokyo", default_category="ristoranti")
+    assert report.imported == 1
+    item, = data["dati_citta"]["Tokyo"]["ristoranti"].values()
+    assert (item["nome"], item["costo"], item["valuta"]) == ("Ramen Ichiran", 1200.0, "JPY")
+
+
+def test_single_column_is_not_split_on_letters():
+    assert sniff_delimiter("nome\nSensoji\nMeiji Jingu\n") == "\t"
+
+
+def test_duplicates_and_invalid_rows():
+    data = {"dati_citta": {"Tokyo": {
+        "alloggi": {}, "ristoranti": {"ristorante_1": {"nome": "Ramen"}},
+        "negozi": {}, "attivita": {}, "trasporti": {},
+    }}}
+    text = (
+        "citta;categoria;nome;costo\n"
+        "Tokyo;ristoranti;ramen;10\n"        # già presente (nome senza maiuscole)
+        "Tokyo;ristorante;Sushi;20\n"
+        "Kyoto;attività;Kinkakuji;5\n"
+        "Kyoto;attivita;Kinkakuji;5\n"       # ripetuto nel file
+        "Atlantide;attivita;Museo;1\n"       # città sconosciuta
+        "Tokyo;ristoranti;Izakaya;-3\n"      # costo negativo
+    )
+    report, commits = run_import(text, data, batch_size=1)
+    assert (report.rows, report.imported, report.duplicates, report.invalid) == (6, 2, 2, 2)
+    assert len(report.errors) == 2
+    assert report.batches == len(commits) == 2
+    assert {item["nome"] for item in data["dati_citta"]["Tokyo"]["ristoranti"].values()} == {"Ramen", "Sushi"}
+    assert "Kyoto" in data["dati_citta"]
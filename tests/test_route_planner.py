@@ -0,0 +1,42 @@
+import pytest
+
+from route_planner import RouteGraph, format_minutes
+
+
+def leg(origin, destination, cost, minutes, kind="Shinkansen"):
+    return {"partenza": origin, "arrivo": destination, "tipo": kind, "costo": cost, "tempo": minutes}
+
+
+def test_cheapest_and_fastest_routes():
+    graph = RouteGraph([
+        leg("Tokyo", "Kyoto", 100, 140),
+        leg("Tokyo", "Nagoya", 40, 100, "Autobus"),
+        leg("Nagoya", "Kyoto", 30, 90, "Autobus"),
+    ])
+    cost, minutes, legs = graph.route("Tokyo", "Kyoto", "costo")
+    assert (cost, minutes) == (70, 190)
+    assert [(step["partenza"], step["arrivo"]) for step in legs] == [("Tokyo", "Nagoya"), ("Nagoya", "Kyoto")]
+
+    cost, minutes, legs = graph.route("Kyoto", "Tokyo", "tempo")
+    assert (cost, minutes) == (100, 140)
+    assert len(legs) == 1
+
+
+def test_unknown_leg_time_makes_total_unknown():
+    graph = RouteGraph([leg("Tokyo", "Nikko", 20, None), leg("Nikko", "Sendai", 30, 60)])
+    cost, minutes, _ = graph.route("Tokyo", "Sendai", "costo")
+    assert cost == 50
+    assert minutes is None
+    assert format_minutes(minutes) == "N/D"
+    # Senza tempo la tratta non si usa per i percorsi più veloci
+    assert graph.route("Tokyo", "Sendai", "tempo") is None
+
+
+def test_disconnected_cities():
+    graph = RouteGraph([leg("Tokyo", "Kyoto", 100, 140), leg("Osaka", "Nara", 5, 45)])
+    assert graph.route("Tokyo", "Nara") is None
+
+
+@pytest.mark.parametrize("minutes, text", [(45, "45m"), (125.4, "2h 05m"), (60, "1h 00m")])
+def test_format_minutes(minutes, text):
+    assert format_minutes(minutes) == text
@@ -0,0 +1,55 @@
+import time
+
+from save_queue import PendingWrite, SaveJournal, SaveQueue
+
+
+def test_merge_incremental_writes():
+    first = PendingWrite({"v": 1}, rows={"Tokyo": {"x": 1}, "Kyoto": {"y": 1}})
+    second = PendingWrite({"v": 2}, rows={"Osaka": {"z": 1}}, removed={"Kyoto"})
+    merged = first.merge(second)
+    assert merged.document == {"v": 2}
+    assert merged.rows == {"Tokyo": {"x": 1}, "Osaka": {"z": 1}}
+    assert merged.removed == {"Kyoto"}
+
+    # Una città eliminata e poi ricreata torna tra le righe da salvare
+    merged = merged.merge(PendingWrite({"v": 3}, rows={"Kyoto": {"y": 2}}))
+    assert merged.rows["Kyoto"] == {"y": 2}
+    assert "Kyoto" not in merged.removed
+
+
+def test_merge_into_full_document():
+    full = PendingWrite({"v": 1, "meta": {"m": 1}, "dati_citta": {"Tokyo": {}, "Kyoto": {}}}, full=True)
+    merged = full.merge(PendingWrite({"v": 2, "meta": {"m": 2}}, rows={"Osaka": {"z": 1}}, removed={"Kyoto"}))
+    assert merged is full
+    assert merged.document["v"] == 2
+    assert merged.document["meta"] == {"m": 1}
+    assert merged.document["dati_citta"] == {"Tokyo": {}, "Osaka": {"z": 1}}
+
+
+def test_complete_write_replaces_pending():
+    newer = PendingWrite({"v": 2}, rows={"Tokyo": {}}, reset=True)
+    assert PendingWrite({"v": 1}, rows={"Kyoto": {}}).merge(newer) is newer
+
+
+def test_failed_write_stops_after_max_attempts_and_survives_restart(tmp_path):
+    path = str(tmp_path / "journal.db")
+
+    def failing(trip_id, pending):
+        raise ConnectionError("database non raggiungibile")
+
+    queue = SaveQueue(failing, retry_delay=0.001, max_attempts=2, journal=SaveJournal(path))
+    queue.submit("viaggio", PendingWrite({"v": 1}, rows={"Tokyo": {"x": 1}}))
+    queue.submit("viaggio", PendingWrite({"v": 2}, rows={"Kyoto": {"y": 1}}))
+    deadline = time.monotonic() + 5
+    while queue.status("viaggio")["stato"] != "fallito" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.status("viaggio")["stato"] == "fallito"
+    assert queue.has_pending("viaggio")
+
+    saved = []
+    restarted = SaveQueue(lambda trip_id, pending: saved.append(pending) or True, journal=SaveJournal(path))
+    assert restarted.flush(5)
+    assert [(pending.document, pending.rows) for pending in saved] == [
+        ({"v": 2}, {"Tokyo": {"x": 1}, "Kyoto": {"y": 1}})
+    ]
+    assert SaveJournal(path).load() == {}
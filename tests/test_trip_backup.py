@@ -0,0 +1,66 @@
+import copy
+import os
+
+from trip_backup import BackupStore, apply_diff, json_diff
+from save_queue import PendingWrite
+
+
+def test_diff_round_trip():
+    old = {
+        "meta": {"ultima_modifica": "1"},
+        "indice_citta": ["Tokyo", "Kyoto"],
+        "dati_citta": {"Tokyo": {"alloggi": {"a": {"nome": "Hotel", "costo": 100}}}, "Kyoto": {}},
+        "custom_gallery_link": "",
+    }
+    new = copy.deepcopy(old)
+    new["meta"]["ultima_modifica"] = "2"
+    new["indice_citta"].append("Osaka")
+    new["dati_citta"]["Tokyo"]["alloggi"]["a"]["costo"] = 120
+    del new["dati_citta"]["Kyoto"]
+    new["dati_citta"]["Osaka"] = {"ristoranti": {"r": {"nome": "Ramen"}}}
+    new.pop("custom_gallery_link")
+
+    ops = json_diff(old, new)
+    assert apply_diff(copy.deepcopy(old), ops) == new
+    assert json_diff(new, new) == []
+
+
+def test_diff_replaces_root_of_different_type():
+    assert apply_diff({"a": 1}, json_diff({"a": 1}, [1, 2])) == [1, 2]
+
+
+def test_record_and_restore_versions(tmp_path):
+    store = BackupStore(str(tmp_path), keep=3, full_every=2)
+    documents = []
+    for number in range(5):
+        document = {"meta": {"n": number}, "dati_citta": {"Tokyo": {"alloggi": {f"a{number}": {"costo": number}}}}}
+        documents.append(document)
+        assert store.record("viaggio", PendingWrite(copy.deepcopy(document), full=True)) == number + 1
+
+    versions = store.versions("viaggio")
+    assert [version.number for version in versions] == [3, 4, 5]
+    assert versions[0].kind == "full"
+    for version in versions:
+        assert store.restore("viaggio", version.number) == documents[version.number - 1]
+
+
+def test_first_partial_write_uses_complete_document(tmp_path):
+    store = BackupStore(str(tmp_path))
+    complete = {"meta": {}, "dati_citta": {"Tokyo": {"a": 1}, "Kyoto": {"b": 2}}}
+    pending = PendingWrite({"meta": {}}, rows={"Kyoto": {"b": 2}})
+    store.record("viaggio", pending, load_trip=lambda trip_id: copy.deepcopy(complete))
+    assert store.restore("viaggio") == complete
+
+
+def test_versions_are_listed_again_only_after_a_write(tmp_path, monkeypatch):
+    store = BackupStore(str(tmp_path))
+    store.record("viaggio", PendingWrite({"dati_citta": {"Tokyo": {}}}, full=True))
+    listings = []
+    listdir = os.listdir
+    monkeypatch.setattr(os, "listdir", lambda folder: listings.append(folder) or listdir(folder))
+
+    assert len(store.versions("viaggio")) == 1
+    assert len(store.versions("viaggio")) == 1
+    assert listings == []
+    store.record("viaggio", PendingWrite({"dati_citta": {"Kyoto": {}}}, full=True))
+    assert [version.number for version in store.versions("viaggio")] == [1, 2]
@@ -0,0 +1,67 @@
+import copy
+
+from change_tracking import ChangeTracker
+from cost_index import check_cost_index, rebuild_cost_index
+from undo_history import OperationLog, apply_operations, operation_count, removal_operations
+
+
+def make_data():
+    data = {
+        "indice_citta": ["Tokyo"],
+        "dati_citta": {
+            "Tokyo": {
+                "alloggi": {"a1": {"nome": "Hotel", "costo": 100}},
+                "ristoranti": {"r1": {"nome": "Ramen", "costo": 1200, "valuta": "JPY"}},
+                "negozi": {}, "attivita": {}, "trasporti": {},
+                "coordinate": {"lat": 35.68, "lon": 139.69},
+            },
+        },
+    }
+    rebuild_cost_index(data)
+    return data
+
+
+def test_inverse_round_trip():
+    data = make_data()
+    original = copy.deepcopy(data)
+    changes = ChangeTracker()
+
+    inverse = apply_operations(data, removal_operations("Tokyo", "ristoranti", ["r1"]), changes)
+    assert "r1" not in data["dati_citta"]["Tokyo"]["ristoranti"]
+    assert changes.changed_keys("Tokyo", "ristoranti") == {"r1"}
+
+    again = apply_operations(data, inverse, ChangeTracker())
+    assert data == original
+    assert again == removal_operations("Tokyo", "ristoranti", ["r1"])
+
+
+def test_removing_last_item_removes_and_restores_city():
+    data = make_data()
+    original = copy.deepcopy(data)
+    operations = removal_operations("Tokyo", "alloggi", ["a1"]) + removal_operations("Tokyo", "ristoranti", ["r1"])
+    inverse = apply_operations(data, operations, ChangeTracker())
+    assert "Tokyo" not in data["dati_citta"]
+    assert data["indice_citta"] == []
+    assert check_cost_index(data) == []
+
+    apply_operations(data, inverse, ChangeTracker())
+    assert data == original
+
+
+def test_missing_items_are_skipped():
+    data = make_data()
+    assert apply_operations(data, removal_operations("Tokyo", "negozi", ["n1"]), ChangeTracker()) == []
+
+
+def test_log_limits_entries_and_operations():
+    log = OperationLog(size=2, max_operations=5)
+    assert log.record("uno", removal_operations("Tokyo", "negozi", ["a"]))
+    assert log.record("due", removal_operations("Tokyo", "negozi", ["b", "c"]))
+    assert log.record("tre", removal_operations("Tokyo", "negozi", ["d", "e", "f"]))
+    assert log.peek_undo()["descrizione"] == "tre"
+    assert log.undo(make_data(), ChangeTracker()) == "tre"
+    assert log.undo(make_data(), ChangeTracker()) == "due"
+    # "uno" è stata scartata: oltre due modifiche e oltre cinque operazioni
+    assert log.peek_undo() is None
+    assert not log.record("troppi", removal_operations("Tokyo", "negozi", list("abcdef")))
+    assert operation_count(removal_operations("Tokyo", "negozi", list("abc"))) == 3
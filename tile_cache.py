@@ -0,0 +1,245 @@
+"""Cache locale delle tile della mappa in un file MBTiles (SQLite) e server HTTP per Folium.
+
+Le tile del Giappone ai livelli di zoom usati dall'app vengono scaricate una volta
+(seed) e restano sempre in cache; quelle richieste durante la navigazione vengono
+aggiunte al bisogno ed eliminate per prime, dalla meno usata di recente, quando la
+cache supera max_tiles. Senza rete il server restituisce solo le tile in cache.
+
+Seed da riga di comando:
+    python tile_cache.py seed [--path data/tiles.mbtiles] [--min-zoom 0] [--max-zoom 8]
+"""
+
+import argparse
+import math
+import random
+import re
+import sqlite3
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+# Stesse tile di "cartodb positron" usate da Folium
+UPSTREAM_URL = "https://{s}.basemaps.cartocdn.com/light_all/{z}/{x}/{y}.png"
+ATTRIBUTION = "&copy; OpenStreetMap contributors &copy; CARTO"
+
+# Riquadro del Giappone (sud, ovest, nord, est) e zoom della mappa e della minimappa
+JAPAN_BOUNDS = (24.0, 122.5, 46.0, 146.0)
+SEED_ZOOMS = range(0, 9)
+
+
+def tiles_in_bounds(bounds, zoom: int):
+    """Coordinate (x, y) delle tile XYZ che coprono il riquadro al livello di zoom indicato"""
+    south, west, north, east = bounds
+    n = 2 ** zoom
+
+    def tile_x(lon):
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def tile_y(lat):
+        lat = math.radians(lat)
+        return min(n - 1, max(0, int((1.0 - math.asinh(math.tan(lat)) / math.pi) / 2.0 * n)))
+
+    for x in range(tile_x(west), tile_x(east) + 1):
+        for y in range(tile_y(north), tile_y(south) + 1):
+            yield x, y
+
+
+class MBTilesCache:
+    """Tile in formato MBTiles; last_access e pinned servono all'eliminazione LRU"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE IF NOT EXISTS tiles (
+            zoom_level INTEGER NOT NULL,
+            tile_column INTEGER NOT NULL,
+            tile_row INTEGER NOT NULL,
+            tile_data BLOB NOT NULL,
+            last_access REAL NOT NULL,
+            pinned INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (zoom_level, tile_column, tile_row)
+        );
+        CREATE INDEX IF NOT EXISTS idx_tiles_lru ON tiles (pinned, last_access);
+    """
+
+    def __init__(self, path: str = "data/tiles.mbtiles", max_tiles: int = 20000,
+                 upstream_url: str = UPSTREAM_URL, timeout: float = 10.0):
+        self.path = path
+        self.max_tiles = max_tiles
+        self.upstream_url = upstream_url
+        self.timeout = timeout
+        if path != ":memory:":
+            Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        if path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        with self._conn:
+            self._conn.executescript(self.SCHEMA)
+            self._conn.executemany("INSERT OR IGNORE INTO metadata VALUES (?, ?)", [
+                ("name", "Giappone"), ("format", "png"), ("type", "baselayer"),
+                ("attribution", ATTRIBUTION), ("bounds", "{1},{0},{3},{2}".format(*JAPAN_BOUNDS)),
+            ])
+
+    @staticmethod
+    def _row(zoom: int, y: int):
+        # MBTiles usa lo schema TMS: le righe sono numerate dal basso
+        return (2 ** zoom - 1) - y
+
+    def get(self, zoom: int, x: int, y: int):
+        """Tile in cache (PNG) oppure None; aggiorna l'ultimo accesso"""
+        key = (zoom, x, self._row(zoom, y))
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?", key
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE tiles SET last_access = ? WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                    (time.time(),) + key
+                )
+        return row[0] if row else None
+
+    def put(self, zoom: int, x: int, y: int, data: bytes, pinned: bool = False):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?, ?, "
+                "MAX(?, COALESCE((SELECT pinned FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?), 0)))",
+                (zoom, x, self._row(zoom, y), sqlite3.Binary(data), time.time(), int(pinned),
+                 zoom, x, self._row(zoom, y))
+            )
+            self._evict()
+
+    def _evict(self):
+        """Elimina le tile non fissate usate meno di recente oltre max_tiles (con il lock già preso)"""
+        total = self._conn.execute("SELECT COUNT(*) FROM tiles").fetchone()[0]
+        excess = total - self.max_tiles
+        if excess > 0:
+            # Libera un 10% in più per non eliminare a ogni inserimento
+            self._conn.execute(
+                "DELETE FROM tiles WHERE rowid IN ("
+                "SELECT rowid FROM tiles WHERE pinned = 0 ORDER BY last_access LIMIT ?)",
+                (excess + self.max_tiles // 10,)
+            )
+
+    def stats(self):
+        with self._lock:
+            total, pinned = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(pinned), 0) FROM tiles").fetchone()
+        return {"tile": total, "fissate": pinned, "max_tile": self.max_tiles}
+
+    def download(self, zoom: int, x: int, y: int):
+        """Scarica una tile dal server originale; None se la rete non è disponibile"""
+        url = self.upstream_url.format(s=random.choice("abcd"), z=zoom, x=x, y=y)
+        request = urllib.request.Request(url, headers={"User-Agent": "Japan_WebApp tile cache"})
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout) as response:
+                return response.read()
+        except OSError:
+            return None
+
+    def fetch(self, zoom: int, x: int, y: int):
+        """Tile dalla cache o, se manca, scaricata e aggiunta alla cache"""
+        data = self.get(zoom, x, y)
+        if data is None:
+            data = self.download(zoom, x, y)
+            if data is not None:
+                self.put(zoom, x, y, data)
+        return data
+
+    def seed(self, bounds=JAPAN_BOUNDS, zooms=SEED_ZOOMS, progress=None):
+        """Scarica e fissa in cache tutte le tile del riquadro; restituisce (scaricate, già presenti, mancanti)"""
+        downloaded = present = missing = 0
+        for zoom in zooms:
+            for x, y in tiles_in_bounds(bounds, zoom):
+                with self._lock:
+                    exists = self._conn.execute(
+                        "SELECT 1 FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                        (zoom, x, self._row(zoom, y))
+                    ).fetchone()
+                if exists:
+                    with self._lock, self._conn:
+                        self._conn.execute(
+                            "UPDATE tiles SET pinned = 1 WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                            (zoom, x, self._row(zoom, y))
+                        )
+                    present += 1
+                else:
+                    data = self.download(zoom, x, y)
+                    if data is None:
+                        missing += 1
+                    else:
+                        self.put(zoom, x, y, data, pinned=True)
+                        downloaded += 1
+                if progress:
+                    progress(zoom, downloaded, present, missing)
+        return downloaded, present, missing
+
+
+class TileServer:
+    """Server HTTP in un thread separato che serve /{z}/{x}/{y}.png dalla cache"""
+
+    PATH = re.compile(r"^/(\d+)/(\d+)/(\d+)\.png$")
+
+    def __init__(self, cache: MBTilesCache, host: str = "127.0.0.1", port: int = 8765, online: bool = True):
+        self.cache = cache
+        self.online = online
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                match = server.PATH.match(self.path.split("?")[0])
+                if not match:
+                    self.send_error(404)
+                    return
+                zoom, x, y = (int(value) for value in match.groups())
+                if server.online:
+                    data = server.cache.fetch(zoom, x, y)
+                else:
+                    data = server.cache.get(zoom, x, y)
+                if data is None:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(data)))
+                self.send_header("Cache-Control", "public, max-age=604800")
+                self.send_header("Access-Control-Allow-Origin", "*")
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer((host, port), Handler)
+        self._httpd.daemon_threads = True
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="tile-server", daemon=True)
+        self._thread.start()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cache locale delle tile della mappa")
+    parser.add_argument("command", choices=["seed", "stats"])
+    parser.add_argument("--path", default="data/tiles.mbtiles")
+    parser.add_argument("--min-zoom", type=int, default=SEED_ZOOMS.start)
+    parser.add_argument("--max-zoom", type=int, default=SEED_ZOOMS.stop - 1)
+    args = parser.parse_args()
+
+    cache = MBTilesCache(args.path)
+    if args.command == "seed":
+        def progress(zoom, downloaded, present, missing):
+            print(f"\rzoom {zoom}: scaricate {downloaded}, già presenti {present}, non disponibili {missing}",
+                  end="", flush=True)
+
+        downloaded, present, missing = cache.seed(zooms=range(args.min_zoom, args.max_zoom + 1), progress=progress)
+        print(f"\nScaricate {downloaded} tile, {present} già presenti, {missing} non disponibili")
+    print(cache.stats())
+
+
+if __name__ == "__main__":
+    main()
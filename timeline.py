@@ -0,0 +1,235 @@
+"""Timeline giorno per giorno del viaggio e ricerca dei conflitti tra gli elementi.
+
+Gli alloggi occupano le notti da check_in_date a check_out_date; ristoranti, negozi
+e attività con data e orario di visita occupano l'intervallo della visita. I
+conflitti vengono cercati con una scansione (sweep line) degli intervalli ordinati
+per inizio, senza confrontare ogni coppia di elementi:
+- due alloggi nella stessa notte
+- due visite che si sovrappongono
+- una visita fuori dall'orario di apertura
+- una visita in una città diversa da quella dell'alloggio della notte
+Gli intervalli di ogni città vengono ricalcolati solo quando cambiano i suoi elementi.
+"""
+
+import bisect
+import heapq
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+VISIT_CATEGORIES = ["ristoranti", "negozi", "attivita"]
+DEFAULT_VISIT_MINUTES = 60
+
+# kind: "soggiorno" per gli alloggi (dal giorno di check-in a quello di check-out), "visita" per le altre categorie
+Interval = namedtuple("Interval", ["start", "end", "city", "category", "key", "name", "kind"])
+Conflict = namedtuple("Conflict", ["day", "kind", "message", "items"])
+
+
+def _date(text):
+    try:
+        return datetime.strptime(text, "%d-%m-%Y")
+    except (TypeError, ValueError):
+        return None
+
+
+def _minutes(text):
+    try:
+        value = datetime.strptime(text, "%H:%M")
+    except (TypeError, ValueError):
+        return None
+    return value.hour * 60 + value.minute
+
+
+def city_intervals(city_name: str, city_data: dict):
+    """Intervalli degli alloggi e delle visite di una città"""
+    intervals = []
+    for key, item in (city_data.get("alloggi") or {}).items():
+        if not isinstance(item, dict):
+            continue
+        check_in, check_out = _date(item.get("check_in_date")), _date(item.get("check_out_date"))
+        if check_in is None or check_out is None or check_out <= check_in:
+            continue
+        intervals.append(Interval(check_in, check_out, city_name, "alloggi", key, item.get("nome", ""), "soggiorno"))
+
+    for category in VISIT_CATEGORIES:
+        for key, item in (city_data.get(category) or {}).items():
+            if not isinstance(item, dict):
+                continue
+            day, minutes = _date(item.get("data_visita")), _minutes(item.get("orario_visita"))
+            if day is None or minutes is None:
+                continue
+            start = day + timedelta(minutes=minutes)
+            duration = item.get("durata_minuti") or DEFAULT_VISIT_MINUTES
+            intervals.append(Interval(
+                start, start + timedelta(minutes=duration), city_name, category, key, item.get("nome", ""), "visita"
+            ))
+    return intervals
+
+
+def sweep_overlaps(intervals):
+    """Coppie di intervalli sovrapposti (estremi esclusi) con una scansione per inizio.
+
+    Gli intervalli ancora aperti stanno in un heap ordinato per fine: a ogni nuovo
+    inizio si chiudono quelli già terminati e ogni intervallo rimasto si sovrappone
+    al nuovo. Costo O(n log n + numero di sovrapposizioni).
+    """
+    pairs = []
+    active = []
+    for position, interval in enumerate(sorted(intervals, key=lambda i: (i.start, i.end))):
+        while active and active[0][0] <= interval.start:
+            heapq.heappop(active)
+        pairs.extend((other, interval) for _, _, other in active)
+        heapq.heappush(active, (interval.end, position, interval))
+    return pairs
+
+
+class IntervalIndex:
+    """Intervalli ordinati per inizio con il massimo delle fini dei prefissi.
+
+    at(t) parte dall'ultimo intervallo iniziato prima di t e torna indietro finché
+    qualche intervallo precedente può ancora contenere t.
+    """
+
+    def __init__(self, intervals):
+        self.intervals = sorted(intervals, key=lambda i: (i.start, i.end))
+        self._starts = [interval.start for interval in self.intervals]
+        self._max_end = []
+        running = None
+        for interval in self.intervals:
+            running = interval.end if running is None or interval.end > running else running
+            self._max_end.append(running)
+
+    def at(self, moment):
+        """Intervalli che contengono l'istante (inizio incluso, fine esclusa)"""
+        found = []
+        position = bisect.bisect_right(self._starts, moment) - 1
+        while position >= 0 and self._max_end[position] > moment:
+            if self.intervals[position].end > moment:
+                found.append(self.intervals[position])
+            position -= 1
+        return found
+
+
+def _outside_opening(visit, item):
+    """True se la visita non cade interamente nell'orario di apertura dell'elemento"""
+    opening, closing = _minutes(item.get("orario_apertura")), _minutes(item.get("orario_chiusura"))
+    if opening is None or closing is None or opening == closing:
+        # Orari non indicati (00:00 - 00:00) o aperto tutto il giorno
+        return False
+    start = visit.start.hour * 60 + visit.start.minute
+    end = start + int((visit.end - visit.start).total_seconds() // 60)
+    if closing < opening:
+        # Chiude dopo mezzanotte
+        closing += 24 * 60
+        if start < opening:
+            start, end = start + 24 * 60, end + 24 * 60
+    return start < opening or end > closing
+
+
+def find_conflicts(intervals, dati_citta: dict):
+    """Conflitti tra gli intervalli del viaggio, ordinati per giorno"""
+    stays = [interval for interval in intervals if interval.kind == "soggiorno"]
+    visits = [interval for interval in intervals if interval.kind == "visita"]
+    conflicts = []
+
+    for first, second in sweep_overlaps(stays):
+        day = max(first.start, second.start).date()
+        conflicts.append(Conflict(
+            day, "alloggi",
+            f"Due alloggi nella stessa notte: {first.name} ({first.city}) e {second.name} ({second.city})",
+            (first, second)
+        ))
+
+    for first, second in sweep_overlaps(visits):
+        conflicts.append(Conflict(
+            second.start.date(), "sovrapposizione",
+            f"Visite sovrapposte: {first.name} ({first.start:%H:%M}) e {second.name} ({second.start:%H:%M})",
+            (first, second)
+        ))
+
+    nights = IntervalIndex(stays)
+    for visit in visits:
+        item = dati_citta.get(visit.city, {}).get(visit.category, {}).get(visit.key, {})
+        if _outside_opening(visit, item):
+            conflicts.append(Conflict(
+                visit.start.date(), "orario",
+                f"{visit.name} alle {visit.start:%H:%M} è fuori dall'orario di apertura "
+                f"({item.get('orario_apertura')} - {item.get('orario_chiusura')})",
+                (visit,)
+            ))
+        # L'alloggio della notte è quello che contiene il giorno della visita
+        stays_that_day = nights.at(visit.start.replace(hour=12, minute=0))
+        if stays_that_day and all(stay.city != visit.city for stay in stays_that_day):
+            conflicts.append(Conflict(
+                visit.start.date(), "citta",
+                f"{visit.name} è a {visit.city} ma l'alloggio del giorno è a {stays_that_day[0].city}",
+                (visit,) + tuple(stays_that_day)
+            ))
+
+    conflicts.sort(key=lambda conflict: conflict.day)
+    return conflicts
+
+
+def _signature(city_data: dict):
+    # Le chiavi degli elementi non vengono riutilizzate: bastano a capire se la città è cambiata
+    return tuple(
+        tuple(city_data.get(category) or ())
+        for category in ["alloggi"] + VISIT_CATEGORIES
+    )
+
+
+class Timeline:
+    """Timeline del viaggio aggiornata in modo incrementale.
+
+    Gli intervalli vengono ricalcolati solo per le città i cui elementi sono cambiati;
+    giorni e conflitti vengono ricostruiti quando cambia almeno una città.
+    """
+
+    def __init__(self):
+        self._cities = {}
+        self._days = None
+        self._conflicts = None
+
+    def update(self, dati_citta: dict):
+        changed = False
+        for city_name in list(self._cities):
+            if city_name not in dati_citta:
+                del self._cities[city_name]
+                changed = True
+        for city_name, city_data in dati_citta.items():
+            signature = _signature(city_data)
+            cached = self._cities.get(city_name)
+            if cached is None or cached[0] != signature:
+                self._cities[city_name] = (signature, city_intervals(city_name, city_data))
+                changed = True
+
+        if changed or self._days is None:
+            intervals = [interval for _, city in self._cities.values() for interval in city]
+            self._days = group_by_day(intervals)
+            self._conflicts = find_conflicts(intervals, dati_citta)
+        return self
+
+    @property
+    def days(self):
+        """{giorno: [intervalli]}: i soggiorni compaiono in ogni giorno da check-in a check-out"""
+        return self._days
+
+    @property
+    def conflicts(self):
+        return self._conflicts
+
+
+def group_by_day(intervals):
+    """Intervalli raggruppati per giorno, in ordine di data e di inizio"""
+    days = {}
+    for interval in intervals:
+        if interval.kind == "soggiorno":
+            day = interval.start.date()
+            while day <= interval.end.date():
+                days.setdefault(day, []).append(interval)
+                day += timedelta(days=1)
+        else:
+            days.setdefault(interval.start.date(), []).append(interval)
+    return {
+        day: sorted(entries, key=lambda i: (i.kind != "soggiorno", i.start))
+        for day, entries in sorted(days.items())
+    }
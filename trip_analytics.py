@@ -0,0 +1,145 @@
+"""Tabella colonnare degli elementi del viaggio e aggregazioni vettoriali sui costi"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+from cities import CITY_CATEGORIES
+from currency import BASE_CURRENCY, item_currency, item_date, trip_date
+
+ITEM_COLUMNS = [
+    "citta", "categoria", "chiave", "nome", "tipo", "costo", "valuta", "data", "notti",
+    "check_in", "check_out", "prenotazione", "orario_apertura", "orario_chiusura"
+]
+
+
+def build_items_frame(dati_citta: dict):
+    """Appiattisce dati_citta in un DataFrame con una riga per elemento"""
+    columns = {column: [] for column in ITEM_COLUMNS}
+    for city_name, city_data in dati_citta.items():
+        for category in CITY_CATEGORIES:
+            for key, item in (city_data.get(category) or {}).items():
+                if not isinstance(item, dict):
+                    continue
+                columns["citta"].append(city_name)
+                columns["categoria"].append(category)
+                columns["chiave"].append(key)
+                columns["nome"].append(item.get("nome", ""))
+                columns["tipo"].append(item.get("tipo", ""))
+                columns["costo"].append(item.get("costo", 0) or 0)
+                columns["valuta"].append(item_currency(item))
+                columns["data"].append(item_date(item))
+                columns["notti"].append(item.get("notti", 0) or 0)
+                columns["check_in"].append(item.get("check_in_date"))
+                columns["check_out"].append(item.get("check_out_date"))
+                columns["prenotazione"].append(bool(item.get("prenotazione", False)))
+                columns["orario_apertura"].append(item.get("orario_apertura"))
+                columns["orario_chiusura"].append(item.get("orario_chiusura"))
+
+    frame = pd.DataFrame(columns, columns=ITEM_COLUMNS)
+    frame["citta"] = frame["citta"].astype("category")
+    frame["categoria"] = pd.Categorical(frame["categoria"], categories=CITY_CATEGORIES)
+    frame["costo"] = frame["costo"].astype(np.float64)
+    frame["valuta"] = frame["valuta"].astype("category")
+    frame["data"] = pd.to_datetime(frame["data"], format="%d-%m-%Y", errors="coerce")
+    frame["notti"] = frame["notti"].astype(np.int32)
+    frame["prenotazione"] = frame["prenotazione"].astype(bool)
+    frame["check_in"] = pd.to_datetime(frame["check_in"], format="%d-%m-%Y", errors="coerce")
+    frame["check_out"] = pd.to_datetime(frame["check_out"], format="%d-%m-%Y", errors="coerce")
+    return frame
+
+
+def data_version(data: dict):
+    """Firma economica dello stato dei dati: cambia a ogni salvataggio, modifica dell'indice costi
+    o caricamento di una città in modalità lazy"""
+    meta = data.get("meta", {})
+    index = data.get("budget", {}).get("suddivisione_per_citta", {})
+    loaded = tuple(data.get("dati_citta", {}))
+    return meta.get("ultima_modifica", ""), json.dumps(index, sort_keys=True), loaded
+
+
+class ItemsTable:
+    """Tabella degli elementi costruita al primo uso e riutilizzata finché i dati non cambiano.
+
+    Con una tabella dei tassi la colonna costo_eur (costi convertiti in euro al tasso
+    della data di ogni elemento, o della partenza se manca) viene calcolata una sola
+    volta per ogni snapshot dei tassi.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._frame = None
+        self._snapshot = None
+
+    def frame(self, data: dict, rates=None):
+        version = data_version(data)
+        if self._frame is None or version != self._version:
+            self._frame = build_items_frame(data.get("dati_citta", {}))
+            self._version = version
+            self._snapshot = None
+        if rates is not None and rates.snapshot != self._snapshot:
+            days = self._frame["data"].to_numpy(dtype="datetime64[D]")
+            departure = trip_date(data)
+            if departure is not None:
+                days = np.where(np.isnat(days), np.datetime64(departure, "D"), days)
+            self._frame["costo_eur"] = rates.to_base(self._frame["costo"].to_numpy(), self._frame["valuta"].to_numpy(), days)
+            self._snapshot = rates.snapshot
+        return self._frame
+
+    def invalidate(self):
+        self._frame = None
+        self._version = None
+        self._snapshot = None
+
+
+class IndexTotals:
+    """Totali in euro per città e categoria calcolati dall'indice dei costi.
+
+    Gli importi dell'indice (per città, categoria e valuta) non hanno data: vengono
+    convertiti insieme al tasso della data di partenza del viaggio e il risultato è riutilizzato finché non cambiano l'indice o lo snapshot dei tassi.
+    """
+
+    def __init__(self):
+        self._key = None
+        self._totals = None
+
+    def totals(self, data: dict, rates):
+        ultima_modifica, index, _ = data_version(data)
+        key = (ultima_modifica, index, rates.snapshot)
+        if self._totals is None or key != self._key:
+            self._totals = convert_index_totals(data, rates)
+            self._key = key
+        return self._totals
+
+
+def convert_index_totals(data: dict, rates):
+    """DataFrame città x categoria con i totali dell'indice convertiti in euro"""
+    per_citta = data.get("budget", {}).get("suddivisione_per_citta", {})
+    cities, categories, currencies, amounts = [], [], [], []
+    for city_name, entry in per_citta.items():
+        for category in CITY_CATEGORIES:
+            category_entry = entry.get(category, {})
+            for currency, amount in [(BASE_CURRENCY, category_entry.get("totale", 0))] + \
+                    list(category_entry.get("valute", {}).items()):
+                cities.append(city_name)
+                categories.append(category)
+                currencies.append(currency)
+                amounts.append(amount)
+    frame = pd.DataFrame({
+        "citta": cities,
+        "categoria": pd.Categorical(categories, categories=CITY_CATEGORIES),
+        "costo_eur": rates.to_base(amounts, currencies, trip_date(data))
+    })
+    return frame.pivot_table(
+        index="citta", columns="categoria", values="costo_eur",
+        aggfunc="sum", fill_value=0.0, observed=False
+    ).reindex(columns=CITY_CATEGORIES, fill_value=0.0)
+
+
+def category_totals(frame: pd.DataFrame, city_name: str = None, value: str = "costo_eur"):
+    """Costo totale (in euro) e numero di elementi per categoria, per una città o per tutto il viaggio"""
+    if city_name is not None:
+        frame = frame[frame["citta"] == city_name]
+    return frame.groupby("categoria", observed=False)[value].agg(totale="sum", elementi="count")
+
@@ -0,0 +1,255 @@
+"""Backup versionati del viaggio salvati come differenze compresse rispetto alla versione precedente.
+
+Ogni salvataggio riuscito diventa una versione in data/backup/<viaggio>/: un file
+JSON compresso con gzip che contiene le sole differenze dal documento precedente,
+oppure il documento completo ogni FULL_EVERY versioni. Per ripristinare una
+versione si parte dal documento completo più vicino e si applicano al massimo
+FULL_EVERY - 1 differenze. Si mantengono le ultime keep versioni (ed eventualmente
+solo quelle degli ultimi max_age_days giorni): la più vecchia rimasta viene
+riscritta come documento completo prima di eliminare le precedenti.
+I backup vengono scritti da un thread separato, dopo il salvataggio nel database.
+"""
+
+import copy
+import gzip
+import json
+import os
+import queue
+import re
+import threading
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+FULL_EVERY = 20
+
+Version = namedtuple("Version", ["number", "timestamp", "kind", "path", "size"])
+
+_FILE_NAME = re.compile(r"^(\d{8})_(\d{8}T\d{6}\d{6})_(full|delta)\.json\.gz$")
+
+
+def json_diff(old, new, path=()):
+    """Operazioni che trasformano old in new: ["set", percorso, valore] e ["del", percorso].
+
+    I dizionari vengono confrontati chiave per chiave; liste e valori semplici
+    diversi vengono sostituiti interamente.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key in old:
+            if key not in new:
+                ops.append(["del", list(path) + [key]])
+        for key, value in new.items():
+            if key not in old:
+                ops.append(["set", list(path) + [key], value])
+            elif old[key] != value:
+                ops.extend(json_diff(old[key], value, path + (key,)))
+        return ops
+    return [] if old == new else [["set", list(path), new]]
+
+
+def apply_diff(document, ops):
+    """Applica le operazioni di json_diff al documento (modificandolo) e lo restituisce"""
+    for op, path, *value in ops:
+        if not path:
+            document = copy.deepcopy(value[0])
+            continue
+        parent = document
+        for key in path[:-1]:
+            parent = parent[key]
+        if op == "set":
+            parent[path[-1]] = copy.deepcopy(value[0])
+        else:
+            parent.pop(path[-1], None)
+    return document
+
+
+def full_state(previous: dict, pending):
+    """Documento completo (città comprese) dopo una scrittura della coda di salvataggio"""
+    if pending.full:
+        return pending.document
+    state = copy.deepcopy({key: value for key, value in pending.document.items() if key != "dati_citta"})
+    cities = {} if pending.reset or previous is None else copy.deepcopy(previous.get("dati_citta", {}))
+    for city_name in pending.removed:
+        cities.pop(city_name, None)
+    cities.update(copy.deepcopy(pending.rows))
+    state["dati_citta"] = cities
+    return state
+
+
+class BackupStore:
+    """Versioni dei documenti dei viaggi su disco, scritte in un thread separato"""
+
+    def __init__(self, folder: str = "data/backup", keep: int = 10, max_age_days: float = None, full_every: int = FULL_EVERY):
+        self.folder = folder
+        self.keep = max(1, keep)
+        self.max_age_days = max_age_days
+        self.full_every = max(1, full_every)
+        self.last_error = None
+        # Ultimo documento salvato per viaggio: evita di ricostruirlo dal disco a ogni versione
+        self._latest = {}
+        # Elenco delle versioni per viaggio, invalidato da ogni scrittura o eliminazione di file
+        self._versions = {}
+        self._lock = threading.RLock()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="trip-backup", daemon=True)
+        self._thread.start()
+
+    def submit(self, trip_id: str, pending, load_trip=None):
+        """Accoda il backup di una scrittura riuscita; non attende la scrittura del file.
+
+        load_trip(trip_id) restituisce il documento completo salvato (città comprese): serve
+        per la prima versione quando la scrittura contiene solo le città modificate.
+        """
+        self._queue.put((trip_id, pending, load_trip))
+
+    def flush(self):
+        """Attende che tutti i backup accodati siano scritti"""
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            trip_id, pending, load_trip = self._queue.get()
+            try:
+                self.record(trip_id, pending, load_trip)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = str(e)
+            finally:
+                self._queue.task_done()
+
+    def _trip_folder(self, trip_id: str):
+        return os.path.join(self.folder, trip_id)
+
+    def versions(self, trip_id: str = "default_trip"):
+        """Versioni disponibili dalla più vecchia alla più recente.
+
+        L'elenco viene letto dalla cartella solo dopo una scrittura: la sidebar lo chiede a
+        ogni rerun senza rileggere i file.
+        """
+        cached = self._versions.get(trip_id)
+        if cached is None:
+            with self._lock:
+                cached = self._versions.get(trip_id)
+                if cached is None:
+                    cached = self._versions[trip_id] = self._list_versions(trip_id)
+        return list(cached)
+
+    def _list_versions(self, trip_id: str):
+        """Versioni lette dai nomi dei file della cartella del viaggio"""
+        folder = self._trip_folder(trip_id)
+        try:
+            names = os.listdir(folder)
+        except OSError:
+            return []
+        versions = []
+        for name in names:
+            match = _FILE_NAME.match(name)
+            if match:
+                path = os.path.join(folder, name)
+                versions.append(Version(
+                    int(match.group(1)), datetime.strptime(match.group(2), "%Y%m%dT%H%M%S%f"),
+                    match.group(3), path, os.path.getsize(path)
+                ))
+        versions.sort()
+        return versions
+
+    @staticmethod
+    def _read(path: str):
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            return json.load(f)
+
+    def _write(self, trip_id: str, number: int, kind: str, payload, timestamp: datetime):
+        folder = self._trip_folder(trip_id)
+        os.makedirs(folder, exist_ok=True)
+        path = os.path.join(folder, f"{number:08d}_{timestamp:%Y%m%dT%H%M%S%f}_{kind}.json.gz")
+        temporary = path + ".tmp"
+        with gzip.open(temporary, "wt", encoding="utf-8", compresslevel=6) as f:
+            json.dump(payload, f, ensure_ascii=False, separators=(",", ":"))
+        os.replace(temporary, path)
+        self._versions.pop(trip_id, None)
+        return path
+
+    def record(self, trip_id: str, pending, load_trip=None):
+        """Scrive la versione corrispondente a una scrittura riuscita; None se il documento non è cambiato"""
+        with self._lock:
+            versions = self.versions(trip_id)
+            previous = self._latest.get(trip_id)
+            if previous is None and versions:
+                previous = self._restore(versions, versions[-1].number)
+            if previous is None and not pending.full:
+                # Prima versione da una scrittura parziale: le città non modificate sono solo nel database
+                if load_trip is None:
+                    raise ValueError("Prima versione del backup senza il documento completo del viaggio")
+                state = load_trip(trip_id)
+                if state is None:
+                    raise ValueError(f"Viaggio {trip_id} non trovato per la prima versione del backup")
+            else:
+                state = full_state(previous, pending)
+            if previous is not None and _without_meta(previous) == _without_meta(state):
+                # Solo meta (data dell'ultima modifica) diverso: nessuna nuova versione
+                return None
+
+            number = versions[-1].number + 1 if versions else 1
+            since_full = 0
+            for version in reversed(versions):
+                if version.kind == "full":
+                    break
+                since_full += 1
+            if previous is None or since_full + 1 >= self.full_every:
+                self._write(trip_id, number, "full", state, datetime.now())
+            else:
+                self._write(trip_id, number, "delta", json_diff(previous, state), datetime.now())
+            self._latest[trip_id] = copy.deepcopy(state)
+            self._prune(trip_id)
+            return number
+
+    def _restore(self, versions, number: int):
+        """Documento della versione number, dal documento completo più vicino in avanti"""
+        chain = [version for version in versions if version.number <= number]
+        if not chain or chain[-1].number != number:
+            raise KeyError(f"Versione {number} non disponibile")
+        start = max(position for position, version in enumerate(chain) if version.kind == "full")
+        document = self._read(chain[start].path)
+        for version in chain[start + 1:]:
+            document = apply_diff(document, self._read(version.path))
+        return document
+
+    def restore(self, trip_id: str = "default_trip", number: int = None):
+        """Documento completo della versione indicata (la più recente se number è None)"""
+        with self._lock:
+            versions = self.versions(trip_id)
+            if not versions:
+                raise KeyError("Nessun backup disponibile")
+            return self._restore(versions, versions[-1].number if number is None else number)
+
+    def restore_at(self, trip_id: str, moment: datetime):
+        """Documento com'era all'istante indicato: l'ultima versione salvata non oltre moment"""
+        candidates = [version for version in self.versions(trip_id) if version.timestamp <= moment]
+        if not candidates:
+            raise KeyError(f"Nessun backup precedente a {moment:%Y-%m-%d %H:%M:%S}")
+        return self.restore(trip_id, candidates[-1].number)
+
+    def _prune(self, trip_id: str):
+        """Applica la finestra di conservazione mantenendo ripristinabili le versioni rimaste"""
+        versions = self.versions(trip_id)
+        kept = versions[-self.keep:]
+        if self.max_age_days is not None:
+            limit = datetime.now() - timedelta(days=self.max_age_days)
+            # L'ultima versione resta sempre, anche se più vecchia della finestra
+            kept = [version for version in kept[:-1] if version.timestamp >= limit] + kept[-1:]
+        if len(kept) == len(versions):
+            return
+        oldest = kept[0]
+        if oldest.kind == "delta":
+            # La più vecchia rimasta diventa il nuovo documento completo di partenza
+            document = self._restore(versions, oldest.number)
+            self._write(trip_id, oldest.number, "full", document, oldest.timestamp)
+            os.remove(oldest.path)
+        for version in versions:
+            if version.number < oldest.number:
+                os.remove(version.path)
+        self._versions.pop(trip_id, None)
+
+
+def _without_meta(document: dict):
+    return {key: value for key, value in document.items() if key != "meta"}
@@ -0,0 +1,48 @@
+"""Cache in memoria dei documenti dei viaggi con scadenza (TTL) e invalidazione esplicita"""
+
+import copy
+import threading
+import time
+from collections import namedtuple
+
+CacheEntry = namedtuple("CacheEntry", ["data", "updated_at", "expired"])
+
+
+class TripCache:
+    """Cache dei documenti dei viaggi indicizzata per trip_id, condivisa tra le sessioni"""
+
+    def __init__(self, ttl: float = 30.0):
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, trip_id: str):
+        """Restituisce una CacheEntry con una copia dei dati, oppure None se assente"""
+        with self._lock:
+            entry = self._entries.get(trip_id)
+            if entry is None:
+                return None
+            data, updated_at, stored_at = entry
+            expired = time.monotonic() - stored_at > self.ttl
+            # Copia profonda: le sessioni modificano i dati sul posto
+            return CacheEntry(copy.deepcopy(data), updated_at, expired)
+
+    def put(self, trip_id: str, data: dict, updated_at=None):
+        """Memorizza il documento insieme alla sua versione (updated_at)"""
+        with self._lock:
+            self._entries[trip_id] = (copy.deepcopy(data), updated_at, time.monotonic())
+
+    def refresh(self, trip_id: str):
+        """Rinnova la scadenza di un documento la cui versione è ancora valida"""
+        with self._lock:
+            entry = self._entries.get(trip_id)
+            if entry is not None:
+                self._entries[trip_id] = (entry[0], entry[1], time.monotonic())
+
+    def invalidate(self, trip_id: str = None):
+        """Rimuove un documento dalla cache, o tutti se trip_id è None"""
+        with self._lock:
+            if trip_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(trip_id, None)
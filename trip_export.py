@@ -0,0 +1,287 @@
+"""Esportazione del riepilogo del viaggio in XLSX e PDF, riga per riga.
+
+Le righe vengono generate scorrendo costi_partenza e le città una alla volta e
+scritte subito nel file di destinazione: nessun report completo viene costruito
+in memoria. Con city_loader le città non ancora caricate vengono lette dal
+backend una per volta e rilasciate dopo l'esportazione.
+"""
+
+from cities import CITY_CATEGORIES, CATEGORY_LABELS
+from currency import item_currency, item_date, load_rate_table, trip_date
+
+ITEM_HEADER = ["Città", "Categoria", "Nome", "Tipo", "Dettagli", "Importo", "Valuta", "Costo (€)"]
+PRE_DEPARTURE_HEADER = ["Voce", "Dettagli", "Costo (€)"]
+
+
+def iter_pre_departure_rows(data: dict):
+    """Righe dei costi pre-partenza: (voce, dettagli, costo)"""
+    pre_partenza = data.get("costi_partenza", {})
+    volo = pre_partenza.get("volo", {})
+    if volo:
+        yield (
+            "Volo",
+            f"{volo.get('partenza', '')} -> {volo.get('arrivo', '')}, {volo.get('data_partenza', '')} "
+            f"{volo.get('ora_partenza', '')}, {volo.get('compagnia', '')}",
+            float(volo.get("totale", 0) or 0)
+        )
+    assicurazione = pre_partenza.get("assicurazione", {})
+    if assicurazione:
+        yield (
+            "Assicurazione",
+            f"Massimale medico € {assicurazione.get('massimale_medico', 0):,.0f}",
+            float(assicurazione.get("costo", 0) or 0)
+        )
+    altro = pre_partenza.get("altro", {})
+    if altro:
+        yield (
+            "Altro",
+            f"eSIM {altro.get('gb_sim', 0)} GB, contanti € {altro.get('contanti', 0):,.2f}",
+            float(altro.get("totale", 0) or 0)
+        )
+
+
+def _item_row(city_name, category, item, rates, departure=None):
+    if category == "trasporti":
+        name = item.get("tipo", "") if item.get("tipo") == "Japan Rail Pass" else \
+            f"{item.get('partenza', '')} -> {item.get('arrivo', '')}"
+        details = item.get("durata", "") or item.get("note", "")
+    elif category == "alloggi":
+        name = item.get("nome", "")
+        details = f"{item.get('check_in_date', '')} - {item.get('check_out_date', '')}, {item.get('notti', 0)} notti"
+    else:
+        name = item.get("nome", "")
+        details = f"{item.get('orario_apertura', '')}-{item.get('orario_chiusura', '')}"
+    amount, currency = float(item.get("costo", 0) or 0), item_currency(item)
+    return (
+        city_name, CATEGORY_LABELS[category], name, item.get("tipo", ""),
+        details, amount, currency, round(rates.convert(amount, currency, item_date(item) or departure), 2)
+    )
+
+
+def iter_cities(data: dict, city_loader=None):
+    """Restituisce (città, dati) per tutte le città del viaggio, caricando le mancanti una alla volta"""
+    dati_citta = data.get("dati_citta", {})
+    names = list(dati_citta)
+    names += [name for name in data.get("indice_citta", []) if name not in dati_citta]
+    for city_name in names:
+        if city_name in dati_citta:
+            yield city_name, dati_citta[city_name]
+        elif city_loader is not None:
+            yield city_name, city_loader(city_name)
+
+
+def iter_item_rows(data: dict, city_loader=None, rates=None):
+    """Righe degli elementi di tutte le città nell'ordine città/categoria, con il costo convertito in euro"""
+    rates = rates or load_rate_table(data)
+    # Ogni elemento al tasso della sua data; quelli senza data al tasso della partenza
+    departure = trip_date(data)
+    for city_name, city_data in iter_cities(data, city_loader):
+        for category in CITY_CATEGORIES:
+            for item in (city_data.get(category) or {}).values():
+                if isinstance(item, dict):
+                    yield _item_row(city_name, category, item, rates, departure)
+
+
+class _Totals:
+    """Totali per città e categoria accumulati mentre le righe vengono scritte"""
+
+    def __init__(self):
+        self.per_city = {}
+        self.per_category = {label: 0.0 for label in CATEGORY_LABELS.values()}
+        self.items = 0
+
+    def add(self, row):
+        city_name, category, cost = row[0], row[1], row[-1]
+        self.per_city[city_name] = self.per_city.get(city_name, 0.0) + cost
+        self.per_category[category] += cost
+        self.items += 1
+
+    def total(self):
+        return sum(self.per_category.values())
+
+
+def export_xlsx(data: dict, output, city_loader=None, rates=None):
+    """Scrive il riepilogo in un file XLSX in modalità write-only (righe scritte su disco man mano)"""
+    try:
+        from openpyxl import Workbook
+    except ImportError as e:
+        raise ImportError("Per esportare in Excel installa openpyxl (pip install openpyxl)") from e
+
+    workbook = Workbook(write_only=True)
+
+    sheet = workbook.create_sheet("Pre-partenza")
+    sheet.append(PRE_DEPARTURE_HEADER)
+    for row in iter_pre_departure_rows(data):
+        sheet.append(list(row))
+    pre_departure_total = float(data.get("costi_partenza", {}).get("totale_generale", 0) or 0)
+    sheet.append(["TOTALE", "", pre_departure_total])
+
+    totals = _Totals()
+    sheet = workbook.create_sheet("Elementi")
+    sheet.append(ITEM_HEADER)
+    for row in iter_item_rows(data, city_loader, rates):
+        sheet.append(list(row))
+        totals.add(row)
+
+    sheet = workbook.create_sheet("Riepilogo")
+    sheet.append(["Città", "Costo (€)"])
+    for city_name, cost in totals.per_city.items():
+        sheet.append([city_name, round(cost, 2)])
+    sheet.append([])
+    sheet.append(["Categoria", "Costo (€)"])
+    for category, cost in totals.per_category.items():
+        sheet.append([category, round(cost, 2)])
+    sheet.append([])
+    sheet.append(["Costi pre-partenza", pre_departure_total])
+    sheet.append(["Costi città", round(totals.total(), 2)])
+    sheet.append(["TOTALE VIAGGIO", round(pre_departure_total + totals.total(), 2)])
+
+    workbook.save(output)
+    return totals.items
+
+
+class StreamingPDFWriter:
+    """PDF di solo testo scritto pagina per pagina: in memoria c'è solo la pagina corrente.
+
+    Usa i font standard Courier (WinAnsiEncoding), quindi non serve alcuna libreria esterna;
+    i caratteri non rappresentabili vengono sostituiti con "?".
+    """
+
+    PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in punti
+
+    def __init__(self, output, font_size: int = 8, margin: int = 36):
+        self.output = output
+        self.font_size = font_size
+        self.leading = font_size + 2
+        self.margin = margin
+        self.lines_per_page = (self.PAGE_HEIGHT - 2 * margin) // self.leading
+        self.columns = int((self.PAGE_WIDTH - 2 * margin) / (font_size * 0.6))
+        self._offsets = {}
+        self._position = 0
+        self._next_id = 5  # 1 catalogo, 2 pagine, 3-4 font
+        self._page_ids = []
+        self._lines = []
+
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        for object_id, font in ((3, "Courier"), (4, "Courier-Bold")):
+            self._write_object(
+                object_id,
+                f"<< /Type /Font /Subtype /Type1 /BaseFont /{font} /Encoding /WinAnsiEncoding >>".encode()
+            )
+
+    def _write(self, chunk: bytes):
+        self.output.write(chunk)
+        self._position += len(chunk)
+
+    def _write_object(self, object_id: int, body: bytes):
+        self._offsets[object_id] = self._position
+        self._write(f"{object_id} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def _new_id(self):
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    @staticmethod
+    def _escape(text: str):
+        encoded = text.encode("cp1252", errors="replace")
+        return encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+    def add_line(self, text: str = "", bold: bool = False):
+        self._lines.append((text[:self.columns], bold))
+        if len(self._lines) >= self.lines_per_page:
+            self._flush_page()
+
+    def _flush_page(self):
+        if not self._lines:
+            return
+        top = self.PAGE_HEIGHT - self.margin - self.font_size
+        stream = [f"BT {self.leading} TL {self.margin} {top} Td".encode()]
+        current_font = None
+        for text, bold in self._lines:
+            font = b"/F2" if bold else b"/F1"
+            if font != current_font:
+                stream.append(font + f" {self.font_size} Tf".encode())
+                current_font = font
+            stream.append(b"(" + self._escape(text) + b") Tj T*")
+        stream.append(b"ET")
+        content = b"\n".join(stream)
+
+        content_id = self._new_id()
+        self._write_object(
+            content_id,
+            f"<< /Length {len(content)} >>\nstream\n".encode() + content + b"\nendstream"
+        )
+        page_id = self._new_id()
+        self._write_object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.PAGE_WIDTH} {self.PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode())
+        self._page_ids.append(page_id)
+        self._lines = []
+
+    def close(self):
+        """Scrive l'ultima pagina, l'albero delle pagine e la tabella xref"""
+        if self._lines or not self._page_ids:
+            self._lines = self._lines or [("", False)]
+            self._flush_page()
+        kids = " ".join(f"{page_id} 0 R" for page_id in self._page_ids)
+        self._write_object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self._page_ids)} >>".encode())
+        self._write_object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+
+        xref_position = self._position
+        size = self._next_id
+        xref = [f"xref\n0 {size}\n".encode(), b"0000000000 65535 f \n"]
+        for object_id in range(1, size):
+            xref.append(f"{self._offsets[object_id]:010d} 00000 n \n".encode())
+        self._write(b"".join(xref))
+        self._write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n".encode())
+
+
+def _format_row(row, widths):
+    cells = []
+    for value, width in zip(row, widths):
+        text = f"{value:,.2f}" if isinstance(value, float) else str(value)
+        cells.append(text[:width].rjust(width) if isinstance(value, float) else text[:width].ljust(width))
+    return " ".join(cells)
+
+
+def export_pdf(data: dict, output, city_loader=None, rates=None):
+    """Scrive il riepilogo in PDF riga per riga"""
+    pdf = StreamingPDFWriter(output)
+    pdf.add_line("Viaggio in Giappone - Riepilogo costi", bold=True)
+    pdf.add_line(f"Ultima modifica: {data.get('meta', {}).get('ultima_modifica', '')}")
+    pdf.add_line()
+
+    pre_widths = [16, 70, 14]
+    pdf.add_line("Costi pre-partenza", bold=True)
+    pdf.add_line(_format_row(PRE_DEPARTURE_HEADER, pre_widths), bold=True)
+    for row in iter_pre_departure_rows(data):
+        pdf.add_line(_format_row(row, pre_widths))
+    pre_departure_total = float(data.get("costi_partenza", {}).get("totale_generale", 0) or 0)
+    pdf.add_line(_format_row(("TOTALE", "", pre_departure_total), pre_widths), bold=True)
+    pdf.add_line()
+
+    item_widths = [11, 10, 24, 11, 20, 10, 4, 12]
+    totals = _Totals()
+    pdf.add_line("Elementi per città", bold=True)
+    pdf.add_line(_format_row(ITEM_HEADER, item_widths), bold=True)
+    for row in iter_item_rows(data, city_loader, rates):
+        pdf.add_line(_format_row(row, item_widths))
+        totals.add(row)
+    pdf.add_line()
+
+    pdf.add_line("Riepilogo per città", bold=True)
+    for city_name, cost in totals.per_city.items():
+        pdf.add_line(_format_row((city_name, cost), [30, 14]))
+    pdf.add_line()
+    pdf.add_line("Riepilogo per categoria", bold=True)
+    for category, cost in totals.per_category.items():
+        pdf.add_line(_format_row((category, cost), [30, 14]))
+    pdf.add_line()
+    pdf.add_line(_format_row(("Costi pre-partenza", pre_departure_total), [30, 14]))
+    pdf.add_line(_format_row(("Costi città", totals.total()), [30, 14]))
+    pdf.add_line(_format_row(("TOTALE VIAGGIO", pre_departure_total + totals.total()), [30, 14]), bold=True)
+
+    pdf.close()
+    return totals.items
@@ -0,0 +1,242 @@
+"""Annulla e ripeti per l'aggiunta e l'eliminazione degli elementi delle città.
+
+Ogni voce della cronologia è una lista di operazioni che annullano una modifica:
+- {"op": "aggiungi", "citta", "categoria", "chiave", "elemento"}: rimette un elemento
+  eliminato; con "struttura_citta" ricrea anche la città rimossa perché vuota
+- {"op": "rimuovi", "citta", "categoria", "chiavi"}: elimina gli elementi aggiunti con
+  le chiavi indicate (una sola operazione per città e categoria, anche per le importazioni)
+Applicare una voce restituisce le operazioni inverse, che diventano la voce da
+ripetere (e viceversa): i dati vengono modificati in sessione senza ricaricare il
+viaggio dal database. Le due pile hanno un numero massimo di voci e di elementi
+coinvolti (le voci più vecchie vengono scartate) e possono essere salvate in un file
+JSON per viaggio e sessione, per sopravvivere al riavvio della sessione.
+"""
+
+import copy
+import json
+import os
+from collections import deque
+from datetime import datetime, timedelta
+
+from cities import CITY_CATEGORIES
+from cost_index import index_add_item, index_remove_item
+
+DEFAULT_HISTORY_SIZE = 50
+# Elementi coinvolti da tutte le voci delle due pile (un'importazione ne tocca migliaia)
+DEFAULT_MAX_OPERATIONS = 20000
+
+
+def _city_is_empty(city_data: dict):
+    return not any(city_data.get(category) for category in CITY_CATEGORIES)
+
+
+def _add(data: dict, op: dict, changes):
+    city_name, category, key = op["citta"], op["categoria"], op["chiave"]
+    dati_citta = data.setdefault("dati_citta", {})
+    if city_name not in dati_citta:
+        dati_citta[city_name] = copy.deepcopy(op.get("struttura_citta")) or {c: {} for c in CITY_CATEGORIES}
+        city_index = data.setdefault("indice_citta", [])
+        if city_name not in city_index:
+            city_index.insert(min(op.get("posizione", len(city_index)), len(city_index)), city_name)
+        changes.mark_city(city_name)
+    items = dati_citta[city_name].setdefault(category, {})
+    if key in items:
+        index_remove_item(data, city_name, category, items[key])
+    items[key] = copy.deepcopy(op["elemento"])
+    index_add_item(data, city_name, category, items[key])
+    changes.mark_item(city_name, category, key)
+    return {"op": "rimuovi", "citta": city_name, "categoria": category, "chiavi": [key]}
+
+
+def _remove(data: dict, op: dict, key, changes):
+    city_name, category = op["citta"], op["categoria"]
+    city_data = data.get("dati_citta", {}).get(city_name)
+    if city_data is None or key not in (city_data.get(category) or {}):
+        # Elemento già eliminato (es. da un'altra sessione): niente da annullare
+        return None
+    item = city_data[category].pop(key)
+    index_remove_item(data, city_name, category, item)
+    changes.mark_item(city_name, category, key)
+    inverse = {"op": "aggiungi", "citta": city_name, "categoria": category, "chiave": key, "elemento": item}
+    if _city_is_empty(city_data):
+        # La città rimasta vuota viene rimossa; la sua struttura (coordinate, contatori) resta nell'inversa
+        city_index = data.get("indice_citta", [])
+        if city_name in city_index:
+            inverse["posizione"] = city_index.index(city_name)
+            city_index.remove(city_name)
+        inverse["struttura_citta"] = data["dati_citta"].pop(city_name)
+        changes.mark_city(city_name)
+    return inverse
+
+
+def apply_operations(data: dict, operations: list, changes):
+    """Applica le operazioni ai dati, segnando le modifiche da salvare; restituisce le operazioni inverse"""
+    inverse = []
+    for op in operations:
+        if op["op"] == "aggiungi":
+            inverse.append(_add(data, op, changes))
+            continue
+        # "chiave": voci salvate prima delle operazioni con più chiavi
+        for key in op.get("chiavi", [op.get("chiave")]):
+            result = _remove(data, op, key, changes)
+            if result is not None:
+                inverse.append(result)
+    inverse.reverse()
+    return _merge_removals(inverse)
+
+
+def _merge_removals(operations: list):
+    """Unisce le eliminazioni consecutive della stessa città e categoria in un'unica operazione"""
+    merged = []
+    for op in operations:
+        previous = merged[-1] if merged else None
+        if op["op"] == "rimuovi" and previous is not None and previous["op"] == "rimuovi" \
+                and (previous["citta"], previous["categoria"]) == (op["citta"], op["categoria"]):
+            previous["chiavi"].extend(op["chiavi"])
+        else:
+            merged.append(op)
+    return merged
+
+
+def operation_count(operations: list):
+    """Elementi coinvolti dalle operazioni di una voce"""
+    return sum(len(op["chiavi"]) if "chiavi" in op else 1 for op in operations)
+
+
+def removal_operations(city_name: str, category: str, keys):
+    """Operazione che annulla l'aggiunta degli elementi con le chiavi indicate"""
+    keys = list(keys)
+    return [{"op": "rimuovi", "citta": city_name, "categoria": category, "chiavi": keys}] if keys else []
+
+
+def changes_to_removals(changes):
+    """Operazioni che annullano le aggiunte registrate in un ChangeTracker"""
+    return [
+        op
+        for city_name, categories in changes.cities.items()
+        for category, keys in categories.items()
+        for op in removal_operations(city_name, category, sorted(keys))
+    ]
+
+
+def history_path(folder: str, trip_id: str, session_id: str):
+    """File della cronologia di una sessione su un viaggio"""
+    return os.path.join(folder, trip_id, f"{session_id}.json")
+
+
+def prune_history_files(folder: str, max_age_days: float = 30):
+    """Elimina i file delle cronologie non modificati da max_age_days giorni (sessioni abbandonate)"""
+    limit = (datetime.now() - timedelta(days=max_age_days)).timestamp()
+    try:
+        trips = os.listdir(folder)
+    except OSError:
+        return
+    for trip_id in trips:
+        trip_folder = os.path.join(folder, trip_id)
+        try:
+            names = os.listdir(trip_folder)
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(trip_folder, name)
+            try:
+                if os.path.getmtime(path) < limit:
+                    os.remove(path)
+            except OSError:
+                pass
+
+
+class OperationLog:
+    """Pile limitate delle modifiche da annullare e da ripetere, salvate facoltativamente su file.
+
+    Oltre al numero di voci (size) è limitato il numero totale di elementi coinvolti
+    (max_operations): quando viene superato si scartano le voci più vecchie.
+    """
+
+    def __init__(self, size: int = DEFAULT_HISTORY_SIZE, path: str = None, max_operations: int = DEFAULT_MAX_OPERATIONS):
+        self.size = max(1, size)
+        self.path = path
+        self.max_operations = max(1, max_operations)
+        self._undo = deque(maxlen=self.size)
+        self._redo = deque(maxlen=self.size)
+        self._load()
+        self._trim()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                saved = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._undo.extend(saved.get("annulla", []))
+        self._redo.extend(saved.get("ripeti", []))
+
+    def _save(self):
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        temporary = self.path + ".tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            json.dump({"annulla": list(self._undo), "ripeti": list(self._redo)}, f, ensure_ascii=False)
+        os.replace(temporary, self.path)
+
+    def _trim(self):
+        """Scarta le voci più vecchie (prima quelle da ripetere) finché gli elementi coinvolti superano il limite"""
+        total = sum(operation_count(entry["operazioni"]) for entry in (*self._undo, *self._redo))
+        for stack in (self._redo, self._undo):
+            while stack and total > self.max_operations:
+                total -= operation_count(stack.popleft()["operazioni"])
+
+    def record(self, description: str, undo_operations: list):
+        """Registra una modifica appena fatta; una nuova modifica svuota la pila da ripetere.
+
+        Restituisce False se la modifica coinvolge troppi elementi per essere annullata.
+        """
+        if not undo_operations:
+            return True
+        self._redo.clear()
+        if operation_count(undo_operations) > self.max_operations:
+            self._save()
+            return False
+        self._undo.append({
+            "descrizione": description,
+            "operazioni": undo_operations,
+            "ora": datetime.now().strftime("%H:%M:%S"),
+        })
+        self._trim()
+        self._save()
+        return True
+
+    def _move(self, source: deque, target: deque, data: dict, changes):
+        entry = source.pop()
+        inverse = apply_operations(data, entry["operazioni"], changes)
+        if inverse:
+            target.append(dict(entry, operazioni=inverse))
+        self._save()
+        return entry["descrizione"]
+
+    def undo(self, data: dict, changes):
+        """Annulla l'ultima modifica; restituisce la sua descrizione"""
+        return self._move(self._undo, self._redo, data, changes)
+
+    def redo(self, data: dict, changes):
+        """Ripete l'ultima modifica annullata; restituisce la sua descrizione"""
+        return self._move(self._redo, self._undo, data, changes)
+
+    def peek_undo(self):
+        return self._undo[-1] if self._undo else None
+
+    def peek_redo(self):
+        return self._redo[-1] if self._redo else None
+
+    def cities(self, redo: bool = False):
+        """Città toccate dalla prossima voce da annullare (o da ripetere), da caricare prima di applicarla"""
+        entry = self.peek_redo() if redo else self.peek_undo()
+        return sorted({op["citta"] for op in entry["operazioni"]}) if entry else []
+
+    def clear(self):
+        self._undo.clear()
+        self._redo.clear()
+        self._save()